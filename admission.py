@@ -0,0 +1,103 @@
+""" Limits the number of requests processed at once and sheds load when the server is overloaded. """
+
+from typing import *
+
+import asyncio
+import collections
+
+from metrics import metrics
+
+
+class ServerBusy(Exception):
+    """ The request is not admitted, the client should send it again after retry_after seconds. """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits at most max_in_flight requests at once. Further requests wait in the queue
+    of at most max_queued requests, each at most queue_timeout seconds, in the order
+    of arrival. Requests which do not fit into the queue or wait too long raise ServerBusy.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queued: int,
+        queue_timeout: Optional[float],
+        retry_after: float,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight: int = 0
+        self.waiters: Deque[asyncio.Future] = collections.deque()
+
+    def admit(self) -> "Admission":
+        """ Returns the context manager which admits the request and releases its place afterwards. """
+        return Admission(self)
+
+    async def acquire(self) -> None:
+        """ Takes the place for the request, waiting in the queue when all places are taken. """
+
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self.in_flight += 1
+            metrics.incr("admission.admitted")
+            return
+        if len(self.waiters) >= self.max_queued:
+            metrics.incr("admission.rejected_queue_full")
+            raise ServerBusy("The queue of requests is full.", self.retry_after)
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The place was handed over just before the failure, so it is passed on
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.incr("admission.rejected_queue_timeout")
+                raise ServerBusy("The request waited too long.", self.retry_after)
+            raise
+        metrics.incr("admission.admitted")
+
+    def release(self) -> None:
+        """ Hands the place over to the first waiting request or frees it. """
+
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, float]:
+        """ Returns the current load and the numbers of admitted and rejected requests. """
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "admitted": metrics.get("admission.admitted"),
+            "rejected_queue_full": metrics.get("admission.rejected_queue_full"),
+            "rejected_queue_timeout": metrics.get("admission.rejected_queue_timeout"),
+        }
+
+
+class Admission:
+    """ Async context manager admitting the request by AdmissionController. """
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    async def __aenter__(self) -> None:
+        await self.controller.acquire()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.controller.release()
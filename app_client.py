@@ -10,10 +10,13 @@ PORT = 12345
 
 if __name__ == "__main__":
     async_client = AsyncClient(HOST, PORT)
-    for message in sys.stdin:
-        header, answer = async_client.run_client(
-            request=message, content_type="text", encoding="utf-8"
-        )
-        print("header:", header)
-        print("answer:", answer)
-    async_client.close()
+    try:
+        # All lines are sent over the one connection kept open by the client
+        for message in sys.stdin:
+            header, answer = async_client.run_client(
+                request=message, content_type="text", encoding="utf-8"
+            )
+            print("header:", header)
+            print("answer:", answer)
+    finally:
+        async_client.close()
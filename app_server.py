@@ -2,11 +2,15 @@
 
 from async_server import AsyncServer
 from settings import SERVER, DATABASES
+from supervisor import Supervisor
 
 
 if __name__ == "__main__":
-    async_server = AsyncServer(
-        SERVER["HOST"], SERVER["PORT"], db_config=DATABASES["default"]
-    )
-    server = async_server.run_server()
-    async_server.close(server)
+    if SERVER["WORKERS"] > 1:
+        Supervisor(SERVER["HOST"], SERVER["PORT"], db_config=DATABASES["default"]).run()
+    else:
+        async_server = AsyncServer(
+            SERVER["HOST"], SERVER["PORT"], db_config=DATABASES["default"]
+        )
+        server = async_server.run_server()
+        async_server.close(server, SERVER["SHUTDOWN_GRACE_PERIOD"])
@@ -3,21 +3,49 @@
 from typing import *
 
 import asyncio
+import itertools
 
-from message_stream import MessageStream
+from latency import LatencyInjector
+from message_stream import MessageStream, ConnectionClosed, FrameTooLarge
 
 
 class AsyncClient:
-    """ Initializes and manages the client. """
+    """ Initializes and manages the client. One connection is reused for all requests. """
 
     def __init__(
         self,
         host: str,
         port: int,
         loop: asyncio.AbstractEventLoop = None,
+        idle_timeout: Optional[float] = 30.0,
+        latency: Optional[LatencyInjector] = None,
+        stream_queue_size: int = 16,
+        accept: Optional[List[str]] = None,
+        accept_compression: Optional[List[str]] = None,
+        max_content_size: Optional[int] = None,
+        deadline: Optional[float] = None,
     ):
         self.host = host
         self.port = port
+        self.idle_timeout = idle_timeout
+        self.latency = latency
+        self.message: Optional[MessageStream] = None
+        self.receiver: Optional[asyncio.Future] = None
+        self.connect_lock: Optional[asyncio.Lock] = None
+        self.pending: Dict[int, asyncio.Future] = dict()
+        # Chunks of streamed answers waiting to be consumed, the receiver waits when the queue is full
+        self.streams: Dict[int, asyncio.Queue] = dict()
+        self.stream_queue_size = stream_queue_size
+        # Content types of answers accepted besides json, e.g. ["records"]
+        self.accept = accept
+        # Compression methods of answers accepted by the client, e.g. ["zstd", "zlib"]
+        self.accept_compression = accept_compression
+        # Answers with longer content (in bytes) are rejected, None means no limit
+        self.max_content_size = max_content_size
+        # Seconds after which the server stops answering the request, None means the server default
+        self.deadline = deadline
+        self.request_ids = itertools.count(1)
+        self.last_used: float = float()
         if loop is None:
             self.loop = asyncio.get_event_loop()
         else:
@@ -44,24 +72,207 @@ class AsyncClient:
             self.handle_connection(request, content_type, encoding)
         )
 
+    def run_many(
+        self, requests: Iterable[Tuple[Union[str, bytes, Dict], str, str]]
+    ) -> List[Tuple[Dict, Union[str, Dict, bytes]]]:
+        """ Runs the event loop until answers for all requests are received. """
+        return self.loop.run_until_complete(self.send_many(requests))
+
+    async def send_many(
+        self, requests: Iterable[Tuple[Union[str, bytes, Dict], str, str]]
+    ) -> List[Tuple[Dict, Union[str, Dict, bytes]]]:
+        """
+        Sends all requests at once over the one connection. The server answers them
+        in any order, the answers are returned in the order of requests.
+        """
+        return await asyncio.gather(
+            *(self.handle_connection(*request) for request in requests)
+        )
+
     async def handle_connection(
         self, request: Union[str, bytes, Dict], content_type: str, encoding: str
     ) -> Tuple[Dict, Union[str, Dict, bytes]]:
-        """ Sends the request to the server and receives data from it. """
+        """
+        Sends the request to the server and receives data from it. When the reused connection
+        turns out to be closed by the server, sends the request once again over a new one.
+        """
 
-        reader, writer = await asyncio.open_connection(self.host, self.port)
-        message = MessageStream(reader, writer)
-        await message.send_stream(request, content_type, encoding)
+        message, reused = await self.ensure_connection()
         try:
-            header, answer = await message.receive_stream()
-        except ValueError:
-            print(f"An error occurred when receiving data from server.")
-        else:
-            return header, answer
+            return await self.exchange(message, request, content_type, encoding)
+        except ConnectionError:
+            self.drop_connection(message)
+            if not reused:
+                raise
+        message, reused = await self.ensure_connection()
+        return await self.exchange(message, request, content_type, encoding)
+
+    async def exchange(
+        self,
+        message: MessageStream,
+        request: Union[str, bytes, Dict],
+        content_type: str,
+        encoding: str,
+    ) -> Tuple[Dict, Union[str, Dict, bytes]]:
+        """ Sends the request with a new id and waits until the receiver resolves its answer. """
+
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        try:
+            await message.send_stream(
+                request, content_type, encoding, header=self.get_header(request_id)
+            )
+            header, answer = await future
+        except ValueError as e:
+            if future.done():
+                print(f"An error occurred when receiving data from server.")
+                return dict(), str()
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+        self.last_used = self.loop.time()
+        return header, answer
+
+    async def stream(
+        self,
+        request: Union[str, bytes, Dict],
+        content_type: str,
+        encoding: str,
+        chunk_size: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Sends the request asking the server to stream the answer and yields its chunks,
+        e.g. {"answer": [rows]}, as they arrive. The iterator should be consumed to the end
+        or closed with aclose(), because answers received after an unconsumed chunk wait for it.
+        """
+
+        message, reused = await self.ensure_connection()
+        request_id = next(self.request_ids)
+        queue = asyncio.Queue(maxsize=self.stream_queue_size)
+        self.streams[request_id] = queue
+        header = {**self.get_header(request_id), "stream": True}
+        if chunk_size is not None:
+            header["chunk_size"] = chunk_size
+        try:
+            await message.send_stream(request, content_type, encoding, header=header)
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                header, answer = item
+                if header.get("stream") == "end":
+                    if header.get("error"):
+                        yield answer
+                    break
+                yield answer
         finally:
-            message.close()
-        return dict(), str()
+            self.streams.pop(request_id, None)
+            while not queue.empty():
+                queue.get_nowait()
+        self.last_used = self.loop.time()
+
+    def get_header(self, request_id: int) -> Dict:
+        """ Creates the items of the request header. """
+
+        header = {"request_id": request_id}
+        if self.accept:
+            header["accept"] = list(self.accept)
+        if self.accept_compression:
+            header["accept_compression"] = list(self.accept_compression)
+        if self.deadline is not None:
+            header["deadline"] = self.deadline
+        return header
+
+    async def receive_answers(self, message: MessageStream) -> None:
+        """ Reads answers from the connection and resolves futures waiting for them. """
+
+        try:
+            while True:
+                header, answer = await message.receive_stream()
+                if message.is_close_frame(header):
+                    raise ConnectionClosed("The server closed the connection.")
+                if header.get("error") == "frame_too_large" and (
+                    "request_id" not in header
+                ):
+                    raise FrameTooLarge(answer["answer"])
+                queue = self.streams.get(header.get("request_id"))
+                if queue is not None:
+                    await queue.put((header, answer))
+                    continue
+                future = self.pending.get(header.get("request_id"))
+                if future is not None and not future.done():
+                    future.set_result((header, answer))
+        except (ConnectionError, ValueError) as e:
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(e)
+            for queue in list(self.streams.values()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(e)
+            if self.message is message:
+                self.receiver = None
+            self.drop_connection(message)
+
+    async def ensure_connection(self) -> Tuple[MessageStream, bool]:
+        """ Opens the connection if there is no usable one. Returns it and whether it is reused. """
+
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.message is not None:
+                idle = self.loop.time() - self.last_used
+                expired = (
+                    not (self.pending or self.streams)
+                    and self.idle_timeout is not None
+                    and idle > self.idle_timeout
+                )
+                if not (self.message.is_closing or expired):
+                    return self.message, True
+                await self.disconnect()
+            await self.connect()
+            return self.message, False
+
+    async def connect(self) -> None:
+        """ Opens the connection with the server and starts receiving answers from it. """
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.message = MessageStream(
+            reader, writer, self.latency, max_content_size=self.max_content_size
+        )
+        self.receiver = self.loop.create_task(self.receive_answers(self.message))
+        self.last_used = self.loop.time()
+
+    async def disconnect(self) -> None:
+        """ Waits for pending answers, sends the close frame to the server and closes the connection. """
+
+        message = self.message
+        if message is None:
+            return
+        if self.pending:
+            await asyncio.wait(list(self.pending.values()))
+        try:
+            await message.send_close()
+        except ConnectionError:
+            pass
+        self.drop_connection(message)
+
+    def drop_connection(self, message: Optional[MessageStream] = None) -> None:
+        """ Closes the connection without notifying the server. """
+
+        if message is None:
+            message = self.message
+        if message is None:
+            return
+        if self.message is message:
+            self.message = None
+            if self.receiver is not None:
+                self.receiver.cancel()
+                self.receiver = None
+        message.close()
 
     def close(self) -> None:
-        """ Closing the event loop. """
+        """ Closing the connection and the event loop. """
+        self.loop.run_until_complete(self.disconnect())
         self.loop.close()
@@ -3,10 +3,24 @@
 from typing import *
 
 import asyncio
+import collections
 
-from message_stream import MessageStream
+import compression
+from admission import AdmissionController, ServerBusy
+from latency import LatencyInjector
+from metrics import metrics
+from message_stream import (
+    MessageStream,
+    ConnectionClosed,
+    FrameTooLarge,
+    InvalidHeader,
+    ReadTimeout,
+    RECORDS_CONTENT_TYPE,
+)
+from protocol_server import MessageProtocol
 from request_manager import RequestManager
-from settings import DATABASES
+from result_rows import Rows
+from settings import DATABASES, SERVER, LATENCY
 
 
 class AsyncServer:
@@ -18,9 +32,58 @@ class AsyncServer:
         port: int,
         loop: asyncio.AbstractEventLoop = None,
         db_config: Dict = DATABASES["default"],
+        idle_timeout: Optional[float] = SERVER["IDLE_TIMEOUT"],
+        latency: Optional[LatencyInjector] = LatencyInjector.from_config(LATENCY),
+        chunk_size: int = SERVER["STREAM_CHUNK_SIZE"],
+        max_chunk_size: int = SERVER["MAX_STREAM_CHUNK_SIZE"],
+        compression_methods: List[str] = SERVER["COMPRESSION"],
+        compression_threshold: int = SERVER["COMPRESSION_THRESHOLD"],
+        max_header_size: Optional[int] = SERVER["MAX_HEADER_SIZE"],
+        max_content_size: Optional[int] = SERVER["MAX_CONTENT_SIZE"],
+        transport: str = SERVER["TRANSPORT"],
+        reuse_port: bool = False,
+        max_in_flight: int = SERVER["MAX_IN_FLIGHT"],
+        max_queued: int = SERVER["MAX_QUEUED"],
+        queue_timeout: Optional[float] = SERVER["QUEUE_TIMEOUT"],
+        retry_after: float = SERVER["RETRY_AFTER"],
+        request_timeout: Optional[float] = SERVER["REQUEST_TIMEOUT"],
+        header_timeout: Optional[float] = SERVER["HEADER_TIMEOUT"],
+        body_timeout: Optional[float] = SERVER["BODY_TIMEOUT"],
+        min_transfer_rate: Optional[float] = SERVER["MIN_TRANSFER_RATE"],
+        max_connections_per_peer: Optional[int] = SERVER["MAX_CONNECTIONS_PER_PEER"],
     ):
         self.host = host
         self.port = port
+        self.idle_timeout = idle_timeout
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.compression_methods = compression_methods
+        self.compression_threshold = compression_threshold
+        self.max_header_size = max_header_size
+        self.max_content_size = max_content_size
+        if transport not in ("streams", "protocol"):
+            raise ValueError(
+                "Wrong transport! Available transports: streams, protocol."
+            )
+        self.transport = transport
+        # Allows many processes to listen on the same port
+        self.reuse_port = reuse_port
+        # Number of requests being answered, awaited when the server shuts down
+        self.active_requests: int = 0
+        # Seconds after which answering the request is cancelled, None means no limit
+        self.request_timeout = request_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.min_transfer_rate = min_transfer_rate
+        self.max_connections_per_peer = max_connections_per_peer
+        # Numbers of open connections by the host address of the client
+        self.peer_connections: DefaultDict[str, int] = collections.defaultdict(int)
+        # Open connections (MessageStream or MessageProtocol), closed when the server shuts down
+        self.connections: Set[Any] = set()
+        self.admission = AdmissionController(
+            max_in_flight, max_queued, queue_timeout, retry_after
+        )
         self.req_man = RequestManager(db_config=db_config)
         if loop is None:
             self.loop = asyncio.get_event_loop()
@@ -38,11 +101,23 @@ class AsyncServer:
         return server
 
     async def start_server(self) -> asyncio.AbstractServer:
-        """ Starts the server. """
+        """ Creates the database pool and starts the server with the configured transport. """
 
-        server = await asyncio.start_server(
-            self.handle_connection, self.host, self.port
-        )
+        await self.req_man.start()
+        if self.transport == "protocol":
+            server = await self.loop.create_server(
+                lambda: MessageProtocol(self),
+                self.host,
+                self.port,
+                reuse_port=self.reuse_port,
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection,
+                self.host,
+                self.port,
+                reuse_port=self.reuse_port,
+            )
         addr = self.get_addr(server)
         print(f"Serving on {addr}")
         return server
@@ -55,26 +130,378 @@ class AsyncServer:
     async def handle_connection(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ) -> None:
-        """ Receives messages from the clients and sends answers to them. """
+        """
+        Receives messages from the client and answers them over the same connection until
+        the client sends the close frame, disconnects or stays idle longer than idle_timeout.
+        Requests are processed concurrently and every answer is sent as soon as it is ready.
+        Connections of clients which send messages too slowly are closed.
+        """
 
         addr = writer.get_extra_info("peername")
-        message = MessageStream(reader, writer)
+        if not self.accept_peer(addr):
+            print(f"Too many connections from address: {addr}.")
+            writer.close()
+            return
+        message = MessageStream(
+            reader,
+            writer,
+            self.latency,
+            self.compression_threshold,
+            self.max_header_size,
+            self.max_content_size,
+            self.header_timeout,
+            self.body_timeout,
+            self.min_transfer_rate,
+        )
+        tasks: Set[asyncio.Future] = set()
+        graceful = False
+        self.connections.add(message)
         try:
-            header, request = await message.receive_stream()
-        except (ConnectionResetError, ValueError) as e:
+            while True:
+                try:
+                    header, request = await message.receive_stream(self.idle_timeout)
+                except FrameTooLarge as e:
+                    print(f"Rejecting the request from address: {addr}. {e}")
+                    await self.reject_frame(message, e)
+                    graceful = True
+                    break
+                except InvalidHeader as e:
+                    print(f"Rejecting the request from address: {addr}. {e}")
+                    await self.reject_header(message, e)
+                    graceful = True
+                    break
+                except asyncio.TimeoutError:
+                    if tasks:
+                        continue
+                    print(f"Closing the idle connection with address: {addr}.")
+                    self.count_closed_connection("idle_timeout")
+                    await message.send_close()
+                    break
+                if message.is_close_frame(header):
+                    graceful = True
+                    break
+                task = asyncio.ensure_future(self.respond(message, header, request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionClosed:
+            pass
+        except ReadTimeout as e:
+            print(f"Closing the connection with address: {addr}. {e}")
+            self.count_closed_connection(e.rule)
+        except (ConnectionError, ValueError) as e:
             print(f"An error occurred: {e} when address: {addr} connect.")
-        else:
-            response = await self.get_answer_from_db(request)
-            await message.send_stream(response, "json", "utf-8")
         finally:
+            if graceful and tasks:
+                await asyncio.wait(tasks)
+            for task in tasks:
+                task.cancel()
             message.close()
+            self.connections.discard(message)
+            self.release_peer(addr)
+
+    @staticmethod
+    def get_peer_host(addr: Any) -> Any:
+        return addr[0] if isinstance(addr, tuple) else addr
+
+    def accept_peer(self, addr: Any) -> bool:
+        """ Counts the new connection of the client unless it has max_connections_per_peer already. """
+
+        host = self.get_peer_host(addr)
+        if (
+            self.max_connections_per_peer is not None
+            and self.peer_connections[host] >= self.max_connections_per_peer
+        ):
+            self.count_closed_connection("max_connections_per_peer")
+            return False
+        self.peer_connections[host] += 1
+        return True
+
+    def release_peer(self, addr: Any) -> None:
+        host = self.get_peer_host(addr)
+        self.peer_connections[host] -= 1
+        if not self.peer_connections[host]:
+            del self.peer_connections[host]
+
+    @staticmethod
+    def count_closed_connection(rule: str) -> None:
+        """ Counts connections closed by the rule, e.g. idle_timeout or min_transfer_rate. """
+        metrics.incr(f"connections.closed_by_{rule}")
+
+    async def respond(
+        self, message: MessageStream, header: Dict, request: Union[str, Dict, bytes]
+    ) -> None:
+        """
+        Answers one request when the admission controller admits it, otherwise answers
+        that the server is busy. The answer carries the request_id of the request.
+        Cancelling the task (e.g. when the client disconnects) cancels the database query.
+        """
+
+        self.active_requests += 1
+        deadline = self.get_deadline(header)
+        try:
+            async with self.admission.admit():
+                if header.get("stream"):
+                    await self.respond_stream(message, header, request, deadline)
+                else:
+                    await self.respond_single(message, header, request, deadline)
+        except ServerBusy as e:
+            await self.reject_busy(message, header, e)
+        finally:
+            self.active_requests -= 1
+
+    async def respond_single(
+        self,
+        message: MessageStream,
+        header: Dict,
+        request: Union[str, Dict, bytes],
+        deadline: Optional[float] = None,
+    ) -> None:
+        """ Answers the request with one message. The query is cancelled at the deadline. """
+
+        response_header = self.get_response_header(header)
+        try:
+            response = await asyncio.wait_for(
+                self.get_answer_from_db(request), self.get_remaining_time(deadline)
+            )
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            response = self.timeout_response(request, response_header)
+        except Exception as e:
+            print(f"An error occurred: {e} when processing request: {request}.")
+            response = self.req_man.give_response("The request can not be processed.")
+            response_header["error"] = "request_failed"
+        try:
+            try:
+                await self.send_answer(message, header, response, response_header)
+            except (TypeError, ValueError) as e:
+                print(
+                    f"An error occurred: {e} when sending answer to request: {request}."
+                )
+                response = self.req_man.give_response("The answer can not be encoded.")
+                response_header["error"] = "request_failed"
+                await self.send_answer(message, header, response, response_header)
+        except ConnectionError:
+            pass
+
+    def get_deadline(self, header: Dict) -> Optional[float]:
+        """
+        Gets the event loop time when answering the request is cancelled. The client can
+        shorten the default request_timeout with the deadline header item (in seconds).
+        """
+
+        timeout = self.request_timeout
+        requested = header.get("deadline")
+        if isinstance(requested, (int, float)) and requested > 0:
+            timeout = requested if timeout is None else min(timeout, requested)
+        if timeout is None:
+            return None
+        return self.loop.time() + timeout
+
+    def get_remaining_time(self, deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        return max(deadline - self.loop.time(), 0)
+
+    def timeout_response(
+        self, request: Union[str, Dict, bytes], response_header: Dict
+    ) -> Dict:
+        """ Marks the answer to the request which exceeded its deadline with the timeout error. """
+
+        print(f"The request: {request} exceeded its deadline.")
+        metrics.incr("requests.timeouts")
+        response_header["error"] = "timeout"
+        return self.req_man.give_response("The request exceeded its deadline.")
+
+    async def reject_busy(
+        self, message: MessageStream, header: Dict, error: ServerBusy
+    ) -> None:
+        """ Answers the request which is not admitted with the error and the time to retry after. """
+
+        response_header = self.get_response_header(header)
+        response_header["error"] = "server_busy"
+        response_header["retry_after"] = error.retry_after
+        if header.get("stream"):
+            response_header["stream"] = "end"
+        response = self.req_man.give_response(f"The server is busy. {error}")
+        try:
+            await message.send_stream(response, "json", "utf-8", header=response_header)
+        except ConnectionError:
+            pass
+
+    async def reject_frame(self, message: MessageStream, error: FrameTooLarge) -> None:
+        """
+        Answers the request which exceeds size limits with the error. Its content is not read,
+        so the connection is closed afterwards.
+        """
+
+        response_header = self.get_response_header(error.header or {})
+        response_header["error"] = "frame_too_large"
+        response_header["max_header_size"] = self.max_header_size
+        response_header["max_content_size"] = self.max_content_size
+        response = self.req_man.give_response(f"The request is too large. {error}")
+        await message.send_stream(response, "json", "utf-8", header=response_header)
+
+    async def reject_header(self, message: MessageStream, error: InvalidHeader) -> None:
+        """
+        Answers the request with the invalid header with the error. Its content can not be
+        found, so the connection is closed afterwards.
+        """
+
+        response = self.req_man.give_response(f"The request header is invalid. {error}")
+        await message.send_stream(
+            response, "json", "utf-8", header={"error": "invalid_header"}
+        )
+
+    async def respond_stream(
+        self,
+        message: MessageStream,
+        header: Dict,
+        request: Union[str, Dict, bytes],
+        deadline: Optional[float] = None,
+    ) -> None:
+        """
+        Sends the answer in chunk messages, each with at most chunk_size rows, and finishes
+        with the end message. The next chunk is fetched from the database only after
+        the previous one is drained from the socket buffer. The query is cancelled at the deadline.
+        """
+
+        response_header = self.get_response_header(header)
+        chunks = None
+        end = {"rows": 0}
+        end_header = {**response_header, "stream": "end"}
+        try:
+            chunks = self.req_man.stream(request, self.get_chunk_size(header))
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), self.get_remaining_time(deadline)
+                    )
+                except StopAsyncIteration:
+                    break
+                await self.send_answer(
+                    message, header, chunk, {**response_header, "stream": "chunk"}
+                )
+                if isinstance(chunk["answer"], (list, Rows)):
+                    end["rows"] += len(chunk["answer"])
+        except ConnectionError:
+            return
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            end = self.timeout_response(request, end_header)
+        except Exception as e:
+            print(
+                f"An error occurred: {e} when streaming answer to request: {request}."
+            )
+            end = self.req_man.give_response("The request can not be processed.")
+            end_header["error"] = "request_failed"
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+        try:
+            await self.send_answer(message, header, end, end_header)
+        except ConnectionError:
+            pass
+
+    def get_chunk_size(self, header: Dict) -> int:
+        """
+        Gets the number of rows of chunk messages. The client can choose it with the chunk_size
+        header item (at most max_chunk_size), wrong values are replaced by the default.
+        """
+
+        requested = header.get("chunk_size")
+        if type(requested) != int or requested <= 0:
+            requested = self.chunk_size
+        return min(requested, self.max_chunk_size)
+
+    async def send_answer(
+        self,
+        message: MessageStream,
+        header: Dict,
+        response: Dict,
+        response_header: Dict,
+    ) -> None:
+        """
+        Sends the answer with the content type chosen from the types accepted by the client.
+        The answer is compressed when the client accepts one of compression methods of the server.
+        """
+
+        content_type = self.get_content_type(header, response)
+        method = compression.negotiate(
+            header.get("accept_compression") or [], self.compression_methods
+        )
+        try:
+            await message.send_stream(
+                response, content_type, "utf-8", response_header, method
+            )
+        except (ValueError, TypeError):
+            # The answer can not be encoded as records, it is sent as JSON instead
+            if content_type == "json":
+                raise
+            await message.send_stream(
+                response, "json", "utf-8", response_header, method
+            )
+
+    @staticmethod
+    def get_content_type(header: Dict, response: Dict) -> str:
+        """ Chooses records when the client accepts it and the answer consists of rows, otherwise json. """
+
+        accept = header.get("accept") or []
+        if RECORDS_CONTENT_TYPE in accept and MessageStream.is_records_answer(response):
+            return RECORDS_CONTENT_TYPE
+        return "json"
+
+    @staticmethod
+    def get_response_header(header: Dict) -> Dict:
+        """ Gets the items of the request header which are sent back with the answer. """
+
+        if "request_id" in header:
+            return {"request_id": header["request_id"]}
+        return {}
 
     async def get_answer_from_db(self, request: Union[str, Dict, bytes]) -> Dict:
         """ Provides data from the database by the information specified in the request. """
         return await self.req_man.entrypoint(request)
 
-    def close(self, server: asyncio.AbstractServer) -> None:
-        """ Closing the server. """
+    def get_stats(self) -> Dict[str, Dict]:
+        """ Provides the server statistics for monitoring. """
+        return {
+            "db_pool": self.req_man.pool_stats(),
+            "db_nodes": self.req_man.node_stats(),
+            "custom_query": self.req_man.custom_query_stats(),
+            "result_cache": self.req_man.cache_stats(),
+            "single_flight": self.req_man.single_flight_stats(),
+            "movie_index": self.req_man.index_stats(),
+            "compression": compression.stats(),
+            "admission": self.admission.stats(),
+            "requests": metrics.snapshot("requests."),
+            "connections": {
+                "open": sum(self.peer_connections.values()),
+                **metrics.snapshot("connections."),
+            },
+        }
+
+    async def shutdown(
+        self, server: asyncio.AbstractServer, grace_period: float = 0.0
+    ) -> None:
+        """
+        Stops accepting connections, waits at most grace_period seconds for requests
+        in progress to be answered, closes open connections and the database pool.
+        """
+
         server.close()
-        self.loop.run_until_complete(server.wait_closed())
+        deadline = self.loop.time() + grace_period
+        while self.active_requests and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        # Since Python 3.12 wait_closed waits until all connections are closed,
+        # so keep-alive connections are closed first
+        for connection in list(self.connections):
+            connection.close()
+        await server.wait_closed()
+        await self.req_man.close()
+
+    def close(self, server: asyncio.AbstractServer, grace_period: float = 0.0) -> None:
+        """ Closing the server and the database pool. """
+        self.loop.run_until_complete(self.shutdown(server, grace_period))
         self.loop.close()
@@ -0,0 +1,115 @@
+""" Compares getting movie details with one JSON aggregating statement and with a query per part. """
+
+from typing import *
+
+import asyncio
+import time
+
+from request_manager import RequestManager
+from settings import DATABASES
+
+# Number of distinct titles looked up and number of lookups running at once
+TITLES = 500
+CONCURRENCY = 20
+
+# Queries of the parts of the details, run one by one for every movie
+PART_QUERIES = [
+    """
+    SELECT genres.name FROM movie_metadata_association association
+    INNER JOIN genres ON genres.id = association.genres
+    WHERE association.movies_metadata = $1
+    """,
+    """
+    SELECT production_companies.name FROM movie_metadata_association association
+    INNER JOIN production_companies
+    ON production_companies.id = association.production_companies
+    WHERE association.movies_metadata = $1
+    """,
+    """
+    SELECT countries.name FROM movie_metadata_association association
+    INNER JOIN countries ON countries.id = association.countries
+    WHERE association.movies_metadata = $1
+    """,
+    """
+    SELECT languages.name FROM movie_metadata_association association
+    INNER JOIN languages ON languages.id = association.languages
+    WHERE association.movies_metadata = $1
+    """,
+    "SELECT keywords FROM keywords WHERE movie_id = $1",
+]
+CAST_QUERY = """
+SELECT actors.name, characters.character FROM characters
+INNER JOIN actors ON actors.id = characters.actor_id
+WHERE characters.movie_id = $1
+ORDER BY characters."order" LIMIT $2
+"""
+CREW_QUERY = """
+SELECT crew_members.name, crew.job, crew.department FROM crew
+INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+WHERE crew.movie_id = $1 AND crew.job = ANY($2::text[])
+"""
+
+
+async def get_titles(req_man: RequestManager) -> List[str]:
+    async with req_man.db.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT title FROM movies_metadata ORDER BY id LIMIT $1", TITLES
+        )
+    return [row["title"] for row in rows]
+
+
+async def composed_lookup(req_man: RequestManager, title: str) -> None:
+    """ Looks up the title with its category and queries every part of every movie. """
+
+    movies = await req_man.query_db(req_man.db, req_man.get_by_title(title))
+    async with req_man.db.acquire() as conn:
+        for movie in movies:
+            for query in PART_QUERIES:
+                await conn.fetch(query, movie["id"])
+            await conn.fetch(CAST_QUERY, movie["id"], req_man.details_cast_size)
+            await conn.fetch(CREW_QUERY, movie["id"], req_man.details_crew_jobs)
+
+
+async def details_lookup(req_man: RequestManager, title: str) -> None:
+    await req_man.query_db(req_man.db, req_man.get_details(title))
+
+
+async def measure(
+    req_man: RequestManager, lookup: Callable, titles: List[str]
+) -> float:
+    """ Returns lookups per second of looking up all titles by CONCURRENCY workers. """
+
+    queue = list(titles)
+
+    async def worker() -> None:
+        while queue:
+            await lookup(req_man, queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return len(titles) / (time.perf_counter() - start)
+
+
+async def run() -> None:
+    req_man = RequestManager(db_config=DATABASES["default"])
+    await req_man.start()
+    try:
+        titles = await get_titles(req_man)
+        print(f"{'lookup':>9} {'lookups/s':>10}")
+        for label, lookup in [
+            ("composed", composed_lookup),
+            ("details", details_lookup),
+        ]:
+            # The first round warms up connections of the pool
+            await measure(req_man, lookup, titles[:CONCURRENCY])
+            print(f"{label:>9} {await measure(req_man, lookup, titles):>10.1f}")
+    finally:
+        await req_man.close()
+
+
+def main() -> None:
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+""" Compares encoding and decoding query results as json and as records. """
+
+from typing import *
+
+import json
+import random
+import time
+
+from record_codec import encode_records, decode_records
+
+ROWS = [100, 10000, 100000]
+REPEAT = 3
+
+
+def create_records(count: int) -> List[Dict]:
+    """ Creates rows similar to the rows of movies_metadata table. """
+
+    generator = random.Random(0)
+    return [
+        {
+            "id": i,
+            "adult": False,
+            "budget": generator.choice([None, generator.randint(0, 10 ** 8)]),
+            "original_language": "en",
+            "title": f"Movie title {i}",
+            "overview": "Lorem ipsum dolor sit amet " * generator.randint(1, 10),
+            "popularity": generator.random() * 100,
+            "release_date": "10-Sep-1994",
+            "runtime": generator.randint(60, 200),
+            "vote_average": generator.random() * 10,
+            "vote_count": generator.randint(0, 10000),
+        }
+        for i in range(count)
+    ]
+
+
+def measure(func: Callable, arg: Any) -> Tuple[float, Any]:
+    """ Returns the best time of REPEAT calls and the result of the function. """
+
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    print(
+        f"{'rows':>7} {'format':>8} {'bytes':>11} {'encode ms':>10} {'decode ms':>10}"
+    )
+    for count in ROWS:
+        records = create_records(count)
+        formats = [
+            ("json", lambda data: json.dumps(data).encode("utf-8"), json.loads),
+            ("records", encode_records, decode_records),
+        ]
+        for name, encode, decode in formats:
+            encode_time, encoded = measure(encode, records)
+            decode_time, decoded = measure(decode, encoded)
+            assert decoded == records
+            print(
+                f"{count:>7} {name:>8} {len(encoded):>11} {encode_time * 1000:>10.1f}"
+                f" {decode_time * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+""" Measures the throughput of sending and receiving MessageStream frames over a local socket. """
+
+from typing import *
+
+import asyncio
+import contextlib
+import os
+import socket
+import sys
+import time
+
+from message_stream import MessageStream
+
+# Payload size in bytes and number of frames sent with it
+CASES = [
+    (1024, 10000),
+    (1024 ** 2, 200),
+    (100 * 1024 ** 2, 3),
+]
+
+
+async def open_stream_pair() -> Tuple[MessageStream, MessageStream]:
+    sender_sock, receiver_sock = socket.socketpair()
+    sender_reader, sender_writer = await asyncio.open_connection(sock=sender_sock)
+    receiver_reader, receiver_writer = await asyncio.open_connection(sock=receiver_sock)
+    return (
+        MessageStream(sender_reader, sender_writer),
+        MessageStream(receiver_reader, receiver_writer),
+    )
+
+
+async def send_frames(stream: MessageStream, payload: bytes, frames: int) -> None:
+    for _ in range(frames):
+        await stream.send_stream(payload, "binary", "utf-8")
+
+
+async def receive_frames(stream: MessageStream, frames: int) -> None:
+    for _ in range(frames):
+        await stream.receive_stream()
+
+
+async def measure(size: int, frames: int) -> float:
+    """ Returns the number of seconds of transferring frames with the payload of the size. """
+
+    sender, receiver = await open_stream_pair()
+    payload = os.urandom(size)
+    start = time.perf_counter()
+    await asyncio.gather(
+        send_frames(sender, payload, frames), receive_frames(receiver, frames)
+    )
+    elapsed = time.perf_counter() - start
+    sender.close()
+    receiver.close()
+    return elapsed
+
+
+def main() -> None:
+    loop = asyncio.get_event_loop()
+    print(f"{'payload':>10} {'frames':>7} {'frames/s':>12} {'MB/s':>10}")
+    for size, frames in CASES:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            elapsed = loop.run_until_complete(measure(size, frames))
+        print(
+            f"{size:>10} {frames:>7} {frames / elapsed:>12.1f}"
+            f" {size * frames / elapsed / 1024 ** 2:>10.1f}",
+            file=sys.stdout,
+        )
+
+
+if __name__ == "__main__":
+    main()
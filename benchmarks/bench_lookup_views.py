@@ -0,0 +1,99 @@
+""" Compares latency of person lookups joining the tables and reading the lookup views. """
+
+from typing import *
+
+import asyncio
+import time
+
+from request_manager import RequestManager
+from settings import DATABASES
+
+# Number of distinct names looked up per category
+NAMES = 1000
+
+# Statements of the categories joining the tables, as before the lookup views
+JOIN_STATEMENTS = {
+    "actor": """
+    SELECT characters.id AS page_key, title FROM movies_metadata movies
+    INNER JOIN characters ON characters.movie_id = movies.id
+    INNER JOIN actors ON actors.id = characters.actor_id
+    WHERE actors.name = $1
+    AND characters.id > $2::bigint
+    ORDER BY characters.id LIMIT $3
+    """,
+    "director": """
+    SELECT crew.id AS page_key, title FROM movies_metadata movies
+    INNER JOIN crew ON crew.movie_id = movies.id
+    INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+    WHERE crew.job = 'Director'
+    AND crew_members.name = $1
+    AND crew.id > $2::bigint
+    ORDER BY crew.id LIMIT $3
+    """,
+    "screenplay": """
+    SELECT crew.id AS page_key, title FROM movies_metadata movies
+    INNER JOIN crew ON crew.movie_id = movies.id
+    INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+    WHERE crew.department = 'Writing'
+    AND crew_members.name = $1
+    AND crew.id > $2::bigint
+    ORDER BY crew.id LIMIT $3
+    """,
+}
+NAME_QUERIES = {
+    "actor": "SELECT DISTINCT name FROM actor_titles LIMIT $1",
+    "director": "SELECT DISTINCT name FROM crew_titles WHERE role = 'director' LIMIT $1",
+    "screenplay": "SELECT DISTINCT name FROM crew_titles WHERE role = 'screenplay' LIMIT $1",
+}
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    return sorted(latencies)[int(fraction * (len(latencies) - 1))]
+
+
+async def measure(statement: Any, names: List[str], page_size: int) -> List[float]:
+    """ Returns latencies of looking up the first page of every name one by one. """
+
+    latencies = []
+    for name in names:
+        start = time.perf_counter()
+        await statement.fetch(name, -(2 ** 63), page_size + 1)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run() -> None:
+    req_man = RequestManager(db_config=DATABASES["default"])
+    await req_man.start()
+    try:
+        print(f"{'category':>10} {'source':>6} {'p50 ms':>7} {'p99 ms':>7}")
+        async with req_man.db.acquire() as conn:
+            for category, join_statement in JOIN_STATEMENTS.items():
+                names = [
+                    row["name"]
+                    for row in await conn.fetch(NAME_QUERIES[category], NAMES)
+                ]
+                for source, statement in [
+                    ("join", await conn.prepare(join_statement)),
+                    ("view", conn.statements[category]),
+                ]:
+                    # The first round warms up the cache of the database
+                    await measure(statement, names, req_man.default_page_size)
+                    latencies = await measure(
+                        statement, names, req_man.default_page_size
+                    )
+                    print(
+                        f"{category:>10} {source:>6}"
+                        f" {percentile(latencies, 0.5) * 1000:>7.2f}"
+                        f" {percentile(latencies, 0.99) * 1000:>7.2f}"
+                    )
+    finally:
+        await req_man.close()
+
+
+def main() -> None:
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == "__main__":
+    main()
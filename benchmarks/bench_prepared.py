@@ -0,0 +1,74 @@
+""" Compares lookups per second of interpolated SQL and of statements prepared on pooled connections. """
+
+from typing import *
+
+import asyncio
+import time
+
+from request_manager import RequestManager
+from settings import DATABASES
+
+# Number of distinct names looked up and number of lookups running at once
+NAMES = 1000
+CONCURRENCY = 20
+
+
+def interpolate(query: str, value: str) -> str:
+    """ Builds SQL the way the categories did before prepared statements. """
+    return query.replace("$1", "'%s'" % value.replace("'", "''"))
+
+
+async def get_names(req_man: RequestManager) -> List[str]:
+    async with req_man.db.acquire() as conn:
+        rows = await conn.fetch("SELECT name FROM actors ORDER BY id LIMIT $1", NAMES)
+    return [row["name"] for row in rows]
+
+
+async def interpolated_lookup(req_man: RequestManager, name: str) -> None:
+    async with req_man.db.acquire() as conn:
+        async with conn.transaction():
+            async for _ in conn.cursor(interpolate(req_man.statements["actor"], name)):
+                pass
+
+
+async def prepared_lookup(req_man: RequestManager, name: str) -> None:
+    await req_man.query_db(req_man.db, req_man.get_by_actor(name))
+
+
+async def measure(req_man: RequestManager, lookup: Callable, names: List[str]) -> float:
+    """ Returns lookups per second of looking up all names by CONCURRENCY workers. """
+
+    queue = list(names)
+
+    async def worker() -> None:
+        while queue:
+            await lookup(req_man, queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return len(names) / (time.perf_counter() - start)
+
+
+async def run() -> None:
+    req_man = RequestManager(db_config=DATABASES["default"])
+    await req_man.start()
+    try:
+        names = await get_names(req_man)
+        print(f"{'lookup':>13} {'lookups/s':>10}")
+        for label, lookup in [
+            ("interpolated", interpolated_lookup),
+            ("prepared", prepared_lookup),
+        ]:
+            # The first round warms up connections of the pool
+            await measure(req_man, lookup, names[:CONCURRENCY])
+            print(f"{label:>13} {await measure(req_man, lookup, names):>10.1f}")
+    finally:
+        await req_man.close()
+
+
+def main() -> None:
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+""" Compares converting query results row by row and once per result set. """
+
+from typing import *
+
+import datetime
+import json
+import random
+import time
+
+from record_codec import encode_records, encode_rows
+from result_rows import convert_records, to_json
+
+ROWS = 100000
+REPEAT = 3
+COLUMNS = (
+    "id",
+    "adult",
+    "budget",
+    "original_language",
+    "title",
+    "overview",
+    "popularity",
+    "release_date",
+    "runtime",
+    "vote_average",
+    "vote_count",
+)
+POSITIONS = {name: position for position, name in enumerate(COLUMNS)}
+
+
+class Record(tuple):
+    """ Imitates asyncpg.Record: iterating gives values, keys() gives column names. """
+
+    def keys(self) -> Tuple[str, ...]:
+        return COLUMNS
+
+    def __getitem__(self, key: Union[str, int]) -> Any:
+        if isinstance(key, str):
+            key = POSITIONS[key]
+        return super().__getitem__(key)
+
+
+def create_records(count: int) -> List[Record]:
+    """ Creates rows similar to the rows of movies_metadata table. """
+
+    generator = random.Random(0)
+    first_day = datetime.date(1950, 1, 1)
+    return [
+        Record(
+            (
+                i,
+                False,
+                generator.choice([None, generator.randint(0, 10 ** 8)]),
+                "en",
+                f"Movie title {i}",
+                "Lorem ipsum dolor sit amet " * generator.randint(1, 10),
+                generator.random() * 100,
+                first_day + datetime.timedelta(days=generator.randrange(25000)),
+                generator.randint(60, 200),
+                generator.random() * 10,
+                generator.randint(0, 10000),
+            )
+        )
+        for i in range(count)
+    ]
+
+
+def process_record(record: Record) -> Dict:
+    """ Converts the row the way RequestManager did before conversion plans. """
+
+    record = {**record}
+    try:
+        release_date = record["release_date"]
+    except KeyError:
+        pass
+    else:
+        record["release_date"] = release_date.strftime("%d-%b-%Y")
+    return record
+
+
+def measure(func: Callable, arg: Any) -> Tuple[float, Any]:
+    """ Returns the best time of REPEAT calls and the result of the function. """
+
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    records = create_records(ROWS)
+    paths = [
+        (
+            "per row",
+            lambda records: [process_record(record) for record in records],
+            lambda answer: json.dumps(answer).encode("utf-8"),
+            encode_records,
+        ),
+        (
+            "plan",
+            convert_records,
+            lambda answer: json.dumps(answer, default=to_json).encode("utf-8"),
+            lambda answer: encode_rows(answer.columns, answer.rows),
+        ),
+    ]
+    print(f"{'conversion':>10} {'convert ms':>11} {'+json ms':>9} {'+records ms':>12}")
+    for name, convert, encode_json, encode_binary in paths:
+        convert_time, answer = measure(convert, records)
+        json_time, _ = measure(encode_json, answer)
+        records_time, _ = measure(encode_binary, answer)
+        print(
+            f"{name:>10} {convert_time * 1000:>11.1f} {json_time * 1000:>9.1f}"
+            f" {records_time * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
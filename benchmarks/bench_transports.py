@@ -0,0 +1,95 @@
+""" Compares requests per second of the server with the streams and the protocol transport. """
+
+from typing import *
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+from async_client import AsyncClient
+from async_server import AsyncServer
+from request_manager import RequestManager
+
+HOST = "127.0.0.1"
+# Number of clients, each with its own connection, and number of requests sent by every client
+CLIENTS = 20
+REQUESTS = 1000
+ANSWER = RequestManager.give_response(
+    [{"title": "Heat", "year": 1995, "runtime": 170}] * 10
+)
+
+
+class BenchServer(AsyncServer):
+    """ Answers every request with the same rows without querying the database. """
+
+    async def get_answer_from_db(self, request: Union[str, Dict, bytes]) -> Dict:
+        return ANSWER
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def run_server(transport: str, port: int) -> None:
+    sys.stdout = open(os.devnull, "w")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = BenchServer(HOST, port, loop=loop, transport=transport)
+
+    async def start_pool() -> None:
+        # The answers do not come from the database
+        pass
+
+    server.req_man.start = start_pool
+    server.run_server()
+
+
+async def wait_for_server(port: int) -> None:
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(HOST, port)
+        except OSError:
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+
+
+async def measure(port: int) -> float:
+    """ Returns the number of seconds of answering all requests of all clients. """
+
+    await wait_for_server(port)
+    clients = [AsyncClient(HOST, port) for _ in range(CLIENTS)]
+    requests = [("title, Heat", "text", "utf-8")] * REQUESTS
+    start = time.perf_counter()
+    await asyncio.gather(*(client.send_many(requests) for client in clients))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(client.disconnect() for client in clients))
+    return elapsed
+
+
+def main() -> None:
+    loop = asyncio.get_event_loop()
+    print(f"{'transport':>10} {'requests':>9} {'requests/s':>12}")
+    for transport in ("streams", "protocol"):
+        port = get_free_port()
+        process = multiprocessing.Process(target=run_server, args=(transport, port))
+        process.start()
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                elapsed = loop.run_until_complete(measure(port))
+        finally:
+            process.terminate()
+            process.join()
+        total = CLIENTS * REQUESTS
+        print(f"{transport:>10} {total:>9} {total / elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+""" Compresses and decompresses message content. lz4 and zstd are used when they are installed. """
+
+from typing import *
+
+import time
+import zlib
+
+from metrics import metrics
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def decompress_zlib(data: bytes, max_length: int) -> bytes:
+    return zlib.decompressobj().decompress(data, max_length)
+
+
+def decompress_lz4(data: bytes, max_length: int) -> bytes:
+    return lz4.frame.LZ4FrameDecompressor().decompress(data, max_length=max_length)
+
+
+def decompress_zstd(data: bytes, max_length: int) -> bytes:
+    # The content size declared in the frame is not trusted, the output is read in chunks
+    chunks = []
+    length = 0
+    with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+        while length < max_length:
+            chunk = reader.read(max_length - length)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+    return b"".join(chunks)
+
+
+def get_compressors() -> Dict[str, Tuple[Callable, Callable, Callable]]:
+    """
+    Gets compress and decompress functions of available compression methods, and functions
+    decompressing at most max_length bytes.
+    """
+
+    compressors = {
+        "zlib": (zlib.compress, zlib.decompress, decompress_zlib),
+    }
+    if lz4 is not None:
+        compressors["lz4"] = (lz4.frame.compress, lz4.frame.decompress, decompress_lz4)
+    if zstandard is not None:
+        compressors["zstd"] = (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+            decompress_zstd,
+        )
+    return compressors
+
+
+compressors = get_compressors()
+
+
+def negotiate(accepted: Iterable[str], preferred: Iterable[str]) -> Optional[str]:
+    """ Chooses the first preferred and available method accepted by the other socket. """
+
+    accepted = set(accepted)
+    for method in preferred:
+        if method in accepted and method in compressors:
+            return method
+    return None
+
+
+def compress(data: bytes, method: str) -> bytes:
+    """ Compresses data and records the compression ratio and CPU time in metrics. """
+
+    start = time.process_time()
+    compressed = compressors[method][0](data)
+    metrics.incr("compression.cpu_seconds", time.process_time() - start)
+    metrics.incr("compression.messages")
+    metrics.incr("compression.bytes_in", len(data))
+    metrics.incr("compression.bytes_out", len(compressed))
+    return compressed
+
+
+def decompress(data: bytes, method: str, max_size: Optional[int] = None) -> bytes:
+    """
+    Decompresses data. Raises ValueError when the method is not available. When max_size
+    is given, decompressing stops after max_size + 1 bytes, so the caller can reject the data
+    before the whole content is decompressed.
+    """
+
+    try:
+        _, decompress_data, decompress_limited = compressors[method]
+    except KeyError:
+        raise ValueError(f"Unsupported content compression: {method}.")
+    start = time.process_time()
+    if max_size is not None:
+        decompressed = decompress_limited(data, max_size + 1)
+    else:
+        decompressed = decompress_data(data)
+    metrics.incr("decompression.cpu_seconds", time.process_time() - start)
+    metrics.incr("decompression.messages")
+    return decompressed
+
+
+def stats() -> Dict[str, float]:
+    """ Gets compression statistics with the ratio of compressed to uncompressed bytes. """
+
+    result = metrics.snapshot("compression.")
+    bytes_in = result.get("bytes_in", 0)
+    result["ratio"] = result.get("bytes_out", 0) / bytes_in if bytes_in else 1.0
+    result["decompression_cpu_seconds"] = metrics.get("decompression.cpu_seconds")
+    return result
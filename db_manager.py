@@ -3,17 +3,54 @@
 from typing import *
 
 from sqlalchemy.engine import Engine, Connection
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.pool import NullPool
 import logging
 import datetime
 
-from settings import DATABASES
+from settings import DATABASES, RESULT_CACHE
 import models
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Materialized views of person name to titles read by the built-in categories, with their
+# indexes. The unique index on id lets them be refreshed concurrently.
+LOOKUP_VIEWS = {
+    "actor_titles": (
+        """
+        SELECT characters.id, actors.name, movies.title FROM movies_metadata movies
+        INNER JOIN characters ON characters.movie_id = movies.id
+        INNER JOIN actors ON actors.id = characters.actor_id
+        """,
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS actor_titles_id ON actor_titles (id)",
+            "CREATE INDEX IF NOT EXISTS actor_titles_name ON actor_titles (name, id)",
+        ],
+    ),
+    "crew_titles": (
+        """
+        SELECT crew.id, crew_members.name,
+        CASE WHEN crew.job = 'Director' THEN 'director' ELSE 'screenplay' END AS role,
+        movies.title FROM movies_metadata movies
+        INNER JOIN crew ON crew.movie_id = movies.id
+        INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+        WHERE crew.job = 'Director' OR crew.department = 'Writing'
+        """,
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS crew_titles_id ON crew_titles (id)",
+            "CREATE INDEX IF NOT EXISTS crew_titles_role_name ON crew_titles (role, name, id)",
+        ],
+    ),
+}
+
+
+def create_lookup_views(conn: Connection) -> None:
+    for name, (query, indexes) in LOOKUP_VIEWS.items():
+        conn.execute(text(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}"))
+        for index in indexes:
+            conn.execute(text(index))
+
 
 class Config:
     """ Provides configuration data for connecting to the database. """
@@ -64,6 +101,7 @@ class TempDB(Config):
         with self.test_db_engine.connect() as conn:
             logging.info(f" {datetime.datetime.now()}: Creating tables.")
             models.Base.metadata.create_all(conn)
+            create_lookup_views(conn)
 
     def teardown_module(self) -> None:
         with self.default_db_engine.connect() as conn:
@@ -89,3 +127,35 @@ class DBManager(Config):
         with self.default_db_engine.connect() as conn:
             logging.info(f" {datetime.datetime.now()}: Creating tables.")
             models.Base.metadata.create_all(conn)
+            create_lookup_views(conn)
+
+    def refresh_lookup_views(self) -> None:
+        """ Refreshes lookup views with the uploaded data. Readers are not blocked meanwhile. """
+
+        engine = self.default_db_engine.execution_options(isolation_level="AUTOCOMMIT")
+        with engine.connect() as conn:
+            for name in LOOKUP_VIEWS:
+                logging.info(f" {datetime.datetime.now()}: Refreshing {name}.")
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+
+    def bump_data_version(self) -> int:
+        """
+        Increases the data version and notifies running servers about it,
+        so they drop answers cached from the previous data.
+        """
+
+        with self.default_db_engine.begin() as conn:
+            version = conn.execute(
+                text(
+                    "INSERT INTO data_version (id, version) VALUES (1, 1) "
+                    "ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1 "
+                    "RETURNING version"
+                )
+            ).scalar()
+            conn.execute(
+                text("SELECT pg_notify(:channel, :version)"),
+                channel=RESULT_CACHE["NOTIFY_CHANNEL"],
+                version=str(version),
+            )
+        logging.info(f" {datetime.datetime.now()}: Data version bumped to {version}.")
+        return version
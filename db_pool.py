@@ -0,0 +1,145 @@
+""" Provides the long-lived database connection pool shared by all requests. """
+
+from typing import *
+
+import asyncio
+import json
+
+import asyncpg
+
+from settings import DB_POOL
+
+
+class PreparedConnection(asyncpg.Connection):
+    """ Connection keeping statements prepared once, when the connection is set up. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = dict()
+
+    async def prepare_statements(self, statements: Dict[str, str]) -> None:
+        for name, query in statements.items():
+            self.statements[name] = await self.prepare(query)
+
+
+class DBPool:
+    """ Creates the asyncpg pool once, hands out its connections and keeps usage statistics. """
+
+    def __init__(
+        self,
+        dsn: str,
+        pool_config: Dict = DB_POOL,
+        statements: Optional[Dict[str, str]] = None,
+    ):
+        self.dsn = dsn
+        # Statements prepared on every connection of the pool, by their names
+        self.statements = statements or dict()
+        self.min_size = pool_config["MIN_SIZE"]
+        self.max_size = pool_config["MAX_SIZE"]
+        self.max_queries = pool_config["MAX_QUERIES"]
+        self.max_inactive_connection_lifetime = pool_config[
+            "MAX_INACTIVE_CONNECTION_LIFETIME"
+        ]
+        self.acquire_timeout = pool_config["ACQUIRE_TIMEOUT"]
+        self.pool: Optional[asyncpg.pool.Pool] = None
+        self.start_lock: Optional[asyncio.Lock] = None
+        self.in_use: int = 0
+        self.waiting: int = 0
+        self.acquire_timeouts: int = 0
+
+    @property
+    def started(self) -> bool:
+        return self.pool is not None
+
+    async def start(self) -> None:
+        """ Creates the pool. Calling it again when the pool exists does nothing. """
+
+        if self.start_lock is None:
+            self.start_lock = asyncio.Lock()
+        async with self.start_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_queries=self.max_queries,
+                    max_inactive_connection_lifetime=self.max_inactive_connection_lifetime,
+                    connection_class=PreparedConnection,
+                    init=self.init_connection,
+                )
+
+    async def init_connection(self, conn: PreparedConnection) -> None:
+        """ Decodes JSON values and prepares statements on the new connection of the pool. """
+
+        await conn.set_type_codec(
+            "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+        )
+        await conn.prepare_statements(self.statements)
+
+    async def close(self) -> None:
+        """ Closes all connections of the pool. """
+
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            await pool.close()
+
+    def acquire(self) -> "PoolConnection":
+        """ Returns the context manager which acquires the connection from the pool. """
+        return PoolConnection(self)
+
+    async def acquire_connection(self) -> asyncpg.Connection:
+        """ Waits for a free connection at most acquire_timeout seconds. """
+
+        if self.pool is None:
+            raise RuntimeError("The database pool is not started.")
+        self.waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        return conn
+
+    async def release_connection(self, conn: asyncpg.Connection) -> None:
+        """ Gives the connection back to the pool. """
+
+        self.in_use -= 1
+        if self.pool is not None:
+            await self.pool.release(conn)
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns the pool usage statistics for monitoring. """
+
+        if self.pool is None:
+            size = idle = 0
+        else:
+            size = self.pool.get_size()
+            idle = self.pool.get_idle_size()
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": size,
+            "in_use": self.in_use,
+            "idle": idle,
+            "waiters": self.waiting,
+            "acquire_timeouts": self.acquire_timeouts,
+        }
+
+
+class PoolConnection:
+    """ Async context manager acquiring the connection from DBPool and releasing it back. """
+
+    def __init__(self, db_pool: DBPool):
+        self.db_pool = db_pool
+        self.conn: Optional[asyncpg.Connection] = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.conn = await self.db_pool.acquire_connection()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        conn, self.conn = self.conn, None
+        await self.db_pool.release_connection(conn)
@@ -0,0 +1,239 @@
+""" Routes queries between the primary database and its read replicas. """
+
+from typing import *
+
+import asyncio
+import time
+
+import asyncpg
+
+from db_pool import DBPool
+from settings import DB_ROUTER
+
+# Errors telling that the node, not the query, failed
+NODE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+)
+
+# Seconds the replica is behind the primary, 0 when it replayed everything it received
+LAG_QUERY = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class DBNode:
+    """ Pool of one database server with its load, latency and error statistics. """
+
+    def __init__(self, name: str, pool: DBPool, replica: bool):
+        self.name = name
+        self.pool = pool
+        self.replica = replica
+        self.outstanding: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.latency_total: float = 0.0
+        # Errors since the last successful request, too many of them eject the node
+        self.consecutive_errors: int = 0
+        # Monotonic time until which the node gets no requests
+        self.ejected_until: float = 0.0
+        self.ejections: int = 0
+        self.lag: Optional[float] = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+    def eject(self, duration: float, reason: str) -> None:
+        if not self.ejected:
+            print(f"Ejecting the database node {self.name}. {reason}")
+            self.ejections += 1
+        self.ejected_until = time.monotonic() + duration
+
+    def restore(self) -> None:
+        if self.ejected:
+            print(f"Restoring the database node {self.name}.")
+        self.ejected_until = 0.0
+        self.consecutive_errors = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "replica": self.replica,
+            "ejected": self.ejected,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "latency_total": self.latency_total,
+            "latency_avg": self.latency_total / self.requests if self.requests else 0.0,
+            "lag": self.lag,
+        }
+
+
+class DBRouter:
+    """
+    Has the interface of DBPool. Read-only connections are acquired from the replica
+    with the least outstanding requests, the others from the primary. Replicas which
+    fail health checks, lag more than max_lag seconds or fail eject_errors requests
+    in a row are ejected for eject_time seconds. Without available replicas reads
+    fall back to the primary.
+    """
+
+    def __init__(
+        self,
+        primary: DBPool,
+        replicas: Sequence[DBPool] = (),
+        router_config: Dict = DB_ROUTER,
+    ):
+        self.primary = DBNode("primary", primary, False)
+        self.replicas = [
+            DBNode(f"replica_{number}", pool, True)
+            for number, pool in enumerate(replicas, 1)
+        ]
+        self.health_check_interval = router_config["HEALTH_CHECK_INTERVAL"]
+        self.max_lag = router_config["MAX_LAG"]
+        self.eject_errors = router_config["EJECT_ERRORS"]
+        self.eject_time = router_config["EJECT_TIME"]
+        self.health_checks: Optional[asyncio.Future] = None
+
+    @property
+    def nodes(self) -> List[DBNode]:
+        return [self.primary, *self.replicas]
+
+    @property
+    def pool(self) -> Optional[asyncpg.pool.Pool]:
+        return self.primary.pool.pool
+
+    @property
+    def started(self) -> bool:
+        return self.primary.pool.started
+
+    async def start(self) -> None:
+        """ Starts all pools. Replicas which can not be started are ejected. """
+
+        await self.primary.pool.start()
+        for node in self.replicas:
+            try:
+                await node.pool.start()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                node.eject(self.eject_time, f"It can not be started: {e}")
+        if self.replicas and self.health_checks is None:
+            self.health_checks = asyncio.ensure_future(self.run_health_checks())
+
+    async def close(self) -> None:
+        if self.health_checks is not None:
+            health_checks, self.health_checks = self.health_checks, None
+            health_checks.cancel()
+        for node in self.nodes:
+            await node.pool.close()
+
+    async def run_health_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await asyncio.gather(*(self.check_node(node) for node in self.replicas))
+
+    async def check_node(self, node: DBNode) -> None:
+        """ Measures the lag of the replica. Ejects it when it fails or lags, restores it otherwise. """
+
+        try:
+            if not node.pool.started:
+                await node.pool.start()
+            async with node.pool.acquire() as conn:
+                node.lag = float(await conn.fetchval(LAG_QUERY))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            node.eject(self.eject_time, f"The health check failed: {e}")
+            return
+        if self.max_lag is not None and node.lag > self.max_lag:
+            node.eject(self.eject_time, f"It lags {node.lag:.1f} seconds.")
+        else:
+            node.restore()
+
+    def choose_node(self, read_only: bool) -> DBNode:
+        if read_only:
+            # Replicas which failed to start are started again by health checks
+            replicas = [
+                node for node in self.replicas if not node.ejected and node.pool.started
+            ]
+            if replicas:
+                return min(replicas, key=lambda node: (node.outstanding, node.requests))
+        return self.primary
+
+    def acquire(self, read_only: bool = False) -> "RoutedConnection":
+        """ Returns the context manager which acquires the connection from the chosen node. """
+        return RoutedConnection(self, read_only)
+
+    def count_error(self, node: DBNode, error: Exception) -> None:
+        if isinstance(error, asyncio.CancelledError):
+            return
+        node.errors += 1
+        if not isinstance(error, NODE_ERRORS):
+            return
+        node.consecutive_errors += 1
+        if node.replica and node.consecutive_errors >= self.eject_errors:
+            node.eject(self.eject_time, f"It failed {node.consecutive_errors} times.")
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns the usage statistics of the primary pool. """
+        return self.primary.pool.stats()
+
+    def node_stats(self) -> Dict[str, Dict]:
+        return {node.name: node.stats() for node in self.nodes}
+
+
+class RoutedConnection:
+    """
+    Async context manager acquiring the connection from the node chosen by DBRouter.
+    When the replica fails to give the connection, it is acquired from the primary.
+    """
+
+    def __init__(self, router: DBRouter, read_only: bool):
+        self.router = router
+        self.read_only = read_only
+        self.node: Optional[DBNode] = None
+        self.pool_connection: Any = None
+        self.start: float = 0.0
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        node = self.router.choose_node(self.read_only)
+        try:
+            return await self.enter(node)
+        except NODE_ERRORS as e:
+            if node is self.router.primary:
+                raise
+            print(f"An error occurred: {e} when connecting to {node.name}.")
+            return await self.enter(self.router.primary)
+
+    async def enter(self, node: DBNode) -> asyncpg.Connection:
+        node.outstanding += 1
+        self.start = time.perf_counter()
+        pool_connection = node.pool.acquire()
+        try:
+            conn = await pool_connection.__aenter__()
+        except BaseException as e:
+            # Acquiring is cancelled e.g. when the request exceeds its deadline
+            node.outstanding -= 1
+            if isinstance(e, Exception):
+                self.router.count_error(node, e)
+            raise
+        self.node, self.pool_connection = node, pool_connection
+        return conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        node, self.node = self.node, None
+        node.outstanding -= 1
+        node.requests += 1
+        node.latency_total += time.perf_counter() - self.start
+        if isinstance(exc_val, Exception):
+            self.router.count_error(node, exc_val)
+        elif exc_val is None:
+            node.consecutive_errors = 0
+        await self.pool_connection.__aexit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,56 @@
+""" Simulates network conditions when testing and benchmarking the client and the server. """
+
+from typing import *
+
+import asyncio
+import random
+
+
+class LatencyInjector:
+    """
+    Delays every read of MessageStream. The delay of the read consists of the constant delay,
+    the time of transferring read bytes with the bandwidth cap (bytes per second)
+    and the random jitter from 0 to jitter seconds.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        bandwidth: Optional[float] = None,
+        jitter: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["LatencyInjector"]:
+        """ Creates the injector from settings. Returns None when the injection is disabled. """
+
+        if not config.get("ENABLED"):
+            return None
+        return cls(
+            delay=config.get("DELAY", 0.0),
+            bandwidth=config.get("BANDWIDTH"),
+            jitter=config.get("JITTER", 0.0),
+            seed=config.get("SEED"),
+        )
+
+    def get_delay(self, n_bytes: int) -> float:
+        """ Calculates the delay of reading n_bytes. """
+
+        delay = self.delay
+        if self.bandwidth:
+            delay += n_bytes / self.bandwidth
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        return delay
+
+    async def apply(self, n_bytes: int) -> None:
+        """ Sleeps for the time of reading n_bytes. """
+
+        delay = self.get_delay(n_bytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -6,121 +6,462 @@ import asyncio
 import json
 import struct
 
+from compression import compress, decompress
+from latency import LatencyInjector
+from record_codec import encode_rows, encode_records, decode_records
+from result_rows import Rows, to_json
+
+# Content type of query results in the compact binary format of record_codec module
+RECORDS_CONTENT_TYPE = "records"
+# Content type of the frame which announces that the sender closes the connection
+CLOSE_CONTENT_TYPE = "close"
+
+# Frames of the protocol version 2 start with the magic byte and the version byte,
+# followed by 4-byte header length and 8-byte content length. Frames of the version 1
+# start with 2-byte header length, so version 1 headers can not be 0xFF00 bytes or longer.
+PROTOCOL_MAGIC = 0xFF
+PROTOCOL_VERSION = 2
+preamble_lengths = struct.Struct(">IQ")
+MAX_V1_HEADER_LEN = 0xFEFF
+
+# Content longer than this is written to the socket separately instead of being merged with the header
+MERGE_LIMIT = 64 * 1024
+
+
+class ConnectionClosed(ConnectionError):
+    """ Raised when the other socket closes the connection or sends the close frame. """
+
+
+class FrameTooLarge(ValueError):
+    """ Raised when the received header or content exceeds the size limit, before it is read. """
+
+    def __init__(self, message: str, header: Optional[Dict] = None):
+        super().__init__(message)
+        # The message header, when it was read before the content was rejected
+        self.header = header
+
+
+class InvalidHeader(ValueError):
+    """ Raised when the received header is not a JSON object with the content length and type. """
+
+
+class ReadTimeout(ConnectionError):
+    """ Raised when the other socket sends the message too slowly. rule names the exceeded limit. """
+
+    def __init__(self, message: str, rule: str):
+        super().__init__(message)
+        self.rule = rule
+
+
+def get_body_read_time(
+    content_len: int,
+    body_timeout: Optional[float],
+    min_transfer_rate: Optional[float],
+) -> Optional[float]:
+    """
+    Gets the number of seconds allowed for receiving the whole content: body_timeout
+    plus the time of transferring it at min_transfer_rate bytes per second.
+    """
+
+    if not min_transfer_rate:
+        return None
+    return (body_timeout or 0) + content_len / min_transfer_rate
+
+
+def encode_content(data: Any, content_type: str, encoding: str) -> bytes:
+    """ Encodes data as the content of the content type. When data is invalid raises ValueError. """
+
+    if encoding not in ("utf-8", "ascii"):
+        raise ValueError("Wrong encoding! Available encodings: utf-8, ascii.")
+    if type(data) in (dict, json) and content_type == "json":
+        return json.dumps(data, default=to_json).encode(encoding)
+    elif type(data) == str and content_type == "text":
+        return data.encode(encoding)
+    elif isinstance(data, (bytes, bytearray, memoryview)) and content_type == "binary":
+        return data
+    elif is_records_answer(data) and content_type == RECORDS_CONTENT_TYPE:
+        answer = data["answer"]
+        if isinstance(answer, Rows):
+            # No records are built for rows kept as tuples
+            return encode_rows(answer.columns, answer.rows)
+        return encode_records(answer)
+    raise ValueError(f"Wrong value of data: {data} or content_type: {content_type}.")
+
+
+def decode_content(
+    content: Union[bytes, bytearray], content_type: str
+) -> Union[str, Dict, bytes]:
+    """ Decodes the received content of the content type. Binary content is given as bytes. """
+
+    if content_type == "text":
+        return content.decode()
+    elif content_type == "json":
+        return json.loads(content)
+    elif content_type == "binary":
+        return bytes(content)
+    elif content_type == RECORDS_CONTENT_TYPE:
+        return {"answer": decode_records(content)}
+    elif content_type == CLOSE_CONTENT_TYPE:
+        return b""
+    return "Unknown received content type."
+
+
+def is_records_answer(data: Any) -> bool:
+    """
+    Checks if data is the answer which can be sent with the records content type. Values
+    of the rows must be flat, so answers of batch items (nested answers) are sent as JSON.
+    """
+
+    if type(data) != dict or list(data) != ["answer"]:
+        return False
+    answer = data["answer"]
+    if isinstance(answer, Rows):
+        return True
+    return isinstance(answer, list) and not any(
+        isinstance(value, Rows)
+        for record in answer
+        if isinstance(record, dict)
+        for value in record.values()
+    )
+
+
+def get_protocol_version(data: bytes) -> int:
+    """ Gets the protocol version from the first two bytes of the message. """
+
+    if data[0] != PROTOCOL_MAGIC:
+        return 1
+    if data[1] != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version: {data[1]}.")
+    return PROTOCOL_VERSION
+
+
+def decode_header(data: Union[bytes, bytearray]) -> Dict:
+    """ Decodes the received message header. When it is invalid raises InvalidHeader. """
+
+    try:
+        header = json.loads(data)
+    except ValueError as e:
+        raise InvalidHeader(f"The header is not valid JSON: {e}")
+    if type(header) != dict:
+        raise InvalidHeader("The header must be a JSON object.")
+    content_length = header.get("content_length")
+    if type(content_length) != int or content_length < 0:
+        raise InvalidHeader(
+            "Wrong content_length. Required content_length: non-negative integer."
+        )
+    if type(header.get("content_type")) != str:
+        raise InvalidHeader("Wrong content_type. Required content_type: string.")
+    return header
+
+
+def check_header_len(header_len: int, max_header_size: Optional[int]) -> None:
+    """ Raises FrameTooLarge when the header is longer than max_header_size. """
+
+    if header_len <= 0:
+        raise ValueError("Header length must be greater than 0!")
+    if max_header_size is not None and header_len > max_header_size:
+        raise FrameTooLarge(
+            f"Header length {header_len} exceeds the limit of {max_header_size} bytes."
+        )
+
+
+def check_content_len(
+    header: Dict, preamble_content_len: Optional[int], max_content_size: Optional[int]
+) -> None:
+    """ Raises FrameTooLarge when the content is longer than max_content_size. """
+
+    content_len = header["content_length"]
+    if preamble_content_len is not None and preamble_content_len != content_len:
+        raise ValueError("Content length of the header and the preamble differ!")
+    if max_content_size is not None and content_len > max_content_size:
+        raise FrameTooLarge(
+            f"Content length {content_len} exceeds the limit of"
+            f" {max_content_size} bytes.",
+            header,
+        )
+
+
+def decompress_content(
+    content: bytearray, header: Dict, max_content_size: Optional[int]
+) -> Union[bytes, bytearray]:
+    """ Decompresses the content when the header announces compression. """
+
+    compression = header.get("content_compression")
+    if not compression:
+        return content
+    content = decompress(content, compression, max_content_size)
+    if max_content_size is not None and len(content) > max_content_size:
+        raise FrameTooLarge(
+            f"Decompressed content exceeds the limit of {max_content_size} bytes.",
+            header,
+        )
+    return content
+
+
+def encode_preamble(header_len: int, content_len: int, version: int) -> bytes:
+    """ Encodes the message preamble of the protocol version. """
+
+    if version == 1:
+        if header_len > MAX_V1_HEADER_LEN:
+            raise ValueError("Header is too long for the protocol version 1!")
+        return struct.pack(">H", header_len)
+    return struct.pack(">BB", PROTOCOL_MAGIC, PROTOCOL_VERSION) + preamble_lengths.pack(
+        header_len, content_len
+    )
+
+
+def merge_frame(preamble: bytes, header: bytes, content: bytes) -> List[bytes]:
+    """ Merges parts of the message. Large content is not copied, it is written after the header. """
+
+    if len(content) > MERGE_LIMIT:
+        return [preamble + header, content]
+    return [preamble + header + content]
+
 
 class MessageStream:
-    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Maximal number of bytes taken from the socket by one read of the message content
+    read_chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        latency: Optional[LatencyInjector] = None,
+        compression_threshold: int = 1024,
+        max_header_size: Optional[int] = None,
+        max_content_size: Optional[int] = None,
+        header_timeout: Optional[float] = None,
+        body_timeout: Optional[float] = None,
+        min_transfer_rate: Optional[float] = None,
+    ):
         self.reader = reader
         self.writer = writer
-        self.recv_buffer: bytes = b""
+        # Simulates network latency only when it is explicitly passed (tests, benchmarks)
+        self.latency = latency
+        # Content shorter than this number of bytes is never compressed
+        self.compression_threshold = compression_threshold
+        # Received messages with longer header or content are rejected, None means no limit
+        self.max_header_size = max_header_size
+        self.max_content_size = max_content_size
+        # The header must be received within header_timeout seconds since the message starts,
+        # the content can not stall longer than body_timeout seconds and must be received
+        # at min_transfer_rate bytes per second on average, None means no limit
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.min_transfer_rate = min_transfer_rate
+        self.read_deadline: Optional[float] = None
+        # Version of sent messages, it follows the version of received messages
+        self.protocol_version: int = PROTOCOL_VERSION
+        self.recv_buffer: bytearray = bytearray()
         self.recv_content: Union[str, Dict, bytes] = {}
         self.recv_header: Dict[str, Union[str, int]] = {}
         self.recv_header_len: int = int()
-        self.data_to_send: bytes = b""
+        self.recv_content_len: Optional[int] = None
+        self.data_to_send: List[bytes] = []
         self.content_to_send: bytes = b""
         self.content_type_to_send: str = ""
         self.header_to_send: Dict[str, Union[str, int]] = {}
         self.header_len_to_send: int = int()
+        self.encoded_header_to_send: bytes = b""
+        self.extra_header_to_send: Dict[str, Union[str, int]] = {}
+        self.compression_to_send: Optional[str] = None
         self.encoding_to_send: str = "utf-8"
+        self.send_lock: Optional[asyncio.Lock] = None
 
-    async def receive_stream(self) -> Tuple[Dict, Union[str, Dict, bytes]]:
-        """ Receives data from the other socket and saves it to class attributes. """
+    async def receive_stream(
+        self, idle_timeout: Optional[float] = None
+    ) -> Tuple[Dict, Union[str, Dict, bytes]]:
+        """
+        Receives the next message from the other socket and saves it to class attributes.
+        Waits at most idle_timeout seconds for the message to start, then raises asyncio.TimeoutError.
+        """
 
-        if not self.recv_header_len:
-            await self.get_recv_header_len()
+        await self.get_recv_header_len(idle_timeout)
         await self.get_recv_header()
         await self.get_recv_content()
         return self.recv_header, self.recv_content
 
-    async def get_recv_header_len(self) -> None:
-        """ Reads the message header length and saves it to the class attribute. """
-
-        data = await self.reader.read(2)
-        if data:
+    async def get_recv_header_len(self, idle_timeout: Optional[float] = None) -> None:
+        """
+        Reads the preamble of the message with the header length (and the content length
+        in the version 2) and saves them to class attributes. Rejects too long headers.
+        """
+
+        data = await asyncio.wait_for(self.read_exactly(2), idle_timeout)
+        self.read_deadline = self.get_deadline(self.header_timeout)
+        self.protocol_version = get_protocol_version(data)
+        if self.protocol_version == PROTOCOL_VERSION:
+            lengths = await self.read_before_deadline(
+                self.read_exactly(preamble_lengths.size), "header_timeout"
+            )
+            self.recv_header_len, self.recv_content_len = preamble_lengths.unpack(
+                lengths
+            )
+        else:
             self.recv_header_len = struct.unpack(">H", data)[0]
+            self.recv_content_len = None
+        check_header_len(self.recv_header_len, self.max_header_size)
 
     async def get_recv_header(self) -> None:
-        """ Reads the message header and saves it to the class attribute. """
-
-        if self.recv_header_len <= 0:
-            raise ValueError("Header length must be greater than 0!")
+        """ Reads the message header and saves it to the class attribute. Rejects too long content. """
 
-        while True:
-            if len(self.recv_buffer) >= self.recv_header_len:
-                break
-            await self.read_data()
-        header = self.recv_buffer[: self.recv_header_len]
-        self.recv_header = self.decode_json(header)
-        self.recv_buffer = self.recv_buffer[self.recv_header_len :]
+        header = await self.read_before_deadline(
+            self.read_exactly(self.recv_header_len), "header_timeout"
+        )
+        self.recv_header = decode_header(header)
+        check_content_len(
+            self.recv_header, self.recv_content_len, self.max_content_size
+        )
 
     async def get_recv_content(self) -> None:
-        """ Reads the message content and saves it to the class attribute. """
+        """ Reads exactly content_length bytes into the buffer allocated for the whole content and decodes them. """
 
-        content_len = self.recv_header["content_length"]
-        while True:
-            if len(self.recv_buffer) >= content_len:
-                break
-            await self.read_data()
+        self.recv_buffer = bytearray(self.recv_header["content_length"])
+        await self.read_into(memoryview(self.recv_buffer))
+        self.recv_buffer = decompress_content(
+            self.recv_buffer, self.recv_header, self.max_content_size
+        )
         self.decode_recv_content()
-        self.recv_buffer = self.recv_buffer[content_len:]
 
-    async def read_data(self):
-        """ Reads data and saves it to the buffer. """
+    async def read_exactly(self, n: int) -> bytes:
+        """ Reads exactly n bytes from the socket. """
+
+        try:
+            data = await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError:
+            raise ConnectionClosed("The connection was closed by the other socket.")
+        if self.latency is not None:
+            await self.latency.apply(n)
+        return data
+
+    async def read_into(self, buffer: memoryview) -> None:
+        """
+        Fills the buffer with chunks read from the socket. Every chunk is copied into
+        the buffer once instead of being concatenated with previous ones. Raises
+        ReadTimeout when the content stalls or is received slower than min_transfer_rate.
+        """
+
+        self.read_deadline = self.get_deadline(
+            get_body_read_time(len(buffer), self.body_timeout, self.min_transfer_rate)
+        )
+        position = 0
+        while position < len(buffer):
+            read = self.reader.read(min(len(buffer) - position, self.read_chunk_size))
+            time_left = self.get_time_left()
+            if self.body_timeout is not None and (
+                time_left is None or self.body_timeout < time_left
+            ):
+                data = await self.read_before(read, self.body_timeout, "body_timeout")
+            else:
+                data = await self.read_before(read, time_left, "min_transfer_rate")
+            if not data:
+                raise ConnectionClosed("The connection was closed by the other socket.")
+            buffer[position : position + len(data)] = data
+            position += len(data)
+            if self.latency is not None:
+                await self.latency.apply(len(data))
+
+    @staticmethod
+    def get_deadline(timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            return None
+        return asyncio.get_event_loop().time() + timeout
+
+    def get_time_left(self) -> Optional[float]:
+        if self.read_deadline is None:
+            return None
+        return max(self.read_deadline - asyncio.get_event_loop().time(), 0)
+
+    async def read_before_deadline(self, read: Awaitable, rule: str) -> bytes:
+        return await self.read_before(read, self.get_time_left(), rule)
 
-        data = await self.reader.read(1024)
-        # Simulate network latency
-        await asyncio.sleep(0.1)
-        self.recv_buffer += data
+    @staticmethod
+    async def read_before(
+        read: Awaitable, timeout: Optional[float], rule: str
+    ) -> bytes:
+        """ Waits for the read at most timeout seconds, then raises ReadTimeout of the rule. """
+
+        if timeout is None:
+            return await read
+        try:
+            return await asyncio.wait_for(read, timeout)
+        except asyncio.TimeoutError:
+            raise ReadTimeout(f"The message was received too slowly ({rule}).", rule)
 
     def decode_recv_content(self) -> None:
         """ Decodes received data saved in the buffer. """
-
-        content_type = self.recv_header["content_type"]
-        if content_type == "text":
-            self.recv_content = self.recv_buffer.decode()
-        elif content_type == "json":
-            self.recv_content = self.decode_json(self.recv_buffer)
-        elif content_type == "binary":
-            self.recv_content = self.recv_buffer
-        else:
-            self.recv_content = "Unknown received content type."
+        self.recv_content = decode_content(
+            self.recv_buffer, self.recv_header["content_type"]
+        )
 
     async def send_stream(
         self,
         data: Union[str, Dict, bytes],
         content_type: str,
         encoding: str = "utf-8",
+        header: Optional[Dict[str, Union[str, int]]] = None,
+        compression: Optional[str] = None,
     ) -> None:
-        """ Prepares inputted data and sends it to the other socket. """
+        """
+        Prepares inputted data and sends it to the other socket. Items of the header argument
+        (e.g. request_id) are added to the message header. The content is compressed
+        with the compression method when it is not shorter than compression_threshold.
+        Messages sent concurrently are written one after another.
+        """
 
         self.validate_input(data, content_type, encoding)
+        self.extra_header_to_send = header or {}
+        self.compress_content(compression)
+        self.prepare_data_to_send()
+        print(f"Sending: {self.header_to_send}")
+        await self.write_data(self.data_to_send)
+
+    async def send_close(self) -> None:
+        """ Sends the close frame announcing that no more messages will be sent. """
+
+        self.encoding_to_send = "utf-8"
+        self.content_to_send = b""
+        self.content_type_to_send = CLOSE_CONTENT_TYPE
+        self.extra_header_to_send = {}
+        self.compression_to_send = None
         self.prepare_data_to_send()
-        print(f"Sending: {self.content_to_send}")
-        self.writer.write(self.data_to_send)
-        await self.writer.drain()
+        await self.write_data(self.data_to_send)
+
+    async def write_data(self, data: List[bytes]) -> None:
+        """ Writes prepared data to the socket and waits until the socket buffer is drained. """
+
+        if self.send_lock is None:
+            self.send_lock = asyncio.Lock()
+        async with self.send_lock:
+            for chunk in data:
+                self.writer.write(chunk)
+            await self.writer.drain()
+
+    @staticmethod
+    def is_records_answer(data: Any) -> bool:
+        return is_records_answer(data)
+
+    @staticmethod
+    def is_close_frame(header: Dict) -> bool:
+        return header.get("content_type") == CLOSE_CONTENT_TYPE
 
     def validate_input(
         self, data: Union[str, Dict, bytes], content_type: str, encoding: str
     ) -> None:
         """ Validates inputted data. When data is invalid raises ValueError. """
 
-        if encoding not in ("utf-8", "ascii"):
-            self.close()
-            raise ValueError("Wrong encoding! Available encodings: utf-8, ascii.")
-
+        self.content_to_send = encode_content(data, content_type, encoding)
         self.encoding_to_send = encoding
+        self.content_type_to_send = content_type
+
+    def compress_content(self, compression: Optional[str]) -> None:
+        """ Compresses content to send when it is long enough. """
 
-        if type(data) in (dict, json) and content_type == "json":
-            self.content_to_send = self.encode_json(data)
-        elif type(data) == str and content_type == "text":
-            self.content_to_send = data.encode(self.encoding_to_send)
-        elif type(data) == bytes and content_type == "binary":
-            self.content_to_send = data
+        if compression and len(self.content_to_send) >= self.compression_threshold:
+            self.content_to_send = compress(self.content_to_send, compression)
+            self.compression_to_send = compression
         else:
-            self.close()
-            raise ValueError(
-                f"Wrong value of data: {data} or content_type: {content_type}."
-            )
-        self.content_type_to_send = content_type
+            self.compression_to_send = None
 
     def prepare_data_to_send(self) -> None:
         """ Creates the message header and message header length and merges it with content data. """
@@ -136,32 +477,47 @@ class MessageStream:
             "content_type": self.content_type_to_send,
             "content_encoding": self.encoding_to_send,
             "content_length": len(self.content_to_send),
+            **self.extra_header_to_send,
         }
+        if self.compression_to_send:
+            self.header_to_send["content_compression"] = self.compression_to_send
 
     def get_header_len_to_send(self) -> None:
         """ Gets the message header length. """
-        self.header_len_to_send = len(self.encode_json(self.header_to_send))
+
+        self.encoded_header_to_send = self.encode_json(self.header_to_send)
+        self.header_len_to_send = len(self.encoded_header_to_send)
 
     def merge_data_to_send(self) -> None:
-        """ Merges the message header length, the message header, and content data. """
-        self.data_to_send = (
-            self.encode_header_len_to_send()
-            + self.encode_json(self.header_to_send)
-            + self.content_to_send
+        """
+        Merges the message header length, the message header, and content data.
+        Large content is not copied, it is written to the socket after the header.
+        """
+
+        self.data_to_send = merge_frame(
+            self.encode_header_len_to_send(),
+            self.encoded_header_to_send,
+            self.content_to_send,
         )
 
     def encode_header_len_to_send(self) -> bytes:
-        """ Encodes the message header length to send it with the answer message. """
-        return struct.pack(">H", self.header_len_to_send)
+        """ Encodes the preamble with the message header length to send it with the answer message. """
+        return encode_preamble(
+            self.header_len_to_send, len(self.content_to_send), self.protocol_version
+        )
 
     @staticmethod
     def decode_json(obj: bytes) -> json:
         return json.loads(obj)
 
     def encode_json(self, data: Dict) -> bytes:
-        return json.dumps(data).encode(self.encoding_to_send)
+        return json.dumps(data, default=to_json).encode(self.encoding_to_send)
 
     def close(self):
         """ Closing the socket. """
         print("Close the socket.")
         self.writer.close()
+
+    @property
+    def is_closing(self) -> bool:
+        return self.writer.transport.is_closing()
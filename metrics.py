@@ -0,0 +1,33 @@
+""" Collects statistics of the process for monitoring. """
+
+from typing import *
+
+import collections
+
+
+class Metrics:
+    """ Keeps counters and sums identified by dotted names, e.g. "compression.bytes_in". """
+
+    def __init__(self):
+        self.values: DefaultDict[str, float] = collections.defaultdict(float)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        self.values[name] += value
+
+    def get(self, name: str) -> float:
+        return self.values.get(name, 0)
+
+    def snapshot(self, prefix: str = "") -> Dict[str, float]:
+        """ Returns values whose names start with the prefix, with the prefix removed. """
+        return {
+            name[len(prefix) :]: value
+            for name, value in self.values.items()
+            if name.startswith(prefix)
+        }
+
+    def reset(self) -> None:
+        self.values.clear()
+
+
+# Metrics of the current process
+metrics = Metrics()
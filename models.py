@@ -313,3 +313,15 @@ class Keywords(Base):
         if query:
             return query
         return cls(**kwargs)
+
+
+class DataVersion(Base):
+    """ Version of the uploaded data, increased after every upload. """
+
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<DataVersion(version='%s')>" % (self.version,)
@@ -0,0 +1,176 @@
+""" Answers lookups of the built-in categories from memory instead of the database. """
+
+from typing import *
+
+import array
+import bisect
+import sys
+
+import asyncpg
+
+from metrics import metrics
+from result_rows import Rows, convert_records
+
+# Rows of people of the categories: name of the person, unique key of the row and movie id
+PEOPLE_QUERIES = {
+    "actor": """
+    SELECT actors.name, characters.id, characters.movie_id FROM characters
+    INNER JOIN actors ON actors.id = characters.actor_id
+    ORDER BY characters.id
+    """,
+    "director": """
+    SELECT crew_members.name, crew.id, crew.movie_id FROM crew
+    INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+    WHERE crew.job = 'Director'
+    ORDER BY crew.id
+    """,
+    "screenplay": """
+    SELECT crew_members.name, crew.id, crew.movie_id FROM crew
+    INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+    WHERE crew.department = 'Writing'
+    ORDER BY crew.id
+    """,
+}
+MOVIES_QUERY = "SELECT * FROM movies_metadata ORDER BY id"
+
+
+class Postings(NamedTuple):
+    """ Keys of rows matching the name in ascending order and movie ids of the rows. """
+
+    keys: array.array
+    movie_ids: array.array
+
+
+class MovieIndex:
+    """
+    Immutable snapshot of the movies and the people of the data version. Names and titles
+    are interned, rows of every name are kept in arrays of integers. It is rebuilt rather
+    than updated, so requests in progress keep reading the snapshot they started with.
+    """
+
+    def __init__(
+        self,
+        version: Optional[int],
+        columns: Tuple[str, ...],
+        movies: Dict[int, tuple],
+        postings: Dict[str, Dict[str, Postings]],
+    ):
+        self.version = version
+        # Columns of movies_metadata and the values of every movie in that order
+        self.columns = columns
+        self.movies = movies
+        self.title_column = columns.index("title")
+        self.postings = postings
+        self.size = self.get_footprint()
+
+    @classmethod
+    def build(
+        cls,
+        version: Optional[int],
+        movies: Rows,
+        people: Dict[str, Iterable[Tuple[str, int, int]]],
+    ) -> "MovieIndex":
+        """ Builds the index of movie rows and (name, key, movie id) rows of people ordered by keys. """
+
+        columns = tuple(sys.intern(name) for name in movies.columns)
+        id_column, title_column = columns.index("id"), columns.index("title")
+        movie_values: Dict[int, tuple] = {}
+        titles: Dict[str, List[int]] = {}
+        for values in movies.rows:
+            title = values[title_column]
+            if title is not None:
+                title = sys.intern(title)
+                values = (*values[:title_column], title, *values[title_column + 1 :])
+                titles.setdefault(title, []).append(values[id_column])
+            movie_values[values[id_column]] = values
+        postings = {"title": {}}
+        for title, ids in titles.items():
+            # Movies of the title are ordered by their ids, which are the keys too
+            ids_array = array.array("q", ids)
+            postings["title"][title] = Postings(ids_array, ids_array)
+        for category, rows in people.items():
+            lists: Dict[str, Tuple[List[int], List[int]]] = {}
+            for name, key, movie_id in rows:
+                if name is None or movie_id not in movie_values:
+                    continue
+                keys, movie_ids = lists.setdefault(sys.intern(name), ([], []))
+                keys.append(key)
+                movie_ids.append(movie_id)
+            postings[category] = {
+                name: Postings(array.array("q", keys), array.array("q", movie_ids))
+                for name, (keys, movie_ids) in lists.items()
+            }
+        return cls(version, columns, movie_values, postings)
+
+    @classmethod
+    async def load(
+        cls,
+        conn: asyncpg.Connection,
+        version: Optional[int],
+    ) -> "MovieIndex":
+        """ Reads the movies and the people of all categories in one snapshot of the database. """
+
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            movies = convert_records(await conn.fetch(MOVIES_QUERY))
+            people = {
+                category: await conn.fetch(query)
+                for category, query in PEOPLE_QUERIES.items()
+            }
+        return cls.build(version, movies, people)
+
+    def lookup(
+        self, category: str, name: str, after: int, limit: Optional[int]
+    ) -> Optional[Rows]:
+        """
+        Gets at most limit rows of the name following the after key, with their keys
+        as page_key, like the statement of the category. None means the name is unknown.
+        """
+
+        names = self.postings.get(category)
+        if names is None:
+            # The category is not indexed
+            return None
+        postings = names.get(name)
+        if postings is None:
+            metrics.incr("movie_index.misses")
+            return None
+        metrics.incr("movie_index.hits")
+        start = bisect.bisect_right(postings.keys, after)
+        end = len(postings.keys) if limit is None else start + limit
+        keys = postings.keys[start:end]
+        movie_ids = postings.movie_ids[start:end]
+        movies = self.movies
+        if category == "title":
+            return Rows(
+                ("page_key", *self.columns),
+                [(key, *movies[movie_id]) for key, movie_id in zip(keys, movie_ids)],
+            )
+        title = self.title_column
+        return Rows(
+            ("page_key", "title"),
+            [(key, movies[movie_id][title]) for key, movie_id in zip(keys, movie_ids)],
+        )
+
+    def get_footprint(self) -> int:
+        """ Returns bytes taken by the index, shared objects are counted once. """
+
+        objects = {id(obj): obj for obj in [self.columns, self.movies, self.postings]}
+        for movie_id, values in self.movies.items():
+            objects[id(movie_id)] = movie_id
+            objects[id(values)] = values
+            for value in values:
+                objects[id(value)] = value
+        for names in self.postings.values():
+            objects[id(names)] = names
+            for name, postings in names.items():
+                for obj in (name, postings, postings.keys, postings.movie_ids):
+                    objects[id(obj)] = obj
+        return sum(map(sys.getsizeof, objects.values()))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "version": self.version,
+            "movies": len(self.movies),
+            "names": sum(len(names) for names in self.postings.values()),
+            "bytes": self.size,
+        }
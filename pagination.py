@@ -0,0 +1,53 @@
+""" Provides pages of query results with keyset continuation tokens. """
+
+from typing import *
+
+import base64
+import hashlib
+import json
+
+# Key before the first row of the built-in categories
+FIRST_KEY = -(2 ** 63)
+
+
+class Page(NamedTuple):
+    """
+    Rows of the page follow the row with the after key, at most limit of them
+    (None means all rows). key is the column with unique keys ordering the rows.
+    """
+
+    limit: Optional[int] = None
+    after: Any = None
+    key: Optional[str] = None
+
+
+def get_scope(request: Dict) -> str:
+    """ Gets the digest of the request items which the continuation token is valid for. """
+
+    category = request.get("category")
+    key = request.get("key") if category == "custom" else None
+    items = [category, request.get("query"), key]
+    return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()[:16]
+
+
+def encode_token(request: Dict, after: Union[int, float, str]) -> str:
+    """ Encodes the opaque token of the next page of the request. """
+
+    data = json.dumps([get_scope(request), after]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_token(request: Dict, token: Any) -> Union[int, float, str]:
+    """ Decodes the key of the last row from the token. Raises ValueError when it is wrong. """
+
+    try:
+        scope, after = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Wrong continuation token.")
+    if scope != get_scope(request) or not isinstance(after, (int, float, str)):
+        raise ValueError("Wrong continuation token.")
+    return after
+
+
+def quote_identifier(name: str) -> str:
+    return '"%s"' % name.replace('"', '""')
@@ -0,0 +1,338 @@
+""" Server transport built directly on asyncio.Protocol instead of StreamReader and StreamWriter. """
+
+from typing import *
+
+import asyncio
+import json
+import struct
+
+from message_stream import (
+    ConnectionClosed,
+    FrameTooLarge,
+    InvalidHeader,
+    ReadTimeout,
+    CLOSE_CONTENT_TYPE,
+    PROTOCOL_VERSION,
+    preamble_lengths,
+    encode_content,
+    decode_content,
+    decode_header,
+    get_protocol_version,
+    check_header_len,
+    check_content_len,
+    decompress_content,
+    encode_preamble,
+    merge_frame,
+    get_body_read_time,
+)
+from compression import compress
+
+if TYPE_CHECKING:
+    from async_server import AsyncServer
+
+
+class MessageProtocol(asyncio.Protocol):
+    """
+    Parses messages of the MessageStream format incrementally from received data and passes
+    requests to the server. It has the sending interface of MessageStream, so the server answers
+    requests the same way as with the streams transport. Latency injection is not supported.
+    """
+
+    def __init__(self, server: "AsyncServer"):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self.addr: Any = None
+        self.buffer = bytearray()
+        # Header of the message whose content is not received yet
+        self.recv_header: Optional[Dict] = None
+        # Version of sent messages, it follows the version of received messages
+        self.protocol_version: int = PROTOCOL_VERSION
+        self.tasks: Set[asyncio.Future] = set()
+        # Closes the connection when it is idle or the message is received too slowly
+        self.timer: Optional[asyncio.Handle] = None
+        # Event loop time when the header or the content of the message must be received
+        self.read_deadline: Optional[float] = None
+        self.accepted = False
+        self.paused = False
+        self.drain_waiters: List[asyncio.Future] = []
+        # Set when no more messages are received, the connection is closed after answering
+        self.finishing = False
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.addr = transport.get_extra_info("peername")
+        self.accepted = self.server.accept_peer(self.addr)
+        if not self.accepted:
+            print(f"Too many connections from address: {self.addr}.")
+            self.finishing = True
+            transport.close()
+            return
+        self.server.connections.add(self)
+        self.reset_timer()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self.accepted:
+            self.server.connections.discard(self)
+            self.server.release_peer(self.addr)
+            self.accepted = False
+        if self.timer is not None:
+            self.timer.cancel()
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(
+                    ConnectionClosed("The connection was closed by the other socket.")
+                )
+        self.drain_waiters.clear()
+        for task in self.tasks:
+            task.cancel()
+
+    def data_received(self, data: bytes) -> None:
+        """ Dispatches every message completed by the received data. """
+
+        if self.finishing:
+            return
+        self.buffer += data
+        try:
+            while not self.finishing and self.parse_message():
+                pass
+        except FrameTooLarge as e:
+            print(f"Rejecting the request from address: {self.addr}. {e}")
+            self.finish(self.server.reject_frame(self, e))
+        except InvalidHeader as e:
+            print(f"Rejecting the request from address: {self.addr}. {e}")
+            self.finish(self.server.reject_header(self, e))
+        except ValueError as e:
+            print(f"An error occurred: {e} when address: {self.addr} connect.")
+            self.close()
+        else:
+            self.reset_timer()
+
+    def eof_received(self) -> Optional[bool]:
+        # Closes the connection, answers of pending requests can not be delivered anyway
+        return False
+
+    def parse_message(self) -> bool:
+        """ Parses the next message from the buffer. Returns False when it is not received yet. """
+
+        if self.recv_header is None and not self.parse_header():
+            return False
+        content_length = self.recv_header["content_length"]
+        if len(self.buffer) < content_length:
+            return False
+        header, self.recv_header = self.recv_header, None
+        self.read_deadline = None
+        # The content is copied from the buffer once
+        with memoryview(self.buffer) as view:
+            content = bytes(view[:content_length])
+        del self.buffer[:content_length]
+        content = decompress_content(content, header, self.server.max_content_size)
+        self.dispatch(header, decode_content(content, header["content_type"]))
+        return True
+
+    def parse_header(self) -> bool:
+        """
+        Parses the preamble and the header of the next message. Too long headers are rejected
+        as soon as the preamble is received and too long content as soon as the header is.
+        """
+
+        if len(self.buffer) < 2:
+            return False
+        version = get_protocol_version(self.buffer[:2])
+        if version == PROTOCOL_VERSION:
+            preamble_len = 2 + preamble_lengths.size
+            if len(self.buffer) < preamble_len:
+                return False
+            header_len, content_len = preamble_lengths.unpack_from(self.buffer, 2)
+        else:
+            preamble_len = 2
+            header_len, content_len = struct.unpack_from(">H", self.buffer)[0], None
+        check_header_len(header_len, self.server.max_header_size)
+        header_end = preamble_len + header_len
+        if len(self.buffer) < header_end:
+            return False
+        header = decode_header(self.buffer[preamble_len:header_end])
+        self.protocol_version = version
+        check_content_len(header, content_len, self.server.max_content_size)
+        del self.buffer[:header_end]
+        self.recv_header = header
+        self.read_deadline = self.get_deadline(
+            get_body_read_time(
+                header["content_length"],
+                self.server.body_timeout,
+                self.server.min_transfer_rate,
+            )
+        )
+        return True
+
+    def dispatch(self, header: Dict, request: Union[str, Dict, bytes]) -> None:
+        """ Answers the request in a new task, the close frame finishes the connection. """
+
+        if self.is_close_frame(header):
+            self.finish()
+            return
+        task = asyncio.ensure_future(self.server.respond(self, header, request))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def finish(self, last_answer: Optional[Awaitable] = None) -> None:
+        """ Stops receiving messages and closes the connection when all requests are answered. """
+
+        self.finishing = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.transport.pause_reading()
+        asyncio.ensure_future(self.close_when_answered(last_answer))
+
+    async def close_when_answered(self, last_answer: Optional[Awaitable]) -> None:
+        try:
+            if last_answer is not None:
+                await last_answer
+            if self.tasks:
+                await asyncio.wait(self.tasks)
+        except ConnectionError:
+            pass
+        finally:
+            self.close()
+
+    @staticmethod
+    def get_deadline(timeout: Optional[float]) -> Optional[float]:
+        if timeout is None:
+            return None
+        return asyncio.get_event_loop().time() + timeout
+
+    def reset_timer(self) -> None:
+        """
+        Sets the timer of the rule which closes the connection first: idle_timeout when
+        no message is being received, header_timeout when the header is being received,
+        body_timeout (since the last read) or min_transfer_rate when the content is.
+        """
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.finishing:
+            return
+        now = asyncio.get_event_loop().time()
+        if not self.buffer and self.recv_header is None:
+            rule, timeout = "idle_timeout", self.server.idle_timeout
+        elif self.recv_header is None:
+            if self.read_deadline is None:
+                self.read_deadline = self.get_deadline(self.server.header_timeout)
+            rule, timeout = "header_timeout", self.time_left(now)
+        else:
+            rule, timeout = "min_transfer_rate", self.time_left(now)
+            body_timeout = self.server.body_timeout
+            if body_timeout is not None and (timeout is None or body_timeout < timeout):
+                rule, timeout = "body_timeout", body_timeout
+        if timeout is not None:
+            self.timer = asyncio.get_event_loop().call_later(
+                timeout, self.timed_out, rule
+            )
+
+    def time_left(self, now: float) -> Optional[float]:
+        if self.read_deadline is None:
+            return None
+        return max(self.read_deadline - now, 0)
+
+    def timed_out(self, rule: str) -> None:
+        """ Closes the idle connection without pending requests, or the connection of the slow client. """
+
+        self.timer = None
+        if rule != "idle_timeout":
+            error = ReadTimeout(f"The message was received too slowly ({rule}).", rule)
+            print(f"Closing the connection with address: {self.addr}. {error}")
+            self.server.count_closed_connection(rule)
+            self.close()
+            return
+        if self.tasks:
+            self.reset_timer()
+            return
+        print(f"Closing the idle connection with address: {self.addr}.")
+        self.server.count_closed_connection(rule)
+        self.write_message(b"", CLOSE_CONTENT_TYPE, "utf-8")
+        self.close()
+
+    async def send_stream(
+        self,
+        data: Union[str, Dict, bytes],
+        content_type: str,
+        encoding: str = "utf-8",
+        header: Optional[Dict[str, Union[str, int]]] = None,
+        compression: Optional[str] = None,
+    ) -> None:
+        """ Sends the message like MessageStream.send_stream and waits until the transport buffer is drained. """
+
+        content = encode_content(data, content_type, encoding)
+        if compression and len(content) < self.server.compression_threshold:
+            compression = None
+        if compression:
+            content = compress(content, compression)
+        self.write_message(content, content_type, encoding, header, compression)
+        await self.drain()
+
+    async def send_close(self) -> None:
+        """ Sends the close frame announcing that no more messages will be sent. """
+
+        self.write_message(b"", CLOSE_CONTENT_TYPE, "utf-8")
+        await self.drain()
+
+    def write_message(
+        self,
+        content: bytes,
+        content_type: str,
+        encoding: str,
+        header: Optional[Dict[str, Union[str, int]]] = None,
+        compression: Optional[str] = None,
+    ) -> None:
+        """ Writes the whole message to the transport at once, so concurrent answers never interleave. """
+
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionClosed("The connection is closed.")
+        header_to_send = {
+            "content_type": content_type,
+            "content_encoding": encoding,
+            "content_length": len(content),
+            **(header or {}),
+        }
+        if compression:
+            header_to_send["content_compression"] = compression
+        print(f"Sending: {header_to_send}")
+        encoded_header = json.dumps(header_to_send).encode(encoding)
+        preamble = encode_preamble(
+            len(encoded_header), len(content), self.protocol_version
+        )
+        self.transport.writelines(merge_frame(preamble, encoded_header, content))
+
+    async def drain(self) -> None:
+        """ Waits until the transport resumes writing. """
+
+        if not self.paused:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self.drain_waiters.append(waiter)
+        await waiter
+
+    def pause_writing(self) -> None:
+        self.paused = True
+
+    def resume_writing(self) -> None:
+        self.paused = False
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.drain_waiters.clear()
+
+    @staticmethod
+    def is_close_frame(header: Dict) -> bool:
+        return header.get("content_type") == CLOSE_CONTENT_TYPE
+
+    def close(self) -> None:
+        """ Closing the socket. """
+        print("Close the socket.")
+        if self.transport is not None:
+            self.transport.close()
+
+    @property
+    def is_closing(self) -> bool:
+        return self.transport is None or self.transport.is_closing()
@@ -0,0 +1,84 @@
+""" Limits the cost of custom queries sent by clients. """
+
+from typing import *
+
+import json
+
+import asyncpg
+
+from metrics import metrics
+
+
+class QueryRejected(Exception):
+    """ Raised when the custom query is rejected or cancelled. error is sent in the answer. """
+
+    def __init__(self, message: str, error: str):
+        super().__init__(message)
+        self.error = error
+
+
+class QueryGuard:
+    """
+    Prepares the read-only transaction of the custom query: sets statement_timeout
+    (in seconds) for it and, when max_cost is set, rejects queries whose EXPLAIN plan
+    costs more. Rejected and cancelled queries are counted and logged with their cost.
+    """
+
+    def __init__(
+        self,
+        statement_timeout: Optional[float],
+        max_rows: int,
+        max_cost: Optional[float],
+    ):
+        self.statement_timeout = statement_timeout
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+
+    async def check(
+        self, conn: asyncpg.Connection, sql: str, args: Tuple
+    ) -> Optional[float]:
+        """ Sets the limits in the transaction of the connection. Returns the plan cost when it is checked. """
+
+        metrics.incr("custom_query.queries")
+        if self.statement_timeout is not None:
+            await conn.fetchval(
+                "SELECT set_config('statement_timeout', $1, true)",
+                str(int(self.statement_timeout * 1000)),
+            )
+        if self.max_cost is None:
+            return None
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        cost = plan[0]["Plan"]["Total Cost"]
+        if cost > self.max_cost:
+            metrics.incr("custom_query.rejected")
+            print(f"Rejecting the custom query with plan cost: {cost}. Query: {sql}")
+            raise QueryRejected(
+                f"The query is too expensive. Plan cost: {cost:.0f}, "
+                f"maximal cost: {self.max_cost:.0f}.",
+                "query_rejected",
+            )
+        return cost
+
+    def cancelled(self, cost: Optional[float], sql: str) -> QueryRejected:
+        """ Counts the query cancelled by statement_timeout and returns the error to raise. """
+
+        metrics.incr("custom_query.cancelled")
+        print(
+            f"The custom query was cancelled after {self.statement_timeout} seconds, "
+            f"plan cost: {cost}. Query: {sql}"
+        )
+        return QueryRejected(
+            f"The query was cancelled after {self.statement_timeout} seconds.",
+            "timeout",
+        )
+
+    def capped(self, sql: str) -> None:
+        metrics.incr("custom_query.capped")
+        print(
+            f"The answer of the custom query was cut to {self.max_rows} rows. Query: {sql}"
+        )
+
+    def stats(self) -> Dict[str, float]:
+        return metrics.snapshot("custom_query.")
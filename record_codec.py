@@ -0,0 +1,169 @@
+""" Compact binary encoding of query results sent with the "records" content type.
+
+The encoded result starts with the schema: the format version, the number of columns,
+and for every column its type code and name. The number of rows follows, then the values
+column after column. Every column consists of the nulls flag (with one byte per row
+marking nulls when the column contains any), and values of its non-null rows:
+8-byte integers, 8-byte floats, 1-byte bools, or 4-byte lengths followed by
+UTF-8 strings (for text and for any other value encoded to JSON).
+"""
+
+from typing import *
+
+import itertools
+import json
+import struct
+
+VERSION = 1
+
+NULL = 0
+INT = 1
+FLOAT = 2
+BOOL = 3
+TEXT = 4
+JSON = 5
+
+INT_MIN = -(2 ** 63)
+INT_MAX = 2 ** 63 - 1
+
+schema_header = struct.Struct(">BH")
+column_header = struct.Struct(">BH")
+rows_header = struct.Struct(">I")
+nulls_flag = struct.Struct(">?")
+
+
+def get_column_type(values: List[Any]) -> int:
+    """ Chooses the type of the column which can hold all its not null values. """
+
+    types = {type(value) for value in values if value is not None}
+    if not types:
+        return NULL
+    if types == {bool}:
+        return BOOL
+    if types == {int}:
+        if all(INT_MIN <= value <= INT_MAX for value in values if value is not None):
+            return INT
+        return JSON
+    if types == {float}:
+        return FLOAT
+    if types == {str}:
+        return TEXT
+    return JSON
+
+
+def encode_column(column_type: int, values: List[Any]) -> List[bytes]:
+    """ Encodes the not null values of the column. """
+
+    if column_type == NULL:
+        return []
+    if column_type == INT:
+        return [struct.pack(">%dq" % len(values), *values)]
+    if column_type == FLOAT:
+        return [struct.pack(">%dd" % len(values), *values)]
+    if column_type == BOOL:
+        return [bytes(values)]
+    if column_type == TEXT:
+        encoded = [value.encode("utf-8") for value in values]
+    else:
+        encoded = [json.dumps(value).encode("utf-8") for value in values]
+    return [
+        struct.pack(">%dI" % len(encoded), *map(len, encoded)),
+        b"".join(encoded),
+    ]
+
+
+def encode_rows(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> bytes:
+    """ Encodes rows given as sequences of values in the order of columns. """
+
+    parts = [schema_header.pack(VERSION, len(columns))]
+    values_by_column = list(zip(*rows)) if rows else [()] * len(columns)
+    column_types = [get_column_type(values) for values in values_by_column]
+    for name, column_type in zip(columns, column_types):
+        name = name.encode("utf-8")
+        parts.append(column_header.pack(column_type, len(name)))
+        parts.append(name)
+    parts.append(rows_header.pack(len(rows)))
+    for column_type, values in zip(column_types, values_by_column):
+        nulls = bytes(value is None for value in values)
+        has_nulls = any(nulls) and column_type != NULL
+        parts.append(nulls_flag.pack(has_nulls))
+        if has_nulls:
+            parts.append(nulls)
+            values = [value for value in values if value is not None]
+        parts.extend(encode_column(column_type, values))
+    return b"".join(parts)
+
+
+def encode_records(records: List[Dict]) -> bytes:
+    """ Encodes the list of rows. All rows must have the same columns, otherwise raises ValueError. """
+
+    columns = tuple(records[0]) if records else ()
+    rows = []
+    for record in records:
+        if tuple(record) != columns:
+            raise ValueError("All records must have the same columns.")
+        rows.append(tuple(record.values()))
+    return encode_rows(columns, rows)
+
+
+def decode_column(
+    column_type: int, data: memoryview, offset: int, count: int
+) -> Tuple[List[Any], int]:
+    """ Decodes count not null values of the column. Returns them and the offset after them. """
+
+    if column_type == NULL:
+        return [None] * count, offset
+    if column_type == INT:
+        values = struct.unpack_from(">%dq" % count, data, offset)
+        return list(values), offset + 8 * count
+    if column_type == FLOAT:
+        values = struct.unpack_from(">%dd" % count, data, offset)
+        return list(values), offset + 8 * count
+    if column_type == BOOL:
+        values = [bool(value) for value in data[offset : offset + count]]
+        return values, offset + count
+    lengths = struct.unpack_from(">%dI" % count, data, offset)
+    offset += 4 * count
+    blob = bytes(data[offset : offset + sum(lengths)])
+    ends = list(itertools.accumulate(lengths))
+    starts = [0] + ends[:-1]
+    values = [blob[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+    if column_type == JSON:
+        values = [json.loads(value) for value in values]
+    return values, offset + len(blob)
+
+
+def decode_records(data: Union[bytes, bytearray, memoryview]) -> List[Dict]:
+    """ Decodes rows encoded by encode_records. """
+
+    data = memoryview(data)
+    version, columns_count = schema_header.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError(f"Unsupported records format version: {version}.")
+    offset = schema_header.size
+    columns = []
+    for _ in range(columns_count):
+        column_type, name_len = column_header.unpack_from(data, offset)
+        offset += column_header.size
+        name = str(data[offset : offset + name_len], "utf-8")
+        offset += name_len
+        columns.append((name, column_type))
+    (rows_count,) = rows_header.unpack_from(data, offset)
+    offset += rows_header.size
+    values_by_column = []
+    for name, column_type in columns:
+        (has_nulls,) = nulls_flag.unpack_from(data, offset)
+        offset += nulls_flag.size
+        if has_nulls:
+            nulls = data[offset : offset + rows_count]
+            offset += rows_count
+            count = rows_count - sum(nulls)
+        else:
+            count = rows_count
+        values, offset = decode_column(column_type, data, offset, count)
+        if has_nulls:
+            values = iter(values)
+            values = [None if null else next(values) for null in nulls]
+        values_by_column.append(values)
+    names = [name for name, column_type in columns]
+    return [dict(zip(names, row)) for row in zip(*values_by_column)]
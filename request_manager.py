@@ -2,24 +2,486 @@
 
 from typing import *
 
+import asyncio
+import time
+
 import asyncpg
 
-from settings import DATABASES
+from db_pool import DBPool
+from db_router import DBRouter
+from metrics import metrics
+from movie_index import MovieIndex
+from pagination import (
+    Page,
+    FIRST_KEY,
+    encode_token,
+    decode_token,
+    quote_identifier,
+)
+from result_cache import ResultCache
+from query_guard import QueryGuard, QueryRejected
+from result_rows import Rows, convert_records
+from single_flight import SingleFlight
+from settings import (
+    DATABASES,
+    DB_POOL,
+    DB_ROUTER,
+    RESULT_CACHE,
+    BATCH,
+    PAGINATION,
+    MOVIE_INDEX,
+    CUSTOM_QUERY,
+    DETAILS,
+)
+
+
+class Query(NamedTuple):
+    """
+    SQL of the request with its parameters. statement names the prepared statement running it.
+    The query returns at most limit rows and one more when there is the next page. key is
+    the column with keys of the page, it is not sent when it is hidden.
+    """
+
+    sql: str
+    args: Tuple = ()
+    statement: Optional[str] = None
+    limit: Optional[int] = None
+    key: Optional[str] = None
+    hidden_key: bool = False
 
 
 class RequestManager:
     dsn_format = "postgresql://{USER}:{PASSWORD}@{HOST}:{PORT}/{NAME}"
+    # Statements of the built-in categories, prepared once on every pooled connection.
+    # Pages of rows are ordered by the unique page_key, which follows the after key $2,
+    # and limited by $3 (NULL means no limit).
+    statements = {
+        "title": """
+        SELECT movies.id AS page_key, movies.* FROM movies_metadata movies
+        WHERE movies.title = $1
+        AND movies.id > $2::bigint
+        ORDER BY movies.id LIMIT $3
+        """,
+        # People are looked up in views created by DBManager, see db_manager.LOOKUP_VIEWS
+        "actor": """
+        SELECT id AS page_key, title FROM actor_titles
+        WHERE name = $1
+        AND id > $2::bigint
+        ORDER BY id LIMIT $3
+        """,
+        "director": """
+        SELECT id AS page_key, title FROM crew_titles
+        WHERE role = 'director'
+        AND name = $1
+        AND id > $2::bigint
+        ORDER BY id LIMIT $3
+        """,
+        "screenplay": """
+        SELECT id AS page_key, title FROM crew_titles
+        WHERE role = 'screenplay'
+        AND name = $1
+        AND id > $2::bigint
+        ORDER BY id LIMIT $3
+        """,
+        # The movie with its genres, companies, countries, languages, keywords, the first
+        # $4 members of the cast and the crew with jobs $5, aggregated to JSON in one query
+        "details": """
+        SELECT movies.id AS page_key, movies.*,
+        COALESCE(genres.names, '[]') AS genres,
+        COALESCE(companies.names, '[]') AS production_companies,
+        COALESCE(countries.names, '[]') AS production_countries,
+        COALESCE(languages.names, '[]') AS spoken_languages,
+        COALESCE(keywords.names, '[]') AS keywords,
+        COALESCE(cast_members.members, '[]') AS "cast",
+        COALESCE(key_crew.members, '[]') AS crew
+        FROM movies_metadata movies
+        LEFT JOIN LATERAL (
+            SELECT json_agg(DISTINCT genres.name) AS names
+            FROM movie_metadata_association association
+            INNER JOIN genres ON genres.id = association.genres
+            WHERE association.movies_metadata = movies.id
+        ) genres ON true
+        LEFT JOIN LATERAL (
+            SELECT json_agg(DISTINCT production_companies.name) AS names
+            FROM movie_metadata_association association
+            INNER JOIN production_companies
+            ON production_companies.id = association.production_companies
+            WHERE association.movies_metadata = movies.id
+        ) companies ON true
+        LEFT JOIN LATERAL (
+            SELECT json_agg(DISTINCT countries.name) AS names
+            FROM movie_metadata_association association
+            INNER JOIN countries ON countries.id = association.countries
+            WHERE association.movies_metadata = movies.id
+        ) countries ON true
+        LEFT JOIN LATERAL (
+            SELECT json_agg(DISTINCT languages.name) AS names
+            FROM movie_metadata_association association
+            INNER JOIN languages ON languages.id = association.languages
+            WHERE association.movies_metadata = movies.id
+        ) languages ON true
+        LEFT JOIN LATERAL (
+            SELECT array_to_json(keywords.keywords) AS names
+            FROM keywords
+            WHERE keywords.movie_id = movies.id
+            LIMIT 1
+        ) keywords ON true
+        LEFT JOIN LATERAL (
+            SELECT json_agg(
+                json_build_object('name', actors.name, 'character', characters.character)
+                ORDER BY characters."order"
+            ) AS members
+            FROM (
+                SELECT * FROM characters
+                WHERE characters.movie_id = movies.id
+                ORDER BY characters."order" LIMIT $4
+            ) characters
+            INNER JOIN actors ON actors.id = characters.actor_id
+        ) cast_members ON true
+        LEFT JOIN LATERAL (
+            SELECT json_agg(
+                json_build_object(
+                    'name', crew_members.name,
+                    'job', crew.job,
+                    'department', crew.department
+                )
+                ORDER BY crew.id
+            ) AS members
+            FROM crew
+            INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
+            WHERE crew.movie_id = movies.id
+            AND crew.job = ANY($5::text[])
+        ) key_crew ON true
+        WHERE movies.title = $1
+        AND movies.id > $2::bigint
+        ORDER BY movies.id LIMIT $3
+        """,
+    }
 
-    def __init__(self, db_config: Dict = DATABASES["docker"]):
+    def __init__(
+        self,
+        db_config: Dict = DATABASES["docker"],
+        pool_config: Dict = DB_POOL,
+        cache_config: Dict = RESULT_CACHE,
+        batch_config: Dict = BATCH,
+        pagination_config: Dict = PAGINATION,
+        router_config: Dict = DB_ROUTER,
+        index_config: Dict = MOVIE_INDEX,
+        custom_query_config: Dict = CUSTOM_QUERY,
+        details_config: Dict = DETAILS,
+    ):
         self.dsn = self.dsn_format.format(**db_config)
         self.encoding = "utf-8"
+        # Lookups of the built-in categories are read from replicas
+        self.db = self.create_db(db_config, pool_config, self.statements, router_config)
+        # Custom queries have their own smaller pool, so they can not take all connections
+        self.custom_db = self.create_db(
+            db_config, custom_query_config["POOL"], None, router_config
+        )
+        self.guard = QueryGuard(
+            custom_query_config["STATEMENT_TIMEOUT"],
+            custom_query_config["MAX_ROWS"],
+            custom_query_config["MAX_COST"],
+        )
+        self.cache: Optional[ResultCache] = None
+        if cache_config["ENABLED"]:
+            self.cache = ResultCache(
+                cache_config["MAX_ENTRIES"],
+                cache_config["MAX_BYTES"],
+                cache_config["TTL"],
+            )
+        self.notify_channel = cache_config["NOTIFY_CHANNEL"]
+        self.listen_retry_min = cache_config["LISTEN_RETRY_MIN"]
+        self.listen_retry_max = cache_config["LISTEN_RETRY_MAX"]
+        # Connection receiving notifications about changes of the data version, it is
+        # connected again by the version_watch task after it closes
+        self.version_listener: Optional[asyncpg.Connection] = None
+        self.version_listener_closed: Optional[asyncio.Event] = None
+        self.version_watch: Optional[asyncio.Future] = None
+        self.start_lock: Optional[asyncio.Lock] = None
+        # Identical lookups requested at once share one query
+        self.single_flight = SingleFlight()
+        self.max_batch_items = batch_config["MAX_ITEMS"]
+        self.batch_parallelism = batch_config["PARALLELISM"]
+        self.default_page_size = pagination_config["DEFAULT_PAGE_SIZE"]
+        self.max_page_size = pagination_config["MAX_PAGE_SIZE"]
+        self.index_enabled = index_config["ENABLED"]
+        self.load_index_on_start = index_config["LOAD_ON_START"]
+        # Answers lookups of the built-in categories, it is replaced by the rebuilt one
+        self.index: Optional[MovieIndex] = None
+        self.index_rebuild: Optional[asyncio.Future] = None
+        self.index_rebuild_pending = False
+        # Members of the cast and jobs of the crew in answers of the details category
+        self.details_cast_size = details_config["CAST_SIZE"]
+        self.details_crew_jobs = tuple(details_config["CREW_JOBS"])
+        # Changes of the data are not noticed while the listener is disconnected, so
+        # the index is dropped until it is rebuilt after the listener connects again
+        self.index_outdated = False
+
+    def create_db(
+        self,
+        db_config: Dict,
+        pool_config: Dict,
+        statements: Optional[Dict[str, str]],
+        router_config: Dict,
+    ) -> DBRouter:
+        """ Creates pools of the database and of its replicas. """
+
+        replicas = [
+            DBPool(
+                self.dsn_format.format(**{**db_config, **replica}),
+                pool_config,
+                statements,
+            )
+            for replica in db_config.get("REPLICAS", [])
+        ]
+        return DBRouter(
+            DBPool(self.dsn, pool_config, statements), replicas, router_config
+        )
+
+    async def start(self) -> None:
+        """
+        Creates the database pools shared by all requests and starts watching the data version.
+        Requests starting it at once wait for the first one.
+        """
+
+        if self.start_lock is None:
+            self.start_lock = asyncio.Lock()
+        async with self.start_lock:
+            if not self.db.started:
+                await self.db.start()
+            if not self.custom_db.started:
+                await self.custom_db.start()
+            self.start_version_watch()
+            if (
+                self.index_enabled
+                and self.load_index_on_start
+                and self.index_rebuild is None
+            ):
+                # Loaded once, later it is rebuilt when the data version changes
+                self.schedule_index_rebuild()
+                await self.index_rebuild
+
+    async def close(self) -> None:
+        """ Closes the database pool. """
+
+        if self.version_watch is not None:
+            version_watch, self.version_watch = self.version_watch, None
+            version_watch.cancel()
+        if self.version_listener is not None:
+            listener, self.version_listener = self.version_listener, None
+            await listener.close()
+        if self.index_rebuild is not None:
+            self.index_rebuild.cancel()
+        await self.db.close()
+        await self.custom_db.close()
+
+    def pool_stats(self) -> Dict[str, int]:
+        return self.db.stats()
+
+    def node_stats(self) -> Dict[str, Dict]:
+        return self.db.node_stats()
+
+    def cache_stats(self) -> Dict[str, float]:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def single_flight_stats(self) -> Dict[str, float]:
+        return self.single_flight.stats()
+
+    def custom_query_stats(self) -> Dict[str, Any]:
+        return {"pool": self.custom_db.stats(), **self.guard.stats()}
+
+    def index_stats(self) -> Dict[str, float]:
+        if not self.index_enabled:
+            return {}
+        return {
+            **(self.index.stats() if self.index is not None else {}),
+            **metrics.snapshot("movie_index."),
+        }
+
+    def invalidate_cache(self) -> None:
+        """ Drops all cached answers. """
+
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def start_version_watch(self) -> None:
+        """ Starts the task watching the data version once, when answers are cached or indexed. """
+
+        if (
+            self.cache is not None or self.index_enabled
+        ) and self.version_watch is None:
+            self.version_watch = asyncio.ensure_future(self.watch_data_version())
+
+    async def watch_data_version(self) -> None:
+        """
+        Keeps the listener of notifications sent by DBManager.bump_data_version connected.
+        After the listener closes or fails to connect, it is connected again after
+        listen_retry_min seconds, doubled after every failed attempt up to listen_retry_max.
+        Nothing is cached while it is disconnected.
+        """
+
+        delay = self.listen_retry_min
+        while True:
+            self.version_listener_closed = asyncio.Event()
+            try:
+                await self.listen_data_version()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(
+                    f"An error occurred: {e} when watching the data version. "
+                    f"Retrying in {delay} seconds."
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.listen_retry_max)
+                continue
+            delay = self.listen_retry_min
+            await self.version_listener_closed.wait()
+            print("The listener of the data version closed. Reconnecting.")
+
+    async def connect_listener(self) -> asyncpg.Connection:
+        return await asyncpg.connect(self.dsn)
+
+    async def listen_data_version(self) -> None:
+        """ Connects the listener and reads the current data version. """
+
+        listener = await self.connect_listener()
+        try:
+            await listener.add_listener(self.notify_channel, self.on_data_version)
+            version = await self.fetch_data_version(listener)
+        except BaseException:
+            listener.terminate()
+            raise
+        self.version_listener = listener
+        listener.add_termination_listener(self.on_version_listener_closed)
+        if listener.is_closed():
+            # Closed before the termination listener was added
+            self.on_version_listener_closed(listener)
+            return
+        if self.cache is not None:
+            self.cache.set_version(version)
+        if self.index_outdated:
+            self.index_outdated = False
+            self.schedule_index_rebuild()
+
+    @staticmethod
+    async def fetch_data_version(conn: asyncpg.Connection) -> int:
+        try:
+            version = await conn.fetchval(
+                "SELECT version FROM data_version WHERE id = 1"
+            )
+        except asyncpg.UndefinedTableError:
+            return 0
+        return version or 0
+
+    def on_data_version(
+        self, conn: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        print(f"The data version changed to {payload}.")
+        if self.cache is not None:
+            self.cache.set_version(int(payload))
+        if self.index_enabled:
+            self.schedule_index_rebuild()
+
+    def on_version_listener_closed(self, conn: asyncpg.Connection) -> None:
+        if self.version_listener is conn:
+            self.version_listener = None
+            if self.cache is not None:
+                self.cache.set_version(None)
+            if self.index is not None:
+                print("Dropping the movie index until the listener connects again.")
+                self.index = None
+                self.index_outdated = True
+            self.version_listener_closed.set()
+
+    def schedule_index_rebuild(self) -> None:
+        """ Rebuilds the index in the background, once more when the data changes meanwhile. """
+
+        self.index_rebuild_pending = True
+        if self.index_rebuild is None or self.index_rebuild.done():
+            self.index_rebuild = asyncio.ensure_future(
+                self.rebuild_index_while_pending()
+            )
+
+    async def rebuild_index_while_pending(self) -> None:
+        while self.index_rebuild_pending:
+            self.index_rebuild_pending = False
+            await self.rebuild_index()
+
+    async def rebuild_index(self) -> None:
+        """
+        Loads the index of the current data from the primary database and swaps it for
+        the old one at once. Lookups are answered by the old index, or by the database,
+        until it is loaded. The index loaded while the listener is disconnected is dropped
+        until it connects again.
+        """
+
+        start = time.perf_counter()
+        try:
+            # Replicas may not have replayed the upload which triggered the rebuild yet
+            async with self.db.acquire() as conn:
+                version = await self.fetch_data_version(conn)
+                index = await MovieIndex.load(conn, version)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"An error occurred: {e} when loading the movie index.")
+            metrics.incr("movie_index.load_errors")
+            return
+        metrics.incr("movie_index.loads")
+        if self.version_listener is None:
+            print("Dropping the loaded movie index until the listener connects again.")
+            self.index_outdated = True
+            return
+        self.index = index
+        print(
+            f"Loaded the movie index of the data version {version} "
+            f"in {time.perf_counter() - start:.2f} seconds, it takes {index.size} bytes."
+        )
+
+    def lookup_index(self, query: Query) -> Optional[Rows]:
+        """ Gets records of the built-in category from the index. None means they must be queried. """
+
+        index = self.index
+        if index is None or query.statement is None:
+            return None
+        value, after, limit = query.args[:3]
+        return index.lookup(query.statement, value, after, limit)
 
     async def entrypoint(self, request: Any) -> Dict:
-        """ Processes the request message to get information from it and creates the database pool. """
+        """ Processes the request message to get information from it and queries the database. """
 
         request = self.process_request(request)
-        async with asyncpg.create_pool(self.dsn) as db:
-            return await self.handle_request(db, request)
+        if not self.db.started:
+            await self.start()
+        return await self.handle_request(self.db, request)
+
+    async def stream(self, request: Any, chunk_size: int) -> AsyncIterator[Dict]:
+        """ Processes the request message and yields the answer in chunks of at most chunk_size rows. """
+
+        request = self.process_request(request)
+        if not self.db.started:
+            await self.start()
+        if request.get("category") == "batch":
+            yield await self.handle_request(self.db, request)
+            return
+        # Streamed answers are not paged, they are sent in chunks instead
+        query, answer = self.get_query(request, paged=False)
+        if query is None:
+            yield self.give_response(answer)
+            return
+        records = self.lookup_index(query)
+        if records is not None:
+            records = self.hide_key(records, query)
+            for start in range(0, len(records), chunk_size):
+                yield self.give_response(records[start : start + chunk_size])
+            return
+        try:
+            async for response in self.stream_db(self.db, query, chunk_size):
+                yield response
+        except QueryRejected as e:
+            yield self.give_error(e)
 
     @classmethod
     def process_request(cls, request: Any) -> Dict:
@@ -46,21 +508,165 @@ class RequestManager:
                 "category": "wrong_type",
             }
 
-    async def handle_request(self, db: asyncpg.pool.Pool, request: Dict) -> Dict:
+    async def handle_request(self, db: DBRouter, request: Dict) -> Dict:
         """ Manages the requests. If the request is proper, queries the database. """
 
+        if request.get("category") == "batch":
+            return self.give_response(await self.handle_batch(db, request.get("items")))
+        query, answer = self.get_query(request)
+        if query is None:
+            return self.give_response(answer)
+        records = self.lookup_index(query)
+        if records is not None:
+            return self.give_page(records, query, request)
+        return await self.query_cached(db, query, request)
+
+    async def query_cached(self, db: DBRouter, query: Query, request: Dict) -> Dict:
+        """
+        Gets the answer of the built-in category from the cache or queries the database
+        and caches it. The answer depends only on the statement and its parameters,
+        so identical lookups requested at once share one query.
+        """
+
+        if query.statement is None:
+            return await self.query_page(db, query, request)
+        key = (query.statement, query.args)
+        if self.cache is not None:
+            answer = self.cache.get(key)
+            if answer is not None:
+                return answer
+        return await self.single_flight.run(
+            key, lambda: self.query_and_cache(db, query, request, key)
+        )
+
+    async def query_and_cache(
+        self, db: DBRouter, query: Query, request: Dict, key: Hashable
+    ) -> Dict:
+        # The answer is not cached when the data version changes during the query
+        version = self.cache.version if self.cache is not None else None
+        records, version = await self.query_versioned(db, query, version)
+        answer = self.give_page(records, query, request)
+        if self.cache is not None:
+            self.cache.put(key, answer, version)
+        return answer
+
+    async def query_versioned(
+        self, db: DBRouter, query: Query, version: Optional[int]
+    ) -> Tuple[Rows, Optional[int]]:
+        """
+        Runs the prepared statement and gets the data version its answer can be cached with.
+        The replica may not have replayed the upload of the version yet, so its answer
+        gets no version unless the replica reads the same version on the connection.
+        """
+
+        connection = db.acquire(read_only=True)
+        async with connection as conn:
+            if (
+                version is not None
+                and connection.node.replica
+                and await self.fetch_data_version(conn) != version
+            ):
+                version = None
+            statement = conn.statements[query.statement]
+            return convert_records(await statement.fetch(*query.args)), version
+
+    async def query_page(self, db: DBRouter, query: Query, request: Dict) -> Dict:
+        try:
+            records = await self.query_db(db, query)
+        except QueryRejected as e:
+            return self.give_error(e)
+        return self.give_page(records, query, request)
+
+    def give_page(
+        self, records: Union[Rows, List[Dict]], query: Query, request: Dict
+    ) -> Dict:
+        """
+        Gives the answer with at most limit rows. When there are more rows, the answer has
+        the next token to send as the after item of the request for the next page, or
+        is marked as truncated when the query has no page key.
+        """
+
+        more = query.limit is not None and len(records) > query.limit
+        if more:
+            records = records[: query.limit]
+        after = records[-1][query.key] if more and query.key else None
+        response = self.give_response(self.hide_key(records, query))
+        if after is not None and isinstance(after, (int, float, str)):
+            response["next"] = encode_token(request, after)
+        elif more:
+            response["truncated"] = True
+        return response
+
+    async def handle_batch(self, db: DBRouter, items: Any) -> Union[str, List[Dict]]:
+        """
+        Answers requests of the batch concurrently, at most batch_parallelism at once.
+        Every item gets its own answer, failed items get the answer with the error.
+        """
+
+        if not isinstance(items, list) or not items:
+            return "Wrong batch content. Required items: list of requests."
+        if len(items) > self.max_batch_items:
+            return f"Too many batch items. Maximal number of items: {self.max_batch_items}."
+        semaphore = asyncio.Semaphore(self.batch_parallelism)
+
+        async def handle_item(item: Any) -> Dict:
+            request = self.process_request(item)
+            if request.get("category") == "batch":
+                return self.give_response(self.wrong_request())
+            async with semaphore:
+                try:
+                    return await self.handle_request(db, request)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"An error occurred: {e} when processing batch item: {item}.")
+                    return {
+                        **self.give_response("The request can not be processed."),
+                        "error": "request_failed",
+                    }
+
+        return await asyncio.gather(*(handle_item(item) for item in items))
+
+    def get_query(
+        self, request: Dict, paged: bool = True
+    ) -> Tuple[Optional[Query], Optional[str]]:
+        """ Gets the database query for the request. When the request is wrong, gets the answer to it instead. """
+
         category = request.get("category")
         query = request.get("query")
         try:
-            query = self.query_manager[category](query)
+            get_query = self.query_manager[category]
         except KeyError:
-            answer = "The request can not be processed."
-        else:
-            if category in ["wrong_type", "wrong_request"]:
-                answer = query
-            else:
-                answer = await self.query_db(db, query)
-        return self.give_response(answer)
+            return None, "The request can not be processed."
+        if category in ["wrong_type", "wrong_request"]:
+            return None, get_query(query)
+        try:
+            page = self.get_page(request) if paged else Page(key=request.get("key"))
+        except ValueError as e:
+            return None, str(e)
+        return get_query(query, page), None
+
+    def get_page(self, request: Dict) -> Page:
+        """
+        Gets the page of the request from its limit (at most max_page_size rows) and after
+        (the token of the previous answer) items. When they are wrong, raises ValueError.
+        """
+
+        limit = request.get("limit", self.default_page_size)
+        if type(limit) != int or limit <= 0:
+            raise ValueError("Wrong limit. Required limit: positive integer.")
+        after = request.get("after")
+        if after is not None:
+            after = decode_token(request, after)
+            if request.get("category") != "custom" and type(after) != int:
+                raise ValueError("Wrong continuation token.")
+        key = request.get("key") if request.get("category") == "custom" else None
+        if key is not None and type(key) != str:
+            raise ValueError("Wrong key. Required key: column name.")
+        max_page_size = self.max_page_size
+        if request.get("category") == "custom":
+            max_page_size = min(max_page_size, self.guard.max_rows)
+        return Page(min(limit, max_page_size), after, key)
 
     @property
     def query_manager(self) -> Dict[str, Callable]:
@@ -69,58 +675,67 @@ class RequestManager:
             "actor": self.get_by_actor,
             "director": self.get_by_director,
             "screenplay": self.get_by_screenplay,
+            "details": self.get_details,
             "custom": self.custom_query,
             "wrong_request": self.wrong_request,
             "wrong_type": self.wrong_type,
         }
 
-    @staticmethod
-    def get_by_title(title: str) -> str:
-        return """
-        SELECT * FROM movies_metadata movies
-        WHERE movies.title = '%s'
-        """ % (
-            title,
-        )
+    @classmethod
+    def get_by_title(cls, title: str, page: Page = Page()) -> "Query":
+        return cls.prepared_query("title", title, page)
 
-    @staticmethod
-    def get_by_actor(actor: str) -> str:
-        return """
-        SELECT title FROM movies_metadata movies
-        INNER JOIN characters ON characters.movie_id = movies.id
-        INNER JOIN actors ON actors.id = characters.actor_id
-        WHERE actors.name = '%s';
-        """ % (
-            actor,
-        )
+    @classmethod
+    def get_by_actor(cls, actor: str, page: Page = Page()) -> "Query":
+        return cls.prepared_query("actor", actor, page)
 
-    @staticmethod
-    def get_by_director(director: str) -> str:
-        return """
-        SELECT title FROM movies_metadata movies
-        INNER JOIN crew ON crew.movie_id = movies.id
-        INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
-        WHERE crew.job = 'Director'
-        AND crew_members.name = '%s';
-        """ % (
-            director,
-        )
+    @classmethod
+    def get_by_director(cls, director: str, page: Page = Page()) -> "Query":
+        return cls.prepared_query("director", director, page)
 
-    @staticmethod
-    def get_by_screenplay(screenplay: str) -> str:
-        return """
-        SELECT title FROM movies_metadata movies
-        INNER JOIN crew ON crew.movie_id = movies.id
-        INNER JOIN crew_members ON crew_members.id = crew.crew_member_id
-        WHERE crew.department = 'Writing'
-        AND crew_members.name = '%s';
-        """ % (
-            screenplay,
+    @classmethod
+    def get_by_screenplay(cls, screenplay: str, page: Page = Page()) -> "Query":
+        return cls.prepared_query("screenplay", screenplay, page)
+
+    def get_details(self, title: str, page: Page = Page()) -> "Query":
+        return self.prepared_query(
+            "details", title, page, self.details_cast_size, self.details_crew_jobs
         )
 
     @classmethod
-    def custom_query(cls, query: str) -> str:
-        return cls.clean_query(query)
+    def prepared_query(
+        cls, name: str, value: str, page: Page, *extra_args: Any
+    ) -> "Query":
+        """ Gets the query running the statement prepared on every pooled connection. """
+
+        after = FIRST_KEY if page.after is None else page.after
+        args = (value, after, cls.get_fetch_limit(page), *extra_args)
+        return Query(cls.statements[name], args, name, page.limit, "page_key", True)
+
+    @classmethod
+    def custom_query(cls, query: str, page: Page = Page()) -> "Query":
+        """
+        Gets the custom query. It is paged by the key column given by the client, whose
+        values must be unique. Without the key column the answer is truncated to the limit.
+        """
+
+        query = cls.clean_query(query)
+        if page.key is None:
+            return Query(query, limit=page.limit)
+        key = f"page.{quote_identifier(page.key)}"
+        query = query.rstrip().rstrip(";")
+        if page.after is None:
+            sql = f"SELECT * FROM ({query}) AS page ORDER BY {key} LIMIT $1"
+            args = (cls.get_fetch_limit(page),)
+        else:
+            sql = f"SELECT * FROM ({query}) AS page WHERE {key} > $1 ORDER BY {key} LIMIT $2"
+            args = (page.after, cls.get_fetch_limit(page))
+        return Query(sql, args, limit=page.limit, key=page.key)
+
+    @staticmethod
+    def get_fetch_limit(page: Page) -> Optional[int]:
+        # One more row tells that there is the next page
+        return page.limit + 1 if page.limit is not None else None
 
     @staticmethod
     def wrong_request(*args) -> str:
@@ -135,26 +750,100 @@ class RequestManager:
         query = query.replace("\n", "")
         return query
 
-    @classmethod
-    async def query_db(cls, db: asyncpg.pool.Pool, query: str) -> list:
+    async def query_db(self, db: DBRouter, query: Query) -> Rows:
+        """
+        Runs the prepared statement of the query, or iterates over the cursor of the custom query.
+        All rows of the result are converted at once.
+        """
+
+        if query.statement is None:
+            return await self.query_custom(query)
+        async with db.acquire(read_only=True) as conn:
+            statement = conn.statements[query.statement]
+            return convert_records(await statement.fetch(*query.args))
+
+    async def query_custom(self, query: Query) -> Rows:
+        """
+        Runs the custom query in the read-only transaction of the custom query pool. It reads
+        at most one row more than the limit, and at most max_rows rows without the limit.
+        """
+
+        max_rows = self.guard.max_rows if query.limit is None else query.limit + 1
         records = list()
-        async with db.acquire() as conn:
+        async with self.custom_db.acquire(read_only=True) as conn:
+            async with conn.transaction(readonly=True):
+                cost = await self.guard.check(conn, query.sql, query.args)
+                try:
+                    async for record in conn.cursor(query.sql, *query.args):
+                        records.append(record)
+                        if len(records) >= max_rows:
+                            break
+                except asyncpg.QueryCanceledError:
+                    raise self.guard.cancelled(cost, query.sql)
+        return convert_records(records)
+
+    async def stream_db(
+        self, db: DBRouter, query: Query, chunk_size: int
+    ) -> AsyncIterator[Dict]:
+        """ Fetches rows from the cursor and yields answers with at most chunk_size rows. """
+
+        if query.statement is None:
+            async for response in self.stream_custom(query, chunk_size):
+                yield response
+            return
+        async with db.acquire(read_only=True) as conn:
             async with conn.transaction():
-                async for record in conn.cursor(query):
-                    record = cls.process_record(record)
-                    records.append(record)
-        return records
+                statement = conn.statements[query.statement]
+                cursor = await statement.cursor(*query.args)
+                while True:
+                    records = await cursor.fetch(chunk_size)
+                    if records:
+                        rows = self.hide_key(convert_records(records), query)
+                        yield self.give_response(rows)
+                    if len(records) < chunk_size:
+                        break
+
+    async def stream_custom(self, query: Query, chunk_size: int) -> AsyncIterator[Dict]:
+        """ Streams at most max_rows rows of the custom query, the last answer is marked when there are more. """
+
+        rows_left = self.guard.max_rows
+        async with self.custom_db.acquire(read_only=True) as conn:
+            async with conn.transaction(readonly=True):
+                cost = await self.guard.check(conn, query.sql, query.args)
+                try:
+                    cursor = await conn.cursor(query.sql, *query.args)
+                    while True:
+                        size = min(chunk_size, rows_left)
+                        records = await cursor.fetch(size)
+                        rows_left -= len(records)
+                        if records:
+                            yield self.give_response(convert_records(records))
+                        if len(records) < size:
+                            break
+                        if rows_left == 0:
+                            if await cursor.fetch(1):
+                                self.guard.capped(query.sql)
+                                yield {**self.give_response([]), "truncated": True}
+                            break
+                except asyncpg.QueryCanceledError:
+                    raise self.guard.cancelled(cost, query.sql)
 
     @staticmethod
-    def process_record(record: asyncpg.Record) -> Dict:
-        record = {**record}
-        try:
-            release_date = record["release_date"]
-        except KeyError:
-            pass
-        else:
-            record["release_date"] = release_date.strftime("%d-%b-%Y")
-        return record
+    def hide_key(
+        records: Union[Rows, List[Dict]], query: Query
+    ) -> Union[Rows, List[Dict]]:
+        if not query.hidden_key:
+            return records
+        if isinstance(records, Rows):
+            return records.without_column(query.key)
+        return [
+            {name: value for name, value in record.items() if name != query.key}
+            for record in records
+        ]
+
+    @classmethod
+    def give_error(cls, error: QueryRejected) -> Dict:
+        return {**cls.give_response(str(error)), "error": error.error}
 
     @staticmethod
     def give_response(answer: Union[str, List, Dict]) -> Dict:
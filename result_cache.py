@@ -0,0 +1,96 @@
+""" Caches answers of category lookups between uploads of the data. """
+
+from typing import *
+
+import collections
+import json
+import time
+
+from metrics import metrics
+from result_rows import to_json
+
+
+class CacheEntry(NamedTuple):
+    answer: Any
+    size: int
+    expires: float
+
+
+class ResultCache:
+    """
+    Keeps at most max_entries answers taking at most max_bytes (measured as JSON),
+    each for ttl seconds, and evicts the least recently used ones. Answers are stamped
+    with the data version, changing the version drops all of them.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: Optional[float]):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "collections.OrderedDict[Hashable, CacheEntry]" = (
+            collections.OrderedDict()
+        )
+        self.size: int = 0
+        # Version of the data in the database, None means it is unknown and nothing is cached
+        self.version: Optional[int] = None
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """ Returns the cached answer or None when it is missing or expired. """
+
+        entry = self.entries.get(key)
+        if entry is None:
+            metrics.incr("result_cache.misses")
+            return None
+        if entry.expires < time.monotonic():
+            self.remove(key)
+            metrics.incr("result_cache.expired")
+            metrics.incr("result_cache.misses")
+            return None
+        self.entries.move_to_end(key)
+        metrics.incr("result_cache.hits")
+        return entry.answer
+
+    def put(self, key: Hashable, answer: Any, version: Optional[int]) -> None:
+        """
+        Caches the answer read from the data of the version. Answers of an outdated
+        version and answers larger than max_bytes are not cached.
+        """
+
+        if version is None or version != self.version:
+            return
+        size = len(json.dumps(answer, default=to_json))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.remove(key)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        self.entries[key] = CacheEntry(answer, size, expires)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            metrics.incr("result_cache.evictions")
+
+    def remove(self, key: Hashable) -> None:
+        self.size -= self.entries.pop(key).size
+
+    def set_version(self, version: Optional[int]) -> None:
+        """ Drops all answers when the data version changes. """
+
+        if version != self.version:
+            self.version = version
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """ Drops all answers, e.g. when new data is uploaded. """
+
+        self.entries.clear()
+        self.size = 0
+        metrics.incr("result_cache.invalidations")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "version": self.version,
+            **metrics.snapshot("result_cache."),
+        }
@@ -0,0 +1,115 @@
+""" Converts rows of query results once per result set and keeps them as tuples. """
+
+from typing import *
+
+import datetime
+import decimal
+import functools
+import uuid
+
+# Columns whose values are converted, by their names
+DATE_COLUMNS = ("release_date",)
+DATE_FORMAT = "%d-%b-%Y"
+
+
+@functools.lru_cache(maxsize=65536)
+def format_date(value: datetime.date) -> str:
+    return value.strftime(DATE_FORMAT)
+
+
+def convert_date(value: Any) -> Any:
+    if value is None:
+        return None
+    return format_date(value)
+
+
+class ConversionPlan:
+    """ Looks at the columns of the result set once and converts values of the columns which need it. """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        self.converters = [
+            (position, convert_date)
+            for position, name in enumerate(self.columns)
+            if name in DATE_COLUMNS
+        ]
+
+    def convert(self, row: Sequence[Any]) -> tuple:
+        if not self.converters:
+            return tuple(row)
+        values = list(row)
+        for position, converter in self.converters:
+            values[position] = converter(values[position])
+        return tuple(values)
+
+
+class Rows:
+    """
+    Rows of the result set as tuples sharing one tuple of column names. It behaves like
+    the list of records (dicts), which are only built when they are needed, e.g. to encode
+    the answer as JSON. The records content type is encoded straight from the tuples.
+    """
+
+    def __init__(self, columns: Tuple[str, ...], rows: List[tuple]):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Dict]:
+        columns = self.columns
+        return (dict(zip(columns, row)) for row in self.rows)
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Dict, "Rows"]:
+        if isinstance(item, slice):
+            return Rows(self.columns, self.rows[item])
+        return dict(zip(self.columns, self.rows[item]))
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Rows):
+            return self.columns == other.columns and self.rows == other.rows
+        if isinstance(other, list):
+            return self.to_records() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Rows({self.to_records()!r})"
+
+    def to_records(self) -> List[Dict]:
+        return list(self)
+
+    def without_column(self, name: str) -> "Rows":
+        if name not in self.columns:
+            return self
+        position = self.columns.index(name)
+        columns = self.columns[:position] + self.columns[position + 1 :]
+        rows = [row[:position] + row[position + 1 :] for row in self.rows]
+        return Rows(columns, rows)
+
+
+def convert_records(records: Sequence[Any]) -> Rows:
+    """ Converts asyncpg records of one result set with one conversion plan. """
+
+    if not records:
+        return Rows((), [])
+    plan = ConversionPlan(records[0].keys())
+    convert = plan.convert
+    return Rows(plan.columns, [convert(record) for record in records])
+
+
+def to_json(obj: Any) -> Any:
+    """
+    Default of json.dumps, it encodes Rows as the list of records, and values of custom
+    queries without JSON types: numeric (exactly, as the string), dates, times and UUIDs.
+    """
+
+    if isinstance(obj, Rows):
+        return obj.to_records()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
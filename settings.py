@@ -27,9 +27,149 @@ with open(BASE_DIR / "secure.json", "r") as file:
 SERVER = {
     "HOST": HOST,
     "PORT": 12345,
+    # "streams" (asyncio.start_server with MessageStream) or "protocol" (MessageProtocol)
+    "TRANSPORT": "streams",
+    # Number of worker processes sharing the port, 1 runs the server in the main process
+    "WORKERS": 1,
+    # Seconds between statistics sent by workers to the supervisor
+    "WORKER_STATS_INTERVAL": 5.0,
+    # Crashed workers are not restarted more often than every this number of seconds
+    "WORKER_RESTART_DELAY": 1.0,
+    # Seconds given to requests in progress when the server shuts down
+    "SHUTDOWN_GRACE_PERIOD": 10.0,
+    # Keep-alive connections are closed after this number of idle seconds
+    "IDLE_TIMEOUT": 60.0,
+    # Number of rows sent in one chunk of the streamed answer
+    "STREAM_CHUNK_SIZE": 500,
+    "MAX_STREAM_CHUNK_SIZE": 10000,
+    # Compression methods in the order of preference, used only when the client accepts them
+    "COMPRESSION": ["zstd", "lz4", "zlib"],
+    # Answers shorter than this number of bytes are not compressed
+    "COMPRESSION_THRESHOLD": 1024,
+    # Requests with longer header or content (in bytes) are rejected before they are read
+    "MAX_HEADER_SIZE": 64 * 1024,
+    "MAX_CONTENT_SIZE": 16 * 1024 ** 2,
+    # The header must be received within this number of seconds since the message starts
+    "HEADER_TIMEOUT": 10.0,
+    # Connections are closed when the content stalls longer than this number of seconds
+    # or is received slower than MIN_TRANSFER_RATE bytes per second (with BODY_TIMEOUT
+    # seconds of allowance)
+    "BODY_TIMEOUT": 10.0,
+    "MIN_TRANSFER_RATE": 16 * 1024,
+    # Further connections from the same host address are closed right away
+    "MAX_CONNECTIONS_PER_PEER": 100,
+    # Requests processed at once, further requests wait in the queue
+    "MAX_IN_FLIGHT": 100,
+    # Requests which do not fit into the queue or wait longer (in seconds) are answered
+    # with the server_busy error and the number of seconds to retry after
+    "MAX_QUEUED": 200,
+    "QUEUE_TIMEOUT": 2.0,
+    "RETRY_AFTER": 1.0,
+    # Answering the request (with its database query) is cancelled after this number
+    # of seconds, clients can shorten it with the deadline header item
+    "REQUEST_TIMEOUT": 30.0,
 }
 
-# Database
+# Simulated network conditions, only for tests and benchmarks
+LATENCY = {
+    "ENABLED": False,
+    # Seconds added to every read
+    "DELAY": 0.1,
+    # Bytes per second, None means no cap
+    "BANDWIDTH": None,
+    # Maximal random seconds added to every read
+    "JITTER": 0.0,
+    "SEED": None,
+}
+
+# Database connection pool
+DB_POOL = {
+    "MIN_SIZE": 5,
+    "MAX_SIZE": 20,
+    # Connections are replaced after this number of queries
+    "MAX_QUERIES": 50000,
+    # Idle connections are closed after this number of seconds
+    "MAX_INACTIVE_CONNECTION_LIFETIME": 300.0,
+    "ACQUIRE_TIMEOUT": 10.0,
+}
+
+# Custom queries run in read-only transactions of their own smaller pool
+CUSTOM_QUERY = {
+    "POOL": {
+        "MIN_SIZE": 1,
+        "MAX_SIZE": 4,
+        "MAX_QUERIES": 50000,
+        "MAX_INACTIVE_CONNECTION_LIFETIME": 300.0,
+        "ACQUIRE_TIMEOUT": 5.0,
+    },
+    # Seconds after which Postgres cancels the query
+    "STATEMENT_TIMEOUT": 5.0,
+    # Rows of the answer, streamed answers are cut to this number too
+    "MAX_ROWS": 10000,
+    # Queries whose EXPLAIN plan costs more are rejected, None disables the check
+    "MAX_COST": None,
+}
+
+# Routing of read-only lookups to REPLICAS of the database
+DB_ROUTER = {
+    "HEALTH_CHECK_INTERVAL": 5.0,
+    # Replicas lagging more seconds behind the primary are ejected, None disables the check
+    "MAX_LAG": 10.0,
+    # Replicas failing this number of requests in a row are ejected
+    "EJECT_ERRORS": 3,
+    "EJECT_TIME": 30.0,
+}
+
+# Answers of category lookups cached by every server process
+RESULT_CACHE = {
+    "ENABLED": True,
+    "MAX_ENTRIES": 10000,
+    # Maximal size of cached answers encoded as JSON, in bytes
+    "MAX_BYTES": 64 * 1024 ** 2,
+    # Seconds after which the answer is read from the database again, None means never
+    "TTL": 300.0,
+    # Channel of notifications sent when the data version changes after an upload
+    "NOTIFY_CHANNEL": "data_version",
+    # Seconds between attempts to connect the listener of notifications, doubled after
+    # every failed attempt up to the maximum
+    "LISTEN_RETRY_MIN": 1.0,
+    "LISTEN_RETRY_MAX": 60.0,
+}
+
+# Requests of the batch category, {"category": "batch", "items": [...]}
+BATCH = {
+    "MAX_ITEMS": 100,
+    # Items of one batch queried at once
+    "PARALLELISM": 8,
+}
+
+# In-memory index answering lookups of the built-in categories, loaded at start
+# or by RequestManager.rebuild_index and rebuilt when the data version changes
+MOVIE_INDEX = {
+    "ENABLED": False,
+    "LOAD_ON_START": True,
+}
+
+# Members of the cast and jobs of the crew in answers of the details category
+DETAILS = {
+    "CAST_SIZE": 10,
+    "CREW_JOBS": [
+        "Director",
+        "Screenplay",
+        "Writer",
+        "Producer",
+        "Original Music Composer",
+    ],
+}
+
+# Answers have at most MAX_PAGE_SIZE rows, DEFAULT_PAGE_SIZE when the request has no limit
+PAGINATION = {
+    "DEFAULT_PAGE_SIZE": 1000,
+    "MAX_PAGE_SIZE": 1000,
+}
+
+# Database. REPLICAS are read replicas, their settings override the settings
+# of the primary, e.g. [{"HOST": "localhost", "PORT": 5433}]
 DATABASES = {
     "default": {
         "NAME": "movies-db",
@@ -37,6 +177,7 @@ DATABASES = {
         "PASSWORD": secure["PG_PASSWORD"],
         "HOST": "localhost",
         "PORT": 5432,
+        "REPLICAS": [],
     },
     "docker": {
         "NAME": "postgres",
@@ -44,6 +185,7 @@ DATABASES = {
         "PASSWORD": secure["PG_PASSWORD"],
         "HOST": "172.17.0.2",
         "PORT": 5432,
+        "REPLICAS": [],
     },
     "test": {
         "NAME": "test",
@@ -51,5 +193,6 @@ DATABASES = {
         "PASSWORD": secure["PG_PASSWORD"],
         "HOST": "localhost",
         "PORT": 5432,
+        "REPLICAS": [],
     },
 }
@@ -0,0 +1,54 @@
+""" Shares one run of the coroutine between concurrent identical calls. """
+
+from typing import *
+
+import asyncio
+
+from metrics import metrics
+
+
+class Flight:
+    """ The running call and the number of callers waiting for it. """
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at once. Calls with the key of the running call
+    wait for its result (or its exception) instead of running again. The call is
+    shielded from cancellation of any caller and cancelled only when all callers are.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = dict()
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(asyncio.ensure_future(func()))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda task: self.land(key, flight))
+            metrics.incr("single_flight.calls")
+        else:
+            metrics.incr("single_flight.saved_queries")
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                flight.task.cancel()
+                # New calls start a new run instead of joining the cancelled one
+                self.land(key, flight)
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def land(self, key: Hashable, flight: Flight) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    def stats(self) -> Dict[str, float]:
+        return {"in_flight": len(self.flights), **metrics.snapshot("single_flight.")}
@@ -0,0 +1,211 @@
+""" Runs the server in many worker processes sharing one port. """
+
+from typing import *
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from async_server import AsyncServer
+from settings import DATABASES, SERVER
+
+
+def run_worker(
+    index: int,
+    host: str,
+    port: int,
+    db_config: Dict,
+    stats_queue: multiprocessing.Queue,
+    stats_interval: float,
+    grace_period: float,
+) -> None:
+    """
+    Runs the server with its own event loop and database pool until SIGTERM or SIGINT.
+    Statistics of the server are sent to the supervisor every stats_interval seconds.
+    """
+
+    # Signal handlers of the supervisor are inherited by the forked process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    async_server = AsyncServer(
+        host, port, loop=loop, db_config=db_config, reuse_port=True
+    )
+    server = loop.run_until_complete(async_server.start_server())
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, loop.stop)
+
+    def send_stats() -> None:
+        stats_queue.put((index, os.getpid(), async_server.get_stats()))
+        loop.call_later(stats_interval, send_stats)
+
+    send_stats()
+    loop.run_forever()
+    print(f"Worker {index} is shutting down.")
+    async_server.close(server, grace_period)
+    stats_queue.put((index, os.getpid(), async_server.get_stats()))
+
+
+# Statistics of workers which are not summed, the largest value is taken: data versions,
+# the replica lag and limits configured for every worker
+MAX_STATS = ("version", "lag", "max_in_flight", "max_queued", "min_size", "max_size")
+
+
+def aggregate_stats(stats: Iterable[Dict]) -> Dict:
+    """
+    Sums numeric statistics of workers. The compression ratio and the average latency
+    are computed from the sums, the largest value of MAX_STATS is taken.
+    """
+
+    total: Dict = {}
+    for worker_stats in stats:
+        for name, value in worker_stats.items():
+            if isinstance(value, dict):
+                total[name] = aggregate_stats([total.get(name, {}), value])
+            elif not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            elif name in MAX_STATS:
+                total[name] = max(total.get(name, value), value)
+            else:
+                total[name] = total.get(name, 0) + value
+    if "ratio" in total:
+        bytes_in = total.get("bytes_in", 0)
+        total["ratio"] = total.get("bytes_out", 0) / bytes_in if bytes_in else 1.0
+    if "latency_avg" in total:
+        requests = total.get("requests", 0)
+        total["latency_avg"] = total["latency_total"] / requests if requests else 0.0
+    return total
+
+
+class Supervisor:
+    """
+    Forks worker processes listening on the same port with SO_REUSEPORT, so the kernel
+    spreads connections between them. Crashed workers are restarted, SIGTERM and SIGINT
+    shut all workers down gracefully.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        workers: int = SERVER["WORKERS"],
+        db_config: Dict = DATABASES["default"],
+        stats_interval: float = SERVER["WORKER_STATS_INTERVAL"],
+        restart_delay: float = SERVER["WORKER_RESTART_DELAY"],
+        grace_period: float = SERVER["SHUTDOWN_GRACE_PERIOD"],
+    ):
+        self.host = host
+        self.port = port
+        self.workers_count = workers
+        self.db_config = db_config
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.grace_period = grace_period
+        self.context = multiprocessing.get_context("fork")
+        self.stats_queue = self.context.Queue()
+        self.workers: Dict[int, multiprocessing.Process] = dict()
+        self.started_at: Dict[int, float] = dict()
+        # The latest statistics sent by every worker
+        self.workers_stats: Dict[int, Dict] = dict()
+        self.restarts: int = 0
+        self.stopping = False
+
+    def run(self) -> None:
+        """ Starts workers and supervises them until SIGTERM or SIGINT. """
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers_count):
+            self.start_worker(index)
+        print(f"Supervising {self.workers_count} workers on {self.host}:{self.port}")
+        try:
+            while not self.stopping:
+                self.collect_stats(timeout=0.5)
+                self.restart_crashed_workers()
+        finally:
+            self.stop_workers()
+        print(f"Statistics of all workers: {self.get_stats()}")
+
+    def stop(self, signum: int, frame: Any) -> None:
+        self.stopping = True
+
+    def start_worker(self, index: int) -> None:
+        worker = self.context.Process(
+            target=run_worker,
+            args=(
+                index,
+                self.host,
+                self.port,
+                self.db_config,
+                self.stats_queue,
+                self.stats_interval,
+                self.grace_period,
+            ),
+            name=f"server-worker-{index}",
+        )
+        worker.start()
+        self.workers[index] = worker
+        self.started_at[index] = time.monotonic()
+
+    def restart_crashed_workers(self) -> None:
+        """ Restarts exited workers, but not more often than every restart_delay seconds. """
+
+        for index, worker in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            if time.monotonic() - self.started_at[index] < self.restart_delay:
+                continue
+            print(f"Worker {index} exited with code {worker.exitcode}, restarting it.")
+            worker.join()
+            self.restarts += 1
+            self.start_worker(index)
+
+    def stop_workers(self) -> None:
+        """
+        Sends SIGTERM to workers and waits until they answer requests in progress.
+        Workers still running after the grace period are killed.
+        """
+
+        for worker in self.workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + self.grace_period + 1.0
+        while time.monotonic() < deadline and any(
+            worker.is_alive() for worker in self.workers.values()
+        ):
+            # Workers can not exit until their statistics are taken from the queue
+            self.collect_stats(timeout=0.1)
+        for index, worker in self.workers.items():
+            if worker.is_alive():
+                print(f"Killing worker {index}.")
+                os.kill(worker.pid, signal.SIGKILL)
+            worker.join()
+        self.collect_stats(timeout=0)
+
+    def collect_stats(self, timeout: float) -> None:
+        """ Saves statistics sent by workers, waiting at most timeout seconds for the first ones. """
+
+        block = timeout > 0
+        while True:
+            try:
+                index, pid, stats = self.stats_queue.get(block, timeout)
+            except queue.Empty:
+                return
+            self.workers_stats[index] = {"pid": pid, **stats}
+            block = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ Provides statistics of every worker and their sums. """
+        return {
+            "workers": self.workers_count,
+            "restarts": self.restarts,
+            "total": aggregate_stats(
+                {name: value for name, value in stats.items() if name != "pid"}
+                for stats in self.workers_stats.values()
+            ),
+            "per_worker": self.workers_stats,
+        }
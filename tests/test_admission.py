@@ -0,0 +1,82 @@
+""" Provides tests for admission module. """
+
+import pytest
+import asyncio
+
+from admission import AdmissionController, ServerBusy
+
+
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_event_loop()
+
+
+async def hold(controller: AdmissionController, release: asyncio.Event) -> str:
+    try:
+        async with controller.admit():
+            await release.wait()
+            return "answered"
+    except ServerBusy:
+        return "busy"
+
+
+def test_requests_over_the_queue_are_rejected(loop):
+    controller = AdmissionController(
+        max_in_flight=2, max_queued=1, queue_timeout=None, retry_after=0.5
+    )
+
+    async def run():
+        release = asyncio.Event()
+        tasks = [asyncio.ensure_future(hold(controller, release)) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        stats = controller.stats()
+        release.set()
+        return stats, await asyncio.gather(*tasks)
+
+    stats, results = loop.run_until_complete(run())
+    assert stats["in_flight"] == 2
+    assert stats["queued"] == 1
+    assert results == ["answered", "answered", "answered", "busy"]
+    assert controller.in_flight == 0
+
+
+def test_request_waiting_too_long_is_rejected(loop):
+    controller = AdmissionController(
+        max_in_flight=1, max_queued=10, queue_timeout=0.01, retry_after=0.5
+    )
+
+    async def run():
+        release = asyncio.Event()
+        first = asyncio.ensure_future(hold(controller, release))
+        await asyncio.sleep(0)
+        with pytest.raises(ServerBusy) as e:
+            await controller.acquire()
+        release.set()
+        await first
+        return e.value
+
+    error = loop.run_until_complete(run())
+    assert error.retry_after == 0.5
+    assert controller.in_flight == 0
+    assert not controller.waiters
+
+
+def test_cancelled_waiter_does_not_take_the_place(loop):
+    controller = AdmissionController(
+        max_in_flight=1, max_queued=10, queue_timeout=None, retry_after=0.5
+    )
+
+    async def run():
+        release = asyncio.Event()
+        first = asyncio.ensure_future(hold(controller, release))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(hold(controller, release))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await first
+        return await hold(controller, release)
+
+    assert loop.run_until_complete(run()) == "answered"
+    assert controller.in_flight == 0
@@ -0,0 +1,110 @@
+""" Provides tests for compression module. """
+
+import pytest
+import asyncio
+
+import json
+
+import compression
+from message_stream import (
+    MessageStream,
+    FrameTooLarge,
+    PROTOCOL_VERSION,
+    encode_preamble,
+)
+from metrics import metrics
+from tests.test_message_stream import FakeWriter
+
+
+@pytest.mark.parametrize(
+    "accepted, preferred, method",
+    [
+        (["zlib"], ["zstd", "lz4", "zlib"], "zlib"),
+        (["unknown", "zlib"], ["unknown", "zlib"], "zlib"),
+        ([], ["zlib"], None),
+        (["zlib"], [], None),
+    ],
+)
+def test_negotiate(accepted, preferred, method):
+    assert compression.negotiate(accepted, preferred) == method
+
+
+@pytest.mark.parametrize("method", list(compression.compressors))
+def test_compress_and_decompress(method):
+    data = b"The overview of the movie. " * 100
+    compressed = compression.compress(data, method)
+    assert len(compressed) < len(data)
+    assert compression.decompress(compressed, method) == data
+
+
+@pytest.mark.parametrize("method", list(compression.compressors))
+def test_decompression_bomb_is_cut_at_max_size(method):
+    bomb = compression.compress(bytes(64 * 1024 ** 2), method)
+    assert len(compression.decompress(bomb, method, max_size=1000)) == 1001
+
+
+@pytest.mark.parametrize("method", list(compression.compressors))
+def test_stream_rejects_decompression_bomb(method):
+    loop = asyncio.get_event_loop()
+    content = compression.compress(bytes(64 * 1024 ** 2), method)
+    header = json.dumps(
+        {
+            "content_type": "binary",
+            "content_encoding": "utf-8",
+            "content_length": len(content),
+            "content_compression": method,
+        }
+    ).encode()
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(
+            encode_preamble(len(header), len(content), PROTOCOL_VERSION)
+            + header
+            + content
+        )
+        stream = MessageStream(reader, FakeWriter(), max_content_size=1000)
+        await stream.receive_stream()
+
+    with pytest.raises(FrameTooLarge):
+        loop.run_until_complete(run())
+
+
+def test_decompress_unknown_method():
+    with pytest.raises(ValueError):
+        compression.decompress(b"data", "unknown")
+
+
+def test_stats():
+    metrics.reset()
+    compression.compress(b"a" * 1000, "zlib")
+    stats = compression.stats()
+    assert stats["messages"] == 1
+    assert stats["bytes_in"] == 1000
+    assert 0 < stats["ratio"] < 1
+    assert stats["cpu_seconds"] >= 0
+
+
+@pytest.mark.parametrize(
+    "answer, compressed",
+    [
+        ({"answer": "Wrong request content."}, False),
+        ({"answer": [{"overview": "A story. " * 10}] * 100}, True),
+    ],
+)
+def test_stream_compresses_long_content(answer, compressed):
+    loop = asyncio.get_event_loop()
+
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream(answer, "json", compression="zlib")
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(writer.data))
+        return len(writer.data), await MessageStream(reader, writer).receive_stream()
+
+    sent, (header, content) = loop.run_until_complete(run())
+    assert content == answer
+    assert ("content_compression" in header) == compressed
+    if compressed:
+        assert header["content_length"] < sent < len(str(answer))
@@ -0,0 +1,192 @@
+""" Provides tests for db_router module. """
+
+from typing import *
+
+import pytest
+import asyncio
+
+from db_router import DBRouter
+
+ROUTER_CONFIG = {
+    "HEALTH_CHECK_INTERVAL": 60.0,
+    "MAX_LAG": 10.0,
+    "EJECT_ERRORS": 2,
+    "EJECT_TIME": 30.0,
+}
+
+
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_event_loop()
+
+
+class FakeConnection:
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+    async def fetchval(self, query: str) -> float:
+        return self.pool.lag
+
+
+class FakePool:
+    """ Has the interface of DBPool, its connections fail when the pool is down. """
+
+    def __init__(self, name: str, lag: float = 0.0):
+        self.name = name
+        self.lag = lag
+        self.down = False
+        self.started = False
+        # Acquiring waits until it is set, when it is given
+        self.free: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        if self.down:
+            raise ConnectionRefusedError("The database is down.")
+        self.started = True
+
+    async def close(self) -> None:
+        self.started = False
+
+    def acquire(self) -> "FakePool":
+        return self
+
+    async def __aenter__(self) -> FakeConnection:
+        if self.free is not None:
+            await self.free.wait()
+        if not self.started:
+            raise RuntimeError("The database pool is not started.")
+        if self.down:
+            raise ConnectionRefusedError("The database is down.")
+        return FakeConnection(self)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    def stats(self):
+        return {"size": 1}
+
+
+async def hold(router: DBRouter, read_only: bool, release: asyncio.Event) -> str:
+    async with router.acquire(read_only) as conn:
+        await release.wait()
+        return conn.pool.name
+
+
+def test_reads_go_to_replica_with_least_outstanding_requests(loop):
+    primary, replicas = FakePool("primary"), [FakePool("r1"), FakePool("r2")]
+    router = DBRouter(primary, replicas, ROUTER_CONFIG)
+
+    async def run():
+        await router.start()
+        release = asyncio.Event()
+        tasks = [asyncio.ensure_future(hold(router, True, release)) for _ in range(4)]
+        tasks.append(asyncio.ensure_future(hold(router, False, release)))
+        await asyncio.sleep(0)
+        outstanding = [node.outstanding for node in router.nodes]
+        release.set()
+        names = await asyncio.gather(*tasks)
+        await router.close()
+        return outstanding, names
+
+    outstanding, names = loop.run_until_complete(run())
+    assert outstanding == [1, 2, 2]
+    assert sorted(names[:4]) == ["r1", "r1", "r2", "r2"]
+    assert names[4] == "primary"
+    stats = router.node_stats()
+    assert stats["replica_1"]["requests"] == 2
+    assert stats["primary"]["outstanding"] == 0
+
+
+def test_failing_replica_is_ejected_and_reads_fall_back_to_primary(loop):
+    primary, replica = FakePool("primary"), FakePool("r1")
+    router = DBRouter(primary, [replica], ROUTER_CONFIG)
+
+    async def read() -> str:
+        async with router.acquire(read_only=True) as conn:
+            return conn.pool.name
+
+    async def run():
+        await router.start()
+        replica.down = True
+        names = [await read() for _ in range(3)]
+        await router.close()
+        return names
+
+    assert loop.run_until_complete(run()) == ["primary"] * 3
+    [node] = router.replicas
+    assert node.ejected
+    # The ejected replica is not asked again
+    assert node.errors == 2
+    assert node.stats()["ejections"] == 1
+
+
+def test_health_check_ejects_lagging_replica_and_restores_it(loop):
+    replica = FakePool("r1", lag=60.0)
+    router = DBRouter(FakePool("primary"), [replica], ROUTER_CONFIG)
+    [node] = router.replicas
+
+    loop.run_until_complete(router.check_node(node))
+    assert node.ejected
+    assert router.choose_node(read_only=True) is router.primary
+
+    replica.lag = 0.5
+    loop.run_until_complete(router.check_node(node))
+    assert not node.ejected
+    assert node.stats()["lag"] == 0.5
+    assert router.choose_node(read_only=True) is node
+
+
+def test_query_errors_do_not_eject_replica(loop):
+    router = DBRouter(FakePool("primary"), [FakePool("r1")], ROUTER_CONFIG)
+    loop.run_until_complete(router.start())
+
+    async def fail() -> None:
+        async with router.acquire(read_only=True):
+            raise ValueError("Syntax error.")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            loop.run_until_complete(fail())
+    [node] = router.replicas
+    assert node.errors == 3
+    assert not node.ejected
+
+
+def test_cancelled_acquire_is_not_outstanding(loop):
+    replica = FakePool("r1")
+    router = DBRouter(FakePool("primary"), [replica], ROUTER_CONFIG)
+    [node] = router.replicas
+
+    async def run():
+        await router.start()
+        replica.free = asyncio.Event()
+        task = asyncio.ensure_future(hold(router, True, asyncio.Event()))
+        await asyncio.sleep(0)
+        outstanding = node.outstanding
+        task.cancel()
+        await asyncio.sleep(0)
+        await router.close()
+        return outstanding
+
+    assert loop.run_until_complete(run()) == 1
+    assert node.outstanding == 0
+    assert node.errors == 0
+
+
+def test_replica_which_is_not_started_is_not_chosen(loop):
+    replica = FakePool("r1")
+    replica.down = True
+    router = DBRouter(FakePool("primary"), [replica], ROUTER_CONFIG)
+
+    async def read() -> str:
+        async with router.acquire(read_only=True) as conn:
+            return conn.pool.name
+
+    async def run():
+        await router.start()
+        # The ejection of the replica which failed to start expires before it is started
+        replica.down = False
+        router.replicas[0].restore()
+        return await read()
+
+    assert loop.run_until_complete(run()) == "primary"
@@ -0,0 +1,56 @@
+""" Provides tests for latency module. """
+
+import pytest
+import asyncio
+import time
+
+from latency import LatencyInjector
+from message_stream import MessageStream
+from tests.test_message_stream import FakeWriter, encode_messages
+
+
+@pytest.mark.parametrize(
+    "injector, n_bytes, delay",
+    [
+        (LatencyInjector(), 1024, 0.0),
+        (LatencyInjector(delay=0.1), 1024, 0.1),
+        (LatencyInjector(bandwidth=1000), 500, 0.5),
+        (LatencyInjector(delay=0.1, bandwidth=1000), 1000, 1.1),
+    ],
+)
+def test_get_delay(injector, n_bytes, delay):
+    assert injector.get_delay(n_bytes) == pytest.approx(delay)
+
+
+def test_jitter_is_bounded():
+    injector = LatencyInjector(delay=0.1, jitter=0.05, seed=1)
+    delays = [injector.get_delay(0) for _ in range(100)]
+    assert all(0.1 <= delay <= 0.15 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize(
+    "config, enabled",
+    [
+        ({"ENABLED": False, "DELAY": 0.1}, False),
+        ({"ENABLED": True, "DELAY": 0.1}, True),
+    ],
+)
+def test_from_config(config, enabled):
+    assert (LatencyInjector.from_config(config) is not None) == enabled
+
+
+def test_stream_reads_with_injected_latency():
+    loop = asyncio.get_event_loop()
+
+    async def run(latency):
+        data = await encode_messages([("title, Heat", "text")])
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        stream = MessageStream(reader, FakeWriter(), latency)
+        start = time.monotonic()
+        await stream.receive_stream()
+        return time.monotonic() - start
+
+    assert loop.run_until_complete(run(None)) < 0.05
+    assert loop.run_until_complete(run(LatencyInjector(delay=0.1))) >= 0.1
@@ -0,0 +1,248 @@
+""" Provides tests for message_stream module. """
+
+import pytest
+import asyncio
+
+import json
+import struct
+
+from message_stream import MessageStream, ConnectionClosed, FrameTooLarge, ReadTimeout
+from result_rows import Rows
+
+
+class FakeTransport:
+    def __init__(self):
+        self.closing = False
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+
+class FakeWriter:
+    """ Collects the data written by MessageStream instead of sending it. """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.transport = FakeTransport()
+
+    def write(self, data: bytes) -> None:
+        self.data += data
+
+    async def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.transport.closing = True
+
+
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_event_loop()
+
+
+async def encode_messages(messages, close: bool = False) -> bytes:
+    writer = FakeWriter()
+    stream = MessageStream(asyncio.StreamReader(), writer)
+    for data, content_type in messages:
+        await stream.send_stream(data, content_type, "utf-8")
+    if close:
+        await stream.send_close()
+    return bytes(writer.data)
+
+
+async def receive_all(data: bytes, count: int, eof: bool = True):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    stream = MessageStream(reader, FakeWriter())
+    return [await stream.receive_stream() for _ in range(count)]
+
+
+def test_many_messages_on_one_stream(loop):
+    messages = [
+        ({"category": "title", "query": "Pulp Fiction"}, "json"),
+        ("actor, Janusz Gajos", "text"),
+        (b"\x00\x01" * 1000, "binary"),
+    ]
+
+    async def run():
+        data = await encode_messages(messages, close=True)
+        return await receive_all(data, len(messages) + 1)
+
+    received = loop.run_until_complete(run())
+    for (header, content), (data, content_type) in zip(received, messages):
+        assert header["content_type"] == content_type
+        assert content == data
+        assert type(content) == type(data)
+    assert MessageStream.is_close_frame(received[-1][0])
+
+
+def test_closed_connection_raises(loop):
+    async def run():
+        data = await encode_messages([("title, Heat", "text")])
+        return await receive_all(data, 2)
+
+    with pytest.raises(ConnectionClosed):
+        loop.run_until_complete(run())
+
+
+def test_idle_timeout(loop):
+    async def run():
+        reader = asyncio.StreamReader()
+        stream = MessageStream(reader, FakeWriter())
+        await stream.receive_stream(idle_timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(run())
+
+
+def test_extra_header_items(loop):
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream("title, Heat", "text", header={"request_id": 7})
+        return await receive_all(bytes(writer.data), 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["request_id"] == 7
+    assert content == "title, Heat"
+
+
+def test_records_content_type(loop):
+    answer = {
+        "answer": [
+            {"title": "Heat", "runtime": 170},
+            {"title": "Ronin", "runtime": None},
+        ]
+    }
+
+    async def run():
+        data = await encode_messages([(answer, "records")])
+        return await receive_all(data, 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["content_type"] == "records"
+    assert content == answer
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"answer": "Wrong request content."},
+        {"answer": [], "next": "token"},
+        {"answer": [{"answer": Rows(("title",), [("Heat",)])}]},
+    ],
+)
+def test_records_content_type_requires_rows(loop, data):
+    async def run():
+        await encode_messages([(data, "records")])
+
+    with pytest.raises(ValueError):
+        loop.run_until_complete(run())
+
+
+def encode_v1_message(header: dict, content: bytes) -> bytes:
+    header = json.dumps(header).encode()
+    return struct.pack(">H", len(header)) + header + content
+
+
+def test_protocol_version_1_is_accepted_and_answered(loop):
+    content = b"title, Heat"
+    header = {"content_type": "text", "content_encoding": "utf-8"}
+    data = encode_v1_message({**header, "content_length": len(content)}, content)
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        writer = FakeWriter()
+        stream = MessageStream(reader, writer)
+        received = await stream.receive_stream()
+        await stream.send_stream({"answer": []}, "json")
+        return received, bytes(writer.data)
+
+    (header, request), answer = loop.run_until_complete(run())
+    assert request == "title, Heat"
+    assert struct.unpack(">H", answer[:2])[0] == len(answer) - 2 - len(
+        b'{"answer": []}'
+    )
+
+
+def test_header_longer_than_64_kb(loop):
+    header = {"request_id": 1, "padding": "x" * 100000}
+
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream("title, Heat", "text", header=header)
+        return await receive_all(bytes(writer.data), 1)
+
+    [(received, content)] = loop.run_until_complete(run())
+    assert received["padding"] == header["padding"]
+    assert content == "title, Heat"
+
+
+@pytest.mark.parametrize(
+    "max_header_size, max_content_size, rejected_header",
+    [(50, None, None), (None, 100, {"request_id": 1})],
+)
+def test_too_large_frame_is_rejected_before_reading(
+    loop, max_header_size, max_content_size, rejected_header
+):
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream("x" * 1000, "text", header={"request_id": 1})
+        reader = asyncio.StreamReader()
+        # Only the preamble and the header are available, the content is never sent
+        reader.feed_data(bytes(writer.data)[:-1000])
+        stream = MessageStream(
+            reader,
+            writer,
+            max_header_size=max_header_size,
+            max_content_size=max_content_size,
+        )
+        await asyncio.wait_for(stream.receive_stream(), 1)
+
+    with pytest.raises(FrameTooLarge) as e:
+        loop.run_until_complete(run())
+    if rejected_header:
+        assert e.value.header["request_id"] == rejected_header["request_id"]
+    else:
+        assert e.value.header is None
+
+
+def test_decompressed_content_limit(loop):
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream("x" * 100000, "text", compression="zlib")
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(writer.data))
+        await MessageStream(reader, writer, max_content_size=10000).receive_stream()
+
+    with pytest.raises(FrameTooLarge):
+        loop.run_until_complete(run())
+
+
+@pytest.mark.parametrize(
+    "missing, timeouts, rule",
+    [
+        (2010, {"header_timeout": 0.01}, "header_timeout"),
+        (1000, {"body_timeout": 0.01}, "body_timeout"),
+        (1000, {"min_transfer_rate": 100000}, "min_transfer_rate"),
+    ],
+)
+def test_slow_message_raises_read_timeout(loop, missing, timeouts, rule):
+    async def run():
+        writer = FakeWriter()
+        stream = MessageStream(asyncio.StreamReader(), writer)
+        await stream.send_stream("x" * 2000, "text")
+        reader = asyncio.StreamReader()
+        # The rest of the message is never sent
+        reader.feed_data(bytes(writer.data)[:-missing])
+        await MessageStream(reader, writer, **timeouts).receive_stream()
+
+    with pytest.raises(ReadTimeout) as e:
+        loop.run_until_complete(asyncio.wait_for(run(), 1))
+    assert e.value.rule == rule
@@ -0,0 +1,86 @@
+""" Provides tests for movie_index module. """
+
+import pytest
+import asyncio
+import sys
+
+from movie_index import MovieIndex
+from request_manager import RequestManager
+from result_rows import Rows
+
+MOVIES = Rows(
+    ("id", "title", "release_date"),
+    [
+        (1, "Heat", "15-Dec-1995"),
+        (2, "Ronin", "25-Sep-1998"),
+        (3, "Heat", "01-Jan-1986"),
+    ],
+)
+PEOPLE = {
+    "actor": [
+        ("Robert De Niro", 10, 1),
+        ("Al Pacino", 11, 1),
+        ("Robert De Niro", 12, 2),
+        # The movie is missing, like in the inner join
+        ("Robert De Niro", 13, 99),
+    ],
+    "director": [("Michael Mann", 20, 1), ("John Frankenheimer", 21, 2)],
+    "screenplay": [],
+}
+
+
+@pytest.fixture
+def index() -> MovieIndex:
+    return MovieIndex.build(7, MOVIES, PEOPLE)
+
+
+def test_lookup_returns_records_like_statements(index):
+    assert index.lookup("actor", "Robert De Niro", -1, None) == [
+        {"page_key": 10, "title": "Heat"},
+        {"page_key": 12, "title": "Ronin"},
+    ]
+    assert index.lookup("title", "Heat", -1, None) == [
+        {"page_key": 1, "id": 1, "title": "Heat", "release_date": "15-Dec-1995"},
+        {"page_key": 3, "id": 3, "title": "Heat", "release_date": "01-Jan-1986"},
+    ]
+    assert index.lookup("director", "Nobody", -1, None) is None
+
+
+def test_lookup_pages_follow_after_key(index):
+    assert index.lookup("title", "Heat", 1, 1) == [
+        {"page_key": 3, "id": 3, "title": "Heat", "release_date": "01-Jan-1986"}
+    ]
+    assert index.lookup("actor", "Robert De Niro", 12, 10) == []
+
+
+def test_names_are_interned_and_footprint_is_reported(index):
+    name = "".join(["Al ", "Pacino"])
+    [actor] = [key for key in index.postings["actor"] if key == name]
+    assert actor is sys.intern(name)
+    assert index.postings["actor"]["Robert De Niro"].movie_ids.typecode == "q"
+    stats = index.stats()
+    assert stats["movies"] == 3
+    assert stats["names"] == 2 + 2 + 2
+    assert stats["bytes"] > 0
+
+
+def test_request_manager_answers_from_index(index):
+    req_man = RequestManager()
+    req_man.index = index
+    loop = asyncio.get_event_loop()
+    # The database is not started, so the answer comes from the index
+    response = loop.run_until_complete(
+        req_man.handle_request(
+            req_man.db, {"category": "actor", "query": "Robert De Niro", "limit": 1}
+        )
+    )
+    assert response["answer"] == [{"title": "Heat"}]
+    query, _ = req_man.get_query(
+        {
+            "category": "actor",
+            "query": "Robert De Niro",
+            "limit": 1,
+            "after": response["next"],
+        }
+    )
+    assert req_man.lookup_index(query) == [{"page_key": 12, "title": "Ronin"}]
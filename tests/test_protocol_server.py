@@ -0,0 +1,185 @@
+""" Provides tests for protocol_server module. """
+
+import pytest
+import asyncio
+
+import struct
+
+from message_stream import MessageStream, FrameTooLarge, InvalidHeader
+from protocol_server import MessageProtocol
+from tests.test_message_stream import FakeWriter, receive_all, encode_v1_message
+
+
+class FakeTransport:
+    """ Collects the data written by MessageProtocol instead of sending it. """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.closing = False
+
+    def get_extra_info(self, name: str) -> str:
+        return "fake"
+
+    def writelines(self, chunks) -> None:
+        for chunk in chunks:
+            self.data += chunk
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def pause_reading(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closing = True
+
+
+class EchoServer:
+    """ Answers every request with its content. """
+
+    idle_timeout = None
+    header_timeout = None
+    body_timeout = None
+    min_transfer_rate = None
+    compression_threshold = 1024
+    max_header_size = 1000
+    max_content_size = 1000
+
+    def __init__(self):
+        self.rejected = []
+        self.closed_by = []
+        self.connections = set()
+
+    def accept_peer(self, addr) -> bool:
+        return True
+
+    def release_peer(self, addr) -> None:
+        pass
+
+    def count_closed_connection(self, rule: str) -> None:
+        self.closed_by.append(rule)
+
+    async def respond(self, message, header, request) -> None:
+        await message.send_stream(
+            {"answer": request}, "json", header={"request_id": header["request_id"]}
+        )
+
+    async def reject_frame(self, message, error: FrameTooLarge) -> None:
+        self.rejected.append(error)
+
+    async def reject_header(self, message, error: InvalidHeader) -> None:
+        self.rejected.append(error)
+
+
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_event_loop()
+
+
+async def encode_requests(requests, close: bool = False) -> bytes:
+    writer = FakeWriter()
+    stream = MessageStream(asyncio.StreamReader(), writer)
+    for request_id, (data, content_type) in enumerate(requests):
+        await stream.send_stream(data, content_type, header={"request_id": request_id})
+    if close:
+        await stream.send_close()
+    return bytes(writer.data)
+
+
+async def run_protocol(
+    data: bytes, step: int, server: EchoServer = None
+) -> MessageProtocol:
+    """ Feeds data to the protocol in pieces of step bytes and waits for the answers. """
+
+    protocol = MessageProtocol(server or EchoServer())
+    protocol.connection_made(FakeTransport())
+    for position in range(0, len(data), step):
+        protocol.data_received(data[position : position + step])
+    for _ in range(10):
+        await asyncio.sleep(0)
+    return protocol
+
+
+@pytest.mark.parametrize("step", [1, 7, 100000])
+def test_messages_split_across_reads(loop, step):
+    requests = [("title, Heat", "text"), ({"category": "title"}, "json")]
+
+    async def run():
+        protocol = await run_protocol(await encode_requests(requests, True), step)
+        answers = await receive_all(bytes(protocol.transport.data), 2)
+        return protocol, answers
+
+    protocol, answers = loop.run_until_complete(run())
+    assert sorted(
+        (header["request_id"], content["answer"]) for header, content in answers
+    ) == [(0, "title, Heat"), (1, {"category": "title"})]
+    # The close frame closes the connection when all requests are answered
+    assert protocol.transport.closing
+
+
+def test_protocol_version_1_is_accepted(loop):
+    content = b"title, Heat"
+    header = {"content_type": "text", "content_encoding": "utf-8", "request_id": 3}
+    data = encode_v1_message({**header, "content_length": len(content)}, content)
+
+    async def run():
+        protocol = await run_protocol(data, 1)
+        return await receive_all(bytes(protocol.transport.data), 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["request_id"] == 3
+    assert content == {"answer": "title, Heat"}
+
+
+def test_too_large_frame_is_rejected_before_it_is_received(loop):
+    async def run():
+        data = await encode_requests([("x" * 2000, "text")])
+        # Only the preamble and the header are received
+        return await run_protocol(data[:-2000], 100000)
+
+    protocol = loop.run_until_complete(run())
+    [error] = protocol.server.rejected
+    assert error.header["request_id"] == 0
+    assert protocol.transport.closing
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        b"not json",
+        b"[1, 2]",
+        b'{"content_type": "text"}',
+        b'{"content_type": "text", "content_length": "11"}',
+        b'{"content_type": "text", "content_length": -1}',
+        b'{"content_length": 11}',
+    ],
+)
+def test_invalid_header_is_rejected(loop, header):
+    data = struct.pack(">H", len(header)) + header + b"title, Heat"
+    protocol = loop.run_until_complete(run_protocol(data, 100000))
+    [error] = protocol.server.rejected
+    assert isinstance(error, InvalidHeader)
+    assert protocol.transport.closing
+
+
+@pytest.mark.parametrize(
+    "missing, timeouts, rule",
+    [
+        (810, {"header_timeout": 0.01}, "header_timeout"),
+        (400, {"body_timeout": 0.01}, "body_timeout"),
+        (400, {"min_transfer_rate": 100000}, "min_transfer_rate"),
+    ],
+)
+def test_slow_client_is_disconnected(loop, missing, timeouts, rule):
+    server = EchoServer()
+    server.__dict__.update(timeouts)
+
+    async def run():
+        data = await encode_requests([("x" * 800, "text")])
+        protocol = await run_protocol(data[:-missing], 100000, server)
+        await asyncio.sleep(0.05)
+        return protocol
+
+    protocol = loop.run_until_complete(run())
+    assert server.closed_by == [rule]
+    assert protocol.transport.closing
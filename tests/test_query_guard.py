@@ -0,0 +1,57 @@
+""" Provides tests for query_guard module. """
+
+import pytest
+import asyncio
+import json
+
+from metrics import metrics
+from query_guard import QueryGuard, QueryRejected
+
+
+class FakeConnection:
+    """ Records queries and answers EXPLAIN with the plan of the given cost. """
+
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.queries = []
+
+    async def fetchval(self, query: str, *args):
+        self.queries.append((query, args))
+        if query.startswith("EXPLAIN"):
+            return json.dumps([{"Plan": {"Total Cost": self.cost}}])
+        return args[0]
+
+
+def check(guard: QueryGuard, conn: FakeConnection):
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(guard.check(conn, "SELECT * FROM actors", ()))
+
+
+def test_statement_timeout_is_set_without_explain():
+    conn = FakeConnection(10.0)
+    assert check(QueryGuard(2.5, 100, None), conn) is None
+    [(query, args)] = conn.queries
+    assert "statement_timeout" in query
+    assert args == ("2500",)
+
+
+def test_cheap_query_is_accepted():
+    conn = FakeConnection(10.0)
+    assert check(QueryGuard(None, 100, 1000.0), conn) == 10.0
+    assert conn.queries == [("EXPLAIN (FORMAT JSON) SELECT * FROM actors", ())]
+
+
+def test_expensive_query_is_rejected():
+    rejected = metrics.get("custom_query.rejected")
+    with pytest.raises(QueryRejected) as error:
+        check(QueryGuard(None, 100, 1000.0), FakeConnection(5000.0))
+    assert error.value.error == "query_rejected"
+    assert "5000" in str(error.value)
+    assert metrics.get("custom_query.rejected") == rejected + 1
+
+
+def test_cancelled_query_is_counted():
+    cancelled = metrics.get("custom_query.cancelled")
+    error = QueryGuard(1.0, 100, None).cancelled(None, "SELECT 1")
+    assert error.error == "timeout"
+    assert metrics.get("custom_query.cancelled") == cancelled + 1
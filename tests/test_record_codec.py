@@ -0,0 +1,75 @@
+""" Provides tests for record_codec module. """
+
+import pytest
+
+import json
+
+from record_codec import (
+    encode_records,
+    decode_records,
+    get_column_type,
+    NULL,
+    INT,
+    FLOAT,
+    BOOL,
+    TEXT,
+    JSON,
+)
+
+
+@pytest.mark.parametrize(
+    "values, column_type",
+    [
+        ([None, None], NULL),
+        ([1, None, 3], INT),
+        ([2 ** 63, 1], JSON),
+        ([1.5, None], FLOAT),
+        ([True, False], BOOL),
+        (["Heat", None], TEXT),
+        ([1, 1.5], JSON),
+        ([["crime", "drama"]], JSON),
+    ],
+)
+def test_get_column_type(values, column_type):
+    assert get_column_type(values) == column_type
+
+
+@pytest.mark.parametrize(
+    "records",
+    [
+        [],
+        [{"title": "Pulp Fiction"}],
+        [
+            {
+                "id": 680,
+                "adult": False,
+                "title": "Pulp Fiction",
+                "popularity": 140.95,
+                "release_date": "10-Sep-1994",
+                "budget": None,
+                "keywords": ["drug", "boxer"],
+            },
+            {
+                "id": 0,
+                "adult": True,
+                "title": "Żółć",
+                "popularity": None,
+                "release_date": None,
+                "budget": None,
+                "keywords": None,
+            },
+        ],
+    ],
+)
+def test_encode_and_decode_records(records):
+    assert decode_records(encode_records(records)) == records
+
+
+def test_records_with_different_columns():
+    with pytest.raises(ValueError):
+        encode_records([{"title": "Heat"}, {"name": "Al Pacino"}])
+
+
+def test_records_are_smaller_than_json():
+    records = [{"id": i, "title": f"Movie {i}", "vote": i / 3} for i in range(100)]
+    assert len(encode_records(records)) < len(json.dumps(records))
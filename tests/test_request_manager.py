@@ -3,8 +3,18 @@
 import pytest
 import asyncio
 
+import asyncpg
+
+from db_router import DBRouter
 from request_manager import RequestManager
-from settings import DATABASES
+from settings import (
+    DATABASES,
+    CUSTOM_QUERY,
+    DETAILS,
+    RESULT_CACHE,
+    MOVIE_INDEX,
+    DB_ROUTER,
+)
 from tests.testing_data import test_actor_query_result
 
 
@@ -72,3 +82,391 @@ def test_request_manager(req_man, question, answer):
     response = loop.run_until_complete(req_man.entrypoint(question))
     loop.call_later(1, loop.stop)
     assert response == answer
+
+
+@pytest.mark.database
+def test_request_manager_reuses_pool(req_man):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(req_man.entrypoint("actor, Janusz Gajos"))
+    pool = req_man.db.pool
+    loop.run_until_complete(req_man.entrypoint("actor, Janusz Gajos"))
+    assert req_man.db.pool is pool
+    stats = req_man.pool_stats()
+    assert stats["in_use"] == 0
+    assert stats["waiters"] == 0
+    assert stats["size"] >= stats["idle"]
+    loop.run_until_complete(req_man.close())
+    assert not req_man.db.started
+
+
+def test_category_values_are_bound_parameters():
+    query, answer = RequestManager().get_query(
+        {"category": "actor", "query": "Peter O'Toole'; DROP TABLE actors; --"}
+    )
+    assert answer is None
+    assert query.statement == "actor"
+    assert query.args[0] == "Peter O'Toole'; DROP TABLE actors; --"
+    assert "O'Toole" not in query.sql
+
+
+@pytest.mark.database
+def test_request_manager_with_quote_in_name(req_man):
+    loop = asyncio.get_event_loop()
+    response = loop.run_until_complete(req_man.entrypoint("actor, Peter O'Toole'"))
+    assert response == {"answer": []}
+    loop.run_until_complete(req_man.close())
+
+
+class FakeQueryRequestManager(RequestManager):
+    """ Answers lookups without the database and records how many run at once. """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.running = 0
+        self.max_running = 0
+
+    async def query_cached(self, db, query, request):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if query.args[0] == "Nobody":
+            raise ValueError("Query failed.")
+        return self.give_response([{"title": query.args[0]}])
+
+
+class FakeListener:
+    """ Imitates the listener connection, terminate() closes it like a lost connection. """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.closed = False
+        self.termination_listeners = []
+
+    async def add_listener(self, channel, callback) -> None:
+        pass
+
+    def add_termination_listener(self, callback) -> None:
+        self.termination_listeners.append(callback)
+
+    async def fetchval(self, query: str) -> int:
+        return self.version
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def terminate(self) -> None:
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+    async def close(self) -> None:
+        self.terminate()
+
+
+class FakeListenerRequestManager(RequestManager):
+    """ Connects fake listeners after the number of failed connections. """
+
+    def __init__(self, failures: int = 0, **kwargs):
+        super().__init__(
+            cache_config={
+                **RESULT_CACHE,
+                "LISTEN_RETRY_MIN": 0.01,
+                "LISTEN_RETRY_MAX": 0.02,
+            },
+            **kwargs,
+        )
+        self.failures = failures
+        self.listeners = []
+
+    async def connect_listener(self) -> FakeListener:
+        if len(self.listeners) < self.failures:
+            self.listeners.append(None)
+            raise ConnectionRefusedError("The database is down.")
+        self.listeners.append(FakeListener(version=len(self.listeners)))
+        return self.listeners[-1]
+
+
+def test_listener_is_connected_once_with_backoff():
+    req_man = FakeListenerRequestManager(failures=3)
+
+    async def run():
+        for _ in range(5):
+            req_man.start_version_watch()
+        await asyncio.sleep(0.1)
+        version = req_man.cache.version
+        await req_man.close()
+        return version
+
+    assert asyncio.get_event_loop().run_until_complete(run()) == 3
+    # Three failed attempts with backoff, then one connected listener
+    assert len(req_man.listeners) == 4
+
+
+def test_closed_listener_is_connected_again():
+    req_man = FakeListenerRequestManager()
+
+    async def run():
+        req_man.start_version_watch()
+        await asyncio.sleep(0.01)
+        req_man.listeners[0].terminate()
+        closed_version = req_man.cache.version
+        await asyncio.sleep(0.01)
+        version = req_man.cache.version
+        await req_man.close()
+        return closed_version, version
+
+    assert asyncio.get_event_loop().run_until_complete(run()) == (None, 1)
+    assert len(req_man.listeners) == 2
+
+
+class FakeIndexRequestManager(FakeListenerRequestManager):
+    """ Counts rebuilds of the index instead of loading it from the database. """
+
+    def __init__(self):
+        super().__init__(index_config={**MOVIE_INDEX, "ENABLED": True})
+        self.rebuilds = 0
+
+    async def rebuild_index(self) -> None:
+        self.rebuilds += 1
+        self.index = "index"
+
+
+def test_index_is_dropped_and_rebuilt_when_listener_reconnects():
+    req_man = FakeIndexRequestManager()
+
+    async def run():
+        req_man.start_version_watch()
+        await asyncio.sleep(0.01)
+        req_man.index = "outdated index"
+        req_man.listeners[0].terminate()
+        dropped_index = req_man.index
+        await asyncio.sleep(0.01)
+        await req_man.close()
+        return dropped_index
+
+    assert asyncio.get_event_loop().run_until_complete(run()) is None
+    assert len(req_man.listeners) == 2
+    assert req_man.rebuilds == 1
+    assert req_man.index == "index"
+
+
+class FakeStatement:
+    async def fetch(self, *args) -> list:
+        return []
+
+
+class FakeVersionPool:
+    """ Has the interface of DBPool, its connections read the data version of the pool. """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.started = True
+        self.statements = {"title": FakeStatement()}
+
+    def acquire(self) -> "FakeVersionPool":
+        return self
+
+    async def __aenter__(self) -> "FakeVersionPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    async def fetchval(self, query: str) -> int:
+        return self.version
+
+
+def test_answer_of_lagging_replica_is_not_cached():
+    req_man = RequestManager()
+    replica = FakeVersionPool(1)
+    req_man.db = DBRouter(FakeVersionPool(2), [replica], DB_ROUTER)
+    req_man.cache.set_version(2)
+    request = {"category": "title", "query": "Heat"}
+    query, _ = req_man.get_query(request)
+    key = (query.statement, query.args)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(req_man.query_cached(req_man.db, query, request))
+    assert req_man.cache.get(key) is None
+    replica.version = 2
+    loop.run_until_complete(req_man.query_cached(req_man.db, query, request))
+    assert req_man.cache.get(key) == {"answer": []}
+
+
+def test_batch_request():
+    req_man = FakeQueryRequestManager(batch_config={"MAX_ITEMS": 10, "PARALLELISM": 2})
+    request = {
+        "category": "batch",
+        "items": [
+            "title, Heat",
+            {"category": "actor", "query": "Nobody"},
+            "wrong request",
+            {"category": "batch", "items": ["title, Heat"]},
+        ]
+        + ["title, Ronin"] * 4,
+    }
+    loop = asyncio.get_event_loop()
+    response = loop.run_until_complete(req_man.handle_request(req_man.db, request))
+    assert response["answer"][:4] == [
+        {"answer": [{"title": "Heat"}]},
+        {"answer": "The request can not be processed.", "error": "request_failed"},
+        {"answer": "Wrong request content."},
+        {"answer": "Wrong request content."},
+    ]
+    assert response["answer"][4:] == [{"answer": [{"title": "Ronin"}]}] * 4
+    assert req_man.max_running == 2
+
+
+@pytest.mark.parametrize("items", [[], "title, Heat", ["title, Heat"] * 11])
+def test_wrong_batch_request(items):
+    req_man = RequestManager(batch_config={"MAX_ITEMS": 10, "PARALLELISM": 2})
+    loop = asyncio.get_event_loop()
+    response = loop.run_until_complete(
+        req_man.handle_request(req_man.db, {"category": "batch", "items": items})
+    )
+    assert isinstance(response["answer"], str)
+
+
+@pytest.mark.parametrize(
+    "request_items, answer",
+    [
+        ({"limit": 0}, "Wrong limit. Required limit: positive integer."),
+        ({"limit": "10"}, "Wrong limit. Required limit: positive integer."),
+        ({"after": "not a token"}, "Wrong continuation token."),
+    ],
+)
+def test_wrong_page_request(request_items, answer):
+    request = {"category": "title", "query": "Heat", **request_items}
+    assert RequestManager().get_query(request) == (None, answer)
+
+
+def test_page_size_is_limited():
+    req_man = RequestManager(
+        pagination_config={"DEFAULT_PAGE_SIZE": 10, "MAX_PAGE_SIZE": 100}
+    )
+    query, _ = req_man.get_query({"category": "actor", "query": "Al Pacino"})
+    assert query.limit == 10
+    query, _ = req_man.get_query(
+        {"category": "actor", "query": "Al Pacino", "limit": 1000}
+    )
+    assert query.limit == 100
+    # One more row tells that there is the next page
+    assert query.args[2] == 101
+
+
+def test_next_page_follows_the_last_row():
+    req_man = RequestManager()
+    request = {"category": "actor", "query": "Al Pacino", "limit": 2}
+    query, _ = req_man.get_query(request)
+    records = [{"page_key": key, "title": str(key)} for key in [3, 5, 8]]
+    response = req_man.give_page(records, query, request)
+    assert response["answer"] == [{"title": "3"}, {"title": "5"}]
+
+    query, _ = req_man.get_query({**request, "after": response["next"]})
+    assert query.args[1] == 5
+    response = req_man.give_page(records[2:], query, request)
+    assert response == {"answer": [{"title": "8"}]}
+
+
+def test_token_of_other_request_is_rejected():
+    req_man = RequestManager()
+    request = {"category": "actor", "query": "Al Pacino", "limit": 1}
+    query, _ = req_man.get_query(request)
+    records = [{"page_key": 1, "title": "Heat"}, {"page_key": 2, "title": "Ronin"}]
+    token = req_man.give_page(records, query, request)["next"]
+    query, answer = req_man.get_query(
+        {"category": "actor", "query": "Robert De Niro", "after": token}
+    )
+    assert query is None
+    assert answer == "Wrong continuation token."
+
+
+def test_custom_query_is_paged_by_key_column():
+    request = {
+        "category": "custom",
+        "query": "SELECT id, name FROM actors;",
+        "key": "id",
+        "limit": 2,
+    }
+    req_man = RequestManager()
+    query, _ = req_man.get_query(request)
+    assert query.sql == (
+        'SELECT * FROM (SELECT id, name FROM actors) AS page ORDER BY page."id" LIMIT $1'
+    )
+    records = [{"id": 1}, {"id": 2}, {"id": 3}]
+    token = req_man.give_page(records, query, request)["next"]
+    query, _ = req_man.get_query({**request, "after": token})
+    assert 'WHERE page."id" > $1' in query.sql
+    assert query.args == (2, 3)
+
+
+def test_custom_query_without_key_column_is_truncated():
+    request = {"category": "custom", "query": "SELECT * FROM actors", "limit": 2}
+    req_man = RequestManager()
+    query, _ = req_man.get_query(request)
+    response = req_man.give_page([{"id": 1}, {"id": 2}, {"id": 3}], query, request)
+    assert response == {"answer": [{"id": 1}, {"id": 2}], "truncated": True}
+
+
+@pytest.mark.database
+def test_custom_query_is_read_only(req_man):
+    loop = asyncio.get_event_loop()
+    with pytest.raises(asyncpg.ReadOnlySQLTransactionError):
+        loop.run_until_complete(req_man.entrypoint("custom, DELETE FROM actors"))
+    loop.run_until_complete(req_man.close())
+
+
+def test_custom_page_size_is_limited_by_max_rows():
+    req_man = RequestManager(
+        custom_query_config={**CUSTOM_QUERY, "MAX_ROWS": 5},
+    )
+    query, _ = req_man.get_query(
+        {"category": "custom", "query": "SELECT * FROM actors", "limit": 100}
+    )
+    assert query.limit == 5
+
+
+def test_details_query_has_cast_size_and_crew_jobs():
+    query, answer = RequestManager().get_query(
+        {"category": "details", "query": "Heat", "limit": 5}
+    )
+    assert answer is None
+    assert query.statement == "details"
+    assert query.args[0] == "Heat"
+    assert query.args[2] == 6
+    assert query.args[3:] == (DETAILS["CAST_SIZE"], tuple(DETAILS["CREW_JOBS"]))
+    hash(query.args)
+
+
+def test_details_config_is_overridden():
+    req_man = RequestManager(details_config={"CAST_SIZE": 3, "CREW_JOBS": ["Director"]})
+    query, _ = req_man.get_query({"category": "details", "query": "Heat"})
+    assert query.args[3:] == (3, ("Director",))
+
+
+@pytest.mark.database
+def test_details_request(req_man):
+    loop = asyncio.get_event_loop()
+    response = loop.run_until_complete(req_man.entrypoint("details, Pulp Fiction"))
+    loop.run_until_complete(req_man.close())
+    [movie] = response["answer"]
+    assert movie["title"] == "Pulp Fiction"
+    assert "Quentin Tarantino" in {member["name"] for member in movie["crew"]}
+    assert 0 < len(movie["cast"]) <= DETAILS["CAST_SIZE"]
+    for name in ["genres", "production_companies", "spoken_languages", "keywords"]:
+        assert isinstance(movie[name], list)
+
+
+@pytest.mark.database
+def test_actor_view_matches_tables(req_man):
+    query = (
+        "custom, SELECT title FROM movies_metadata movies "
+        "INNER JOIN characters ON characters.movie_id = movies.id "
+        "INNER JOIN actors ON actors.id = characters.actor_id "
+        "WHERE actors.name = 'Janusz Gajos' ORDER BY characters.id"
+    )
+    loop = asyncio.get_event_loop()
+    from_view = loop.run_until_complete(req_man.entrypoint("actor, Janusz Gajos"))
+    from_tables = loop.run_until_complete(req_man.entrypoint(query))
+    loop.run_until_complete(req_man.close())
+    assert from_view == from_tables
@@ -0,0 +1,54 @@
+""" Provides tests for result_cache module. """
+
+import pytest
+import time
+
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def cache() -> ResultCache:
+    cache = ResultCache(max_entries=2, max_bytes=100, ttl=60.0)
+    cache.set_version(1)
+    return cache
+
+
+def test_least_recently_used_answer_is_evicted(cache):
+    cache.put(("actor", ("A",)), ["a"], 1)
+    cache.put(("actor", ("B",)), ["b"], 1)
+    assert cache.get(("actor", ("A",))) == ["a"]
+    cache.put(("actor", ("C",)), ["c"], 1)
+    assert cache.get(("actor", ("B",))) is None
+    assert cache.get(("actor", ("A",))) == ["a"]
+    assert cache.get(("actor", ("C",))) == ["c"]
+
+
+def test_byte_budget(cache):
+    cache.put("small", ["x" * 40], 1)
+    cache.put("large", ["x" * 200], 1)
+    assert cache.get("large") is None
+    cache.put("medium", ["x" * 60], 1)
+    assert cache.get("small") is None
+    assert cache.get("medium") == ["x" * 60]
+    assert cache.size <= cache.max_bytes
+
+
+def test_expired_answer_is_not_served(cache):
+    cache.ttl = 0.01
+    cache.put("key", [], 1)
+    assert cache.get("key") == []
+    time.sleep(0.02)
+    assert cache.get("key") is None
+    assert not cache.entries
+
+
+def test_data_version(cache):
+    cache.put("key", ["old"], 1)
+    cache.set_version(2)
+    assert cache.get("key") is None
+    # The answer read before the version changed is not cached
+    cache.put("key", ["old"], 1)
+    assert cache.get("key") is None
+    cache.set_version(None)
+    cache.put("key", ["new"], None)
+    assert cache.get("key") is None
@@ -0,0 +1,68 @@
+""" Provides tests for result_rows module. """
+
+import datetime
+import decimal
+import json
+import uuid
+
+from message_stream import encode_content, decode_content
+from result_rows import Rows, convert_records, format_date, to_json
+
+
+class Record(tuple):
+    """ Imitates asyncpg.Record: iterating gives values, keys() gives column names. """
+
+    columns = ("id", "title", "release_date")
+
+    def keys(self):
+        return self.columns
+
+
+def test_rows_are_converted_with_one_plan():
+    date = datetime.date(1995, 12, 15)
+    rows = convert_records(
+        [Record((1, "Heat", date)), Record((2, "Ronin", None)), Record((3, "X", date))]
+    )
+    assert rows.columns == ("id", "title", "release_date")
+    assert rows.rows == [
+        (1, "Heat", "15-Dec-1995"),
+        (2, "Ronin", None),
+        (3, "X", "15-Dec-1995"),
+    ]
+    assert format_date.cache_info().hits >= 1
+    assert convert_records([]) == []
+
+
+def test_rows_behave_like_records():
+    rows = Rows(("page_key", "title"), [(1, "Heat"), (2, "Ronin")])
+    assert rows == [{"page_key": 1, "title": "Heat"}, {"page_key": 2, "title": "Ronin"}]
+    assert len(rows) == 2
+    assert rows[-1]["page_key"] == 2
+    assert rows[:1].without_column("page_key") == [{"title": "Heat"}]
+    assert json.loads(json.dumps({"answer": rows}, default=to_json)) == {
+        "answer": rows.to_records()
+    }
+
+
+def test_rows_are_encoded_as_records_without_dicts():
+    rows = Rows(("id", "title"), [(1, "Heat"), (2, None)])
+    content = encode_content({"answer": rows}, "records", "utf-8")
+    assert content == encode_content({"answer": rows.to_records()}, "records", "utf-8")
+    assert decode_content(content, "records") == {"answer": rows.to_records()}
+
+
+def test_values_of_custom_queries_are_encoded_to_json():
+    row = {
+        "budget": decimal.Decimal("1.10"),
+        "created": datetime.datetime(1995, 12, 15, 20, 30),
+        "day": datetime.date(1995, 12, 15),
+        "runtime": datetime.timedelta(minutes=170),
+        "id": uuid.UUID(int=1),
+    }
+    assert json.loads(json.dumps(row, default=to_json)) == {
+        "budget": "1.10",
+        "created": "1995-12-15T20:30:00",
+        "day": "1995-12-15",
+        "runtime": 10200.0,
+        "id": "00000000-0000-0000-0000-000000000001",
+    }
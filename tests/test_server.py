@@ -3,8 +3,14 @@
 import pytest
 import asyncio
 import json
+import struct
 
 from async_client import AsyncClient
+from async_server import AsyncServer
+from message_stream import MessageStream
+from protocol_server import MessageProtocol
+from result_rows import Rows
+from tests.test_message_stream import FakeWriter, receive_all
 from tests.testing_data import valid_data, wrong_data
 from settings import SERVER
 
@@ -33,6 +39,7 @@ def test_server_with_valid_data(loop) -> None:
                 "Server is not running. Run app_server.py before start tests."
             )
         else:
+            assert header.pop("request_id")
             assert header == {
                 "content_type": "json",
                 "content_encoding": "utf-8",
@@ -60,3 +67,179 @@ def test_server_with_wrong_data(loop) -> None:
             raise ConnectionRefusedError(
                 "Server is not running. Run app_server.py before start tests."
             )
+
+
+@pytest.mark.database
+@pytest.mark.server
+def test_server_keeps_connection_alive(loop) -> None:
+    async_client = AsyncClient(SERVER["HOST"], SERVER["PORT"], loop=loop)
+    async_client.run_client(
+        valid_data[0]["message"], valid_data[0]["content_type"], "utf-8"
+    )
+    message = async_client.message
+    for data in valid_data:
+        header, result = async_client.run_client(
+            data["message"], data["content_type"], data["encoding"]
+        )
+        assert result == data["result"]
+    assert async_client.message is message
+    loop.run_until_complete(async_client.disconnect())
+    assert async_client.message is None
+
+
+@pytest.mark.database
+@pytest.mark.server
+def test_server_with_pipelined_requests(loop) -> None:
+    async_client = AsyncClient(SERVER["HOST"], SERVER["PORT"], loop=loop)
+    requests = [
+        (data["message"], data["content_type"], data["encoding"])
+        for data in valid_data * 5
+    ]
+    answers = async_client.run_many(requests)
+    assert [result for header, result in answers] == [
+        data["result"] for data in valid_data * 5
+    ]
+    assert len({header["request_id"] for header, result in answers}) == len(requests)
+    loop.run_until_complete(async_client.disconnect())
+
+
+@pytest.mark.database
+@pytest.mark.server
+def test_server_streams_answer_in_chunks(loop) -> None:
+    async_client = AsyncClient(SERVER["HOST"], SERVER["PORT"], loop=loop)
+    request = "custom, SELECT title FROM movies_metadata ORDER BY id LIMIT 25"
+    header, result = async_client.run_client(request, "text", "utf-8")
+
+    async def collect():
+        return [
+            chunk
+            async for chunk in async_client.stream(
+                request, "text", "utf-8", chunk_size=10
+            )
+        ]
+
+    chunks = loop.run_until_complete(collect())
+    assert [len(chunk["answer"]) for chunk in chunks] == [10, 10, 5]
+    assert [row for chunk in chunks for row in chunk["answer"]] == result["answer"]
+    loop.run_until_complete(async_client.disconnect())
+
+
+@pytest.mark.database
+@pytest.mark.server
+def test_server_cancels_request_after_deadline(loop) -> None:
+    async_client = AsyncClient(SERVER["HOST"], SERVER["PORT"], loop=loop, deadline=0.5)
+    header, result = async_client.run_client(
+        "custom, SELECT pg_sleep(10)", "text", "utf-8"
+    )
+    assert header["error"] == "timeout"
+    assert result == {"answer": "The request exceeded its deadline."}
+    loop.run_until_complete(async_client.disconnect())
+
+
+def test_batch_answer_is_sent_as_json_to_records_client(loop) -> None:
+    server = AsyncServer(SERVER["HOST"], SERVER["PORT"], loop=loop)
+    rows = Rows(("title",), [("Heat",), ("Ronin",)])
+    response = {"answer": [{"answer": rows}, {"answer": rows[:1]}]}
+    writer = FakeWriter()
+    message = MessageStream(asyncio.StreamReader(), writer)
+
+    async def run():
+        await server.send_answer(
+            message, {"accept": ["records"]}, response, {"request_id": 1}
+        )
+        return await receive_all(bytes(writer.data), 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["content_type"] == "json"
+    assert header["request_id"] == 1
+    assert content == {
+        "answer": [
+            {"answer": [{"title": "Heat"}, {"title": "Ronin"}]},
+            {"answer": [{"title": "Heat"}]},
+        ]
+    }
+
+
+@pytest.mark.parametrize(
+    "chunk_size, result", [(10, 10), (10 ** 9, 1000), (0, 100), (-5, 100), ("10", 100)]
+)
+def test_wrong_chunk_size_is_replaced_by_default(loop, chunk_size, result) -> None:
+    server = AsyncServer(
+        SERVER["HOST"], SERVER["PORT"], loop=loop, chunk_size=100, max_chunk_size=1000
+    )
+    assert server.get_chunk_size({"chunk_size": chunk_size}) == result
+
+
+@pytest.mark.parametrize("transport", ["streams", "protocol"])
+def test_shutdown_closes_keep_alive_connections(loop, transport) -> None:
+    server = AsyncServer("127.0.0.1", 0, loop=loop, transport=transport)
+
+    async def run():
+        if transport == "protocol":
+            listening = await loop.create_server(
+                lambda: MessageProtocol(server), "127.0.0.1", 0
+            )
+        else:
+            listening = await asyncio.start_server(
+                server.handle_connection, "127.0.0.1", 0
+            )
+        port = listening.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await asyncio.sleep(0.01)
+        open_connections = len(server.connections)
+        await asyncio.wait_for(server.shutdown(listening, 0.1), 5)
+        data = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return open_connections, data
+
+    assert loop.run_until_complete(run()) == (1, b"")
+    assert not server.connections
+
+
+class UnencodableAnswerServer(AsyncServer):
+    """ Answers every request with a value which can not be encoded. """
+
+    async def get_answer_from_db(self, request):
+        return self.req_man.give_response([{"value": object()}])
+
+
+def test_answer_which_can_not_be_encoded_gets_error(loop) -> None:
+    server = UnencodableAnswerServer(SERVER["HOST"], SERVER["PORT"], loop=loop)
+    writer = FakeWriter()
+    message = MessageStream(asyncio.StreamReader(), writer)
+
+    async def run():
+        await server.respond_single(message, {"request_id": 3}, "custom, SELECT 1")
+        return await receive_all(bytes(writer.data), 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["request_id"] == 3
+    assert header["error"] == "request_failed"
+    assert content == {"answer": "The answer can not be encoded."}
+
+
+@pytest.mark.parametrize("transport", ["streams", "protocol"])
+def test_invalid_header_is_answered_with_error(loop, transport) -> None:
+    server = AsyncServer("127.0.0.1", 0, loop=loop, transport=transport)
+    header = b'{"content_type": "text"}'
+
+    async def run():
+        if transport == "protocol":
+            listening = await loop.create_server(
+                lambda: MessageProtocol(server), "127.0.0.1", 0
+            )
+        else:
+            listening = await asyncio.start_server(
+                server.handle_connection, "127.0.0.1", 0
+            )
+        port = listening.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(struct.pack(">H", len(header)) + header + b"title, Heat")
+        data = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        listening.close()
+        return await receive_all(data, 1)
+
+    [(header, content)] = loop.run_until_complete(run())
+    assert header["error"] == "invalid_header"
+    assert content["answer"].startswith("The request header is invalid.")
@@ -0,0 +1,128 @@
+""" Provides tests for single_flight module. """
+
+import pytest
+import asyncio
+
+from single_flight import SingleFlight
+
+
+@pytest.fixture
+def loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_event_loop()
+
+
+class Query:
+    """ Counts runs and finishes when released. """
+
+    def __init__(self, result=None, error: Exception = None):
+        self.runs = 0
+        self.cancelled = False
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_identical_calls_share_one_run(loop):
+    single_flight = SingleFlight()
+    query = Query(result=["Heat"])
+
+    async def run():
+        calls = [
+            asyncio.ensure_future(single_flight.run("key", query)) for _ in range(5)
+        ]
+        await asyncio.sleep(0)
+        query.release.set()
+        return await asyncio.gather(*calls)
+
+    assert loop.run_until_complete(run()) == [["Heat"]] * 5
+    assert query.runs == 1
+    assert not single_flight.flights
+
+
+def test_error_is_raised_in_every_call(loop):
+    single_flight = SingleFlight()
+    query = Query(error=ValueError("failed"))
+
+    async def run():
+        calls = [
+            asyncio.ensure_future(single_flight.run("key", query)) for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        query.release.set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = loop.run_until_complete(run())
+    assert [str(result) for result in results] == ["failed"] * 3
+    assert query.runs == 1
+
+
+def test_cancelled_call_does_not_cancel_others(loop):
+    single_flight = SingleFlight()
+    query = Query(result=["Heat"])
+
+    async def run():
+        first = asyncio.ensure_future(single_flight.run("key", query))
+        second = asyncio.ensure_future(single_flight.run("key", query))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        query.release.set()
+        return first.cancelled(), await second
+
+    assert loop.run_until_complete(run()) == (True, ["Heat"])
+    assert not query.cancelled
+
+
+def test_run_is_cancelled_with_the_last_call(loop):
+    single_flight = SingleFlight()
+    query = Query()
+
+    async def run():
+        calls = [
+            asyncio.ensure_future(single_flight.run("key", query)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        for call in calls:
+            call.cancel()
+        await asyncio.sleep(0.01)
+
+    loop.run_until_complete(run())
+    assert query.cancelled
+    assert not single_flight.flights
+
+
+def test_call_after_cancelled_run_starts_new_run(loop):
+    single_flight = SingleFlight()
+    runs = []
+
+    async def query():
+        runs.append(len(runs))
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            # Releasing the connection takes a few iterations of the loop
+            await asyncio.sleep(0.01)
+            raise
+        return ["Heat"]
+
+    async def run():
+        first = asyncio.ensure_future(single_flight.run("key", query))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        return await single_flight.run("key", query)
+
+    assert loop.run_until_complete(run()) == ["Heat"]
+    assert runs == [0, 1]
+    assert not single_flight.flights
@@ -0,0 +1,43 @@
+""" Provides tests for supervisor module. """
+
+from supervisor import aggregate_stats
+
+
+def test_aggregate_stats():
+    stats = [
+        {
+            "db_pool": {"size": 5, "in_use": 1},
+            "compression": {"bytes_in": 100, "bytes_out": 20, "ratio": 0.2},
+        },
+        {
+            "db_pool": {"size": 7, "in_use": 0},
+            "compression": {"bytes_in": 300, "bytes_out": 180, "ratio": 0.6},
+        },
+        {"db_pool": {"size": 5, "in_use": 2}, "compression": {"ratio": 1.0}},
+    ]
+
+    assert aggregate_stats(stats) == {
+        "db_pool": {"size": 17, "in_use": 3},
+        "compression": {"bytes_in": 400, "bytes_out": 200, "ratio": 0.5},
+    }
+
+
+def test_versions_and_limits_are_not_summed():
+    stats = [
+        {
+            "result_cache": {"version": 3, "entries": 10},
+            "admission": {"max_in_flight": 100, "in_flight": 5},
+            "db_pool": {"max_size": 10, "size": 4},
+        },
+        {
+            "result_cache": {"version": 4, "entries": 2},
+            "admission": {"max_in_flight": 100, "in_flight": 1},
+            "db_pool": {"max_size": 10, "size": 6},
+        },
+    ]
+
+    assert aggregate_stats(stats) == {
+        "result_cache": {"version": 4, "entries": 12},
+        "admission": {"max_in_flight": 100, "in_flight": 6},
+        "db_pool": {"max_size": 10, "size": 10},
+    }
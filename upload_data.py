@@ -251,3 +251,6 @@ if __name__ == "__main__":
     engine = db_man.default_db_engine
     data = upload_csv("archive")
     open_session(engine, upload_data_to_db, data)
+    db_man.refresh_lookup_views()
+    # Servers drop answers cached from the previous data
+    db_man.bump_data_version()